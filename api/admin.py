@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-import aiosqlite
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Literal
 import asyncio
+import base64
 import httpx
 import json
 from fastapi.responses import StreamingResponse
@@ -9,10 +9,24 @@ from pydantic import BaseModel, Field
 import datetime
 from zoneinfo import ZoneInfo
 
-from api.database import key_manager, config_manager, DATABASE_URL
+from api.database import key_manager, config_manager, db_pool
 from api.security import security_service
-from api.utils import create_partial_key
+from api.utils import create_partial_key, split_access_keys
 from api.path_builder import build_upstream_url
+from api.config import WORKERS, KEY_SELECTION_STRATEGY, KEY_RATE_LIMITS, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_DISABLED_ACCESS_KEYS, SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_ALL_POSTS, EMBED_BATCH_ENABLED, EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_ITEMS, HEDGE_ENABLED, HEDGE_BUDGET_RATIO, HEDGE_DEFAULT_DELAY_MS, HEDGE_MIN_DELAY_MS
+from api.key_scheduler import parse_rate_limits
+from api.hedging import ttfb_tracker, hedge_budget
+from api.upstream import upstream_clients, load_upstream_settings
+from api.metadata_cache import metadata_cache, CachedResponse
+from api.response_cache import response_cache
+from api.embedding_cache import embedding_cache
+from api.single_flight import single_flight
+from api.embed_batcher import embed_batcher
+from api.exceptions import ServiceUnavailableError
+from api import rollups
+from api.live_stats import live_stats
+from api.dashboard_snapshot import dashboard_snapshot, dashboard_feed
+from api.retention import retention_engine
 
 # --- Pydantic 模型 ---
 class APIKeyInfo(BaseModel):
@@ -91,8 +105,9 @@ class ErrorLogEntry(BaseModel):
 
 class PaginatedErrorLogs(BaseModel):
     logs: List[ErrorLogEntry]
-    total_pages: int
-    current_page: int
+    next_cursor: str | None = Field(None, description="下一页的游标；没有更多记录时为空")
+    total_estimate: int = Field(..., description="符合条件的记录数（超过计数上限时为下限）")
+    total_is_exact: bool
 
 class RequestLogEntry(BaseModel):
     id: int
@@ -103,14 +118,53 @@ class RequestLogEntry(BaseModel):
 
 class PaginatedRequestLogs(BaseModel):
     logs: List[RequestLogEntry]
-    total_pages: int
-    current_page: int
+    next_cursor: str | None = Field(None, description="下一页的游标；没有更多记录时为空")
+    total_estimate: int = Field(..., description="符合条件的记录数（超过计数上限时为下限）")
+    total_is_exact: bool
 
 class ApiConfig(BaseModel):
     api_base_url: str | None = Field(None, description="Google Gemini API 的基础 URL")
     max_failure_count: int | None = Field(None, ge=1, le=100, description="密钥最大失败次数")
     max_retry_count: int | None = Field(None, ge=1, le=20, description="最大重试次数")
 
+class ModelRateLimit(BaseModel):
+    rpm: int | None = Field(None, ge=1, description="单个密钥每分钟请求数上限")
+    tpm: int | None = Field(None, ge=1, description="单个密钥每分钟 token 数上限")
+
+class KeySchedulerConfig(BaseModel):
+    strategy: Literal["round_robin", "quota"] = Field(..., description="密钥选择策略")
+    rate_limits: dict[str, ModelRateLimit] = Field(default_factory=dict, description="按模型的速率限制，'default' 适用于未单独配置的模型")
+
+class HedgingConfig(BaseModel):
+    enabled: bool = Field(..., description="是否对非流式 generateContent 启用对冲请求")
+    budget_ratio: float = Field(..., ge=0, le=1, description="每个访问密钥允许的对冲比例")
+    default_delay_ms: int = Field(..., ge=50, description="首字节时间样本不足时的对冲等待时间（毫秒）")
+    min_delay_ms: int = Field(..., ge=0, description="对冲等待时间下限（毫秒）")
+
+class UpstreamConfig(BaseModel):
+    http2: bool = Field(..., description="是否启用 HTTP/2 多路复用")
+    connect_timeout: float = Field(..., gt=0, description="建立连接超时（秒）")
+    read_timeout: float = Field(..., gt=0, description="读取超时（秒）")
+    pool_timeout: float = Field(..., gt=0, description="等待连接池空闲连接的超时（秒）")
+    keepalive_expiry: float = Field(..., ge=0, description="空闲 keepalive 连接保留时间（秒）")
+    stream_max_connections: int = Field(..., ge=1, description="流式连接池最大连接数")
+    stream_max_keepalive: int = Field(..., ge=0, description="流式连接池最大 keepalive 连接数")
+    unary_max_connections: int = Field(..., ge=1, description="非流式连接池最大连接数")
+    unary_max_keepalive: int = Field(..., ge=0, description="非流式连接池最大 keepalive 连接数")
+
+class ResponseCacheConfig(BaseModel):
+    enabled: bool = Field(..., description="是否缓存 temperature 为 0 的非流式 generateContent 响应")
+    disabled_access_keys: List[str] = Field(default_factory=list, description="不使用响应缓存的访问密钥")
+
+class SingleFlightConfig(BaseModel):
+    enabled: bool = Field(..., description="是否合并相同的进行中请求")
+    all_posts: bool = Field(..., description="是否同时合并非确定性的 POST 请求")
+
+class EmbedBatchingConfig(BaseModel):
+    enabled: bool = Field(..., description="是否将并发的 embedContent 合并为 batchEmbedContents")
+    window_ms: float = Field(..., gt=0, le=1000, description="攒批等待窗口（毫秒）")
+    max_items: int = Field(..., ge=1, le=100, description="单批最大条目数")
+
 class SchedulerConfig(BaseModel):
     validation_model: str
     validation_model_display_name: str | None = None
@@ -133,20 +187,37 @@ class DashboardData(BaseModel):
     config_keys: ConfigKeys
     trend_data: TrendData
 
+async def _invalidate_dashboard_on_write(request: Request):
+    """管理接口的写操作前后都使仪表盘快照失效，避免前端刷新时读到写入前的快照。"""
+    writes = request.method not in ("GET", "HEAD")
+    if writes:
+        dashboard_snapshot.invalidate()
+    yield
+    if writes:
+        dashboard_snapshot.invalidate()
+
 # --- API 路由 ---
 router = APIRouter(
     prefix="/admin",
     tags=["Admin"],
-    dependencies=[Depends(security_service.verify_admin_key_from_cookie)]
+    dependencies=[Depends(security_service.verify_admin_key_from_cookie), Depends(_invalidate_dashboard_on_write)]
 )
 
 @router.get("/dashboard-data", response_model=DashboardData)
-async def get_dashboard_data():
-    """获取仪表盘的所有数据，用于优化前端加载性能"""
+async def get_dashboard_data(request: Request):
+    """获取仪表盘的所有数据。所有管理会话共享定期重建的快照，内容未变化时返回 304。"""
+    snapshot = await dashboard_snapshot.get(_build_dashboard_body)
+    headers = {"ETag": snapshot.etag, "Cache-Control": "private, no-cache"}
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+async def _build_dashboard_body() -> bytes:
+    """内部函数：计算仪表盘快照的响应体"""
     # 使用 asyncio.gather 并发执行所有数据获取任务
     results = await asyncio.gather(
         get_access_keys(),
-        get_error_logs(page=1, size=50), # 获取第一页的错误日志
+        get_error_logs(size=50), # 获取第一页的错误日志
         get_api_config(),
         get_scheduler_config(),
         get_config_keys(),
@@ -167,18 +238,55 @@ async def get_dashboard_data():
         scheduler_config=scheduler_config,
         config_keys=config_keys,
         trend_data=trend_data
-    )
+    ).model_dump_json().encode()
+
+async def _collect_dashboard_state() -> dict:
+    """内部函数：采集仪表盘增量推送所需的统计与密钥状态（last_used 不在页面上展示，不参与比较）"""
+    stats = await get_admin_stats_internal()
+    return {
+        "stats": stats.model_dump(),
+        "keys": {state.id: _key_info(state).model_dump(exclude={"last_used"}) for state in key_manager.list_states()},
+    }
+
+dashboard_feed.set_collector(_collect_dashboard_state)
+
+# SSE 心跳间隔（秒），同时用于发现因消费过慢被断开的订阅
+DASHBOARD_STREAM_HEARTBEAT_SECONDS = 15
+
+@router.get("/dashboard/stream")
+async def stream_dashboard_updates():
+    """通过 SSE 推送仪表盘的增量：变化的统计分组、状态变化的密钥与被删除的密钥 ID。"""
+    async def event_generator():
+        queue = dashboard_feed.subscribe()
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=DASHBOARD_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if not dashboard_feed.is_subscribed(queue):
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if delta is None:
+                    return
+                yield f"data: {json.dumps(delta)}\n\n"
+        finally:
+            dashboard_feed.unsubscribe(queue)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/dashboard/stats")
+async def get_dashboard_cache_stats():
+    """仪表盘快照与增量推送的运行统计"""
+    return {"snapshot": dashboard_snapshot.stats(), "stream": dashboard_feed.stats()}
 
 async def get_admin_stats_internal():
     """内部函数：获取仪表盘的统计数据"""
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        # Key Stats
-        cursor = await db.execute("SELECT COUNT(*), SUM(CASE WHEN is_valid = 1 THEN 1 ELSE 0 END) FROM api_keys")
-        total, valid = await cursor.fetchone()
-        total = total or 0
-        valid = valid or 0
-        key_stats = KeyStats(total_keys=total, valid_keys=valid, invalid_keys=total - valid)
+    # Key Stats (直接读取 KeyManager 的内存状态表)
+    total, valid = key_manager.count_keys()
+    key_stats = KeyStats(total_keys=total, valid_keys=valid, invalid_keys=total - valid)
 
+    async with db_pool.reader() as db:
         # Call Stats
         # 统一使用上海时区作为所有统计的基准时间，以确保数据一致性
         now = datetime.datetime.now(ZoneInfo("Asia/Shanghai"))
@@ -189,23 +297,15 @@ async def get_admin_stats_internal():
         this_month_row = await cursor.fetchone()
         this_month_calls = this_month_row[0] if this_month_row else 0
 
-        # 2. 获取短期调用次数 (直接从数据库 COUNT)
-        # 使用参数化查询以防止 SQL 注入
-        query = """
-            SELECT
-                (SELECT COUNT(*) FROM api_call_history WHERE timestamp > ?),
-                (SELECT COUNT(*) FROM api_call_history WHERE timestamp > ?),
-                (SELECT COUNT(*) FROM api_call_history WHERE timestamp > ?)
-        """
-        # 将带时区的 datetime 对象转换为 UTC 时间戳字符串，以便与数据库中的 UTC 时间进行比较
-        utc_now = now.astimezone(datetime.timezone.utc)
-        params = (
-            utc_now - datetime.timedelta(minutes=1),
-            utc_now - datetime.timedelta(hours=1),
-            utc_now - datetime.timedelta(days=1)
-        )
-        cursor = await db.execute(query, params)
-        last_minute, last_hour, last_24_hours = await cursor.fetchone()
+        # 2. 获取短期调用次数：单进程时读取内存滑动窗口；多进程时各进程只看到自己的调用，改为读取汇总表
+        if WORKERS == 1:
+            live = live_stats.counts()
+            last_minute, last_hour, last_24_hours = live["last_minute"], live["last_hour"], live["last_24_hours"]
+        else:
+            last_minute, last_hour, last_24_hours = [
+                sum(count for _, count in await rollups.count_since(db, now - window))
+                for window in (datetime.timedelta(minutes=1), datetime.timedelta(hours=1), datetime.timedelta(days=1))
+            ]
 
         call_stats = CallStats(
             last_minute=last_minute,
@@ -217,20 +317,17 @@ async def get_admin_stats_internal():
     return AdminStats(key_stats=key_stats, call_stats=call_stats)
 
 async def get_all_keys_internal():
-    """内部函数：获取所有 API 密钥的脱敏信息"""
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        cursor = await db.execute("SELECT id, key, is_valid, failure_count, last_used FROM api_keys ORDER BY id ASC")
-        rows = await cursor.fetchall()
-        
-        return [
-            APIKeyInfo(
-                id=r[0],
-                key_partial=create_partial_key(r[1]),
-                is_valid=r[2],
-                failure_count=r[3],
-                last_used=r[4]
-            ) for r in rows
-        ]
+    """内部函数：获取所有 API 密钥的脱敏信息（读取 KeyManager 的内存状态表）"""
+    return [_key_info(state) for state in key_manager.list_states()]
+
+def _key_info(state) -> APIKeyInfo:
+    return APIKeyInfo(
+        id=state.id,
+        key_partial=create_partial_key(state.key),
+        is_valid=state.is_valid,
+        failure_count=state.failure_count,
+        last_used=state.last_used
+    )
 
 @router.post("/keys/batch-add", response_model=BatchAddResponse)
 async def batch_add_keys(payload: BatchNewKeys):
@@ -238,19 +335,13 @@ async def batch_add_keys(payload: BatchNewKeys):
     if not payload.keys:
         return BatchAddResponse(message="No keys provided.", added_count=0)
 
-    # 1. 获取数据库中所有现存的密钥
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        cursor = await db.execute("SELECT key FROM api_keys")
-        rows = await cursor.fetchall()
-        existing_keys = {row[0] for row in rows}
-
-    # 2. 去重并过滤掉已经存在的密钥
+    # 1. 去重并过滤掉已经存在的密钥（以 KeyManager 的内存状态表为准）
     unique_inputs = {key.strip() for key in payload.keys if key.strip()}
-    new_keys_to_add = [key for key in unique_inputs if key not in existing_keys]
+    new_keys_to_add = [key for key in unique_inputs if key_manager.get_state(key) is None]
     
     added_count = len(new_keys_to_add)
 
-    # 3. 只添加真正新的密钥
+    # 2. 只添加真正新的密钥
     if not new_keys_to_add:
         return BatchAddResponse(message="No new keys to add.", added_count=0)
 
@@ -265,7 +356,7 @@ async def reveal_keys(payload: BatchKeyIDs):
     if not payload.key_ids:
         return RevealedKeysResponse(revealed_keys={})
     
-    async with aiosqlite.connect(DATABASE_URL) as db:
+    async with db_pool.reader() as db:
         placeholders = ','.join('?' for _ in payload.key_ids)
         cursor = await db.execute(f"SELECT id, key FROM api_keys WHERE id IN ({placeholders})", payload.key_ids)
         rows = await cursor.fetchall()
@@ -276,18 +367,9 @@ async def get_key_call_details(key_id: int):
     """获取单个密钥在过去24小时内按模型分组的总调用详情"""
     day_ago = (datetime.datetime.now(ZoneInfo("Asia/Shanghai")) - datetime.timedelta(days=1)).astimezone(datetime.timezone.utc)
     
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        cursor = await db.execute(
-            """
-            SELECT model_name, COUNT(*)
-            FROM api_call_history
-            WHERE key_id = ? AND timestamp > ? AND model_name IS NOT NULL
-            GROUP BY model_name
-            ORDER BY COUNT(*) DESC
-            """,
-            (key_id, day_ago)
-        )
-        rows = await cursor.fetchall()
+    async with db_pool.reader() as db:
+        rows = await rollups.count_since(db, day_ago, key_id=key_id)
+    rows.sort(key=lambda row: row[1], reverse=True)
 
     response = [
         ModelCallDetail(
@@ -316,19 +398,29 @@ async def get_stats_trend_internal(days: int) -> TrendData:
         time_unit = 'days'
         range_count = days
 
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        cursor = await db.execute(
-            """
-            SELECT
-              strftime(?, timestamp, '+8 hours') as time_group, -- Convert to Shanghai time for grouping
-              model_name,
-              COUNT(*) as call_count
-            FROM api_call_history
-            WHERE timestamp >= ? AND model_name IS NOT NULL
-            GROUP BY time_group, model_name
-            """,
-            (group_format, start_time_utc)
-        )
+    async with db_pool.reader() as db:
+        if time_unit == 'hours':
+            # 小时汇总的桶为 UTC 整点，转换为上海时间后分组
+            cursor = await db.execute(
+                f"""
+                SELECT strftime(?, bucket, '+8 hours') as time_group, model_name, SUM(call_count)
+                FROM {rollups.HOUR_TABLE}
+                WHERE bucket >= ?
+                GROUP BY time_group, model_name
+                """,
+                (group_format, rollups.hour_bucket(start_time_utc.strftime('%Y-%m-%d %H:%M:%S')))
+            )
+        else:
+            # 日汇总的桶本身就是上海时区的日期
+            cursor = await db.execute(
+                f"""
+                SELECT bucket as time_group, model_name, SUM(call_count)
+                FROM {rollups.DAY_TABLE}
+                WHERE bucket >= ?
+                GROUP BY time_group, model_name
+                """,
+                ((end_time_shanghai - datetime.timedelta(days=range_count - 1)).strftime('%Y-%m-%d'),)
+            )
         rows = await cursor.fetchall()
 
     # --- 数据透视 ---
@@ -378,9 +470,7 @@ async def get_stats_trend(range: str = "7d"):
 @router.delete("/keys/{key_id}", status_code=204)
 async def delete_key(key_id: int):
     """删除一个 API 密钥"""
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        await db.execute("DELETE FROM api_keys WHERE id = ?", (key_id,))
-        await db.commit()
+    await key_manager.delete_keys([key_id])
     return None
 
 @router.post("/keys/batch-delete", response_model=BatchDeleteResponse)
@@ -389,12 +479,7 @@ async def batch_delete_keys(payload: BatchKeyIDs):
     if not payload.key_ids:
         return BatchDeleteResponse(message="No keys provided.", deleted_count=0)
         
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        placeholders = ','.join('?' for _ in payload.key_ids)
-        cursor = await db.execute(f"DELETE FROM api_keys WHERE id IN ({placeholders})", payload.key_ids)
-        await db.commit()
-        deleted_count = cursor.rowcount
-        
+    deleted_count = await key_manager.delete_keys(payload.key_ids)
     return BatchDeleteResponse(message=f"Successfully deleted {deleted_count} keys.", deleted_count=deleted_count)
 
 @router.post("/keys/batch-delete-by-value")
@@ -403,12 +488,7 @@ async def batch_delete_keys_by_value(payload: BatchDeleteByValue):
     if not payload.keys:
         raise HTTPException(status_code=400, detail="Key list cannot be empty.")
     
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        placeholders = ','.join('?' for _ in payload.keys)
-        cursor = await db.execute(f"DELETE FROM api_keys WHERE key IN ({placeholders})", payload.keys)
-        await db.commit()
-        deleted_count = cursor.rowcount
-    
+    deleted_count = await key_manager.delete_keys_by_value(payload.keys)
     return {"message": f"Successfully deleted {deleted_count} keys.", "deleted_count": deleted_count}
 
 @router.post("/keys/batch-deactivate", status_code=204)
@@ -416,10 +496,7 @@ async def batch_deactivate_keys(payload: BatchKeyIDs):
     """批量禁用密钥"""
     if not payload.key_ids:
         return
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        placeholders = ','.join('?' for _ in payload.key_ids)
-        await db.execute(f"UPDATE api_keys SET is_valid = 0 WHERE id IN ({placeholders})", payload.key_ids)
-        await db.commit()
+    await key_manager.set_keys_valid(payload.key_ids, False)
     return None
 
 @router.post("/keys/batch-reset", status_code=204)
@@ -427,39 +504,21 @@ async def batch_reset_keys(payload: BatchKeyIDs):
     """批量重置密钥（设为有效，失败计数清零）"""
     if not payload.key_ids:
         return
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        placeholders = ','.join('?' for _ in payload.key_ids)
-        await db.execute(f"UPDATE api_keys SET is_valid = 1, failure_count = 0 WHERE id IN ({placeholders})", payload.key_ids)
-        await db.commit()
+    await key_manager.set_keys_valid(payload.key_ids, True, reset_failures=True)
     return None
 
 @router.put("/keys/{key_id}/status", response_model=APIKeyInfo)
 async def toggle_key_status(key_id: int):
     """手动切换一个密钥的 is_valid 状态"""
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        # First, get the current status
-        cursor = await db.execute("SELECT is_valid FROM api_keys WHERE id = ?", (key_id,))
-        row = await cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Key not found.")
-        
-        new_status = not row[0]
-        await db.execute("UPDATE api_keys SET is_valid = ? WHERE id = ?", (new_status, key_id))
-        await db.commit()
-    
+    # First, get the current status
+    state = key_manager.get_state_by_id(key_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Key not found.")
+
+    await key_manager.set_keys_valid([key_id], not state.is_valid)
 
     # Return the updated key
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        cursor = await db.execute("SELECT id, key, is_valid, failure_count, last_used FROM api_keys WHERE id = ?", (key_id,))
-        updated_row = await cursor.fetchone()
-        
-    return APIKeyInfo(
-        id=updated_row[0],
-        key_partial=create_partial_key(updated_row[1]),
-        is_valid=updated_row[2],
-        failure_count=updated_row[3],
-        last_used=updated_row[4]
-    )
+    return _key_info(state)
 
 async def validate_gemini_key(client: httpx.AsyncClient, key: str, model: str) -> tuple[bool, int, str]:
     """
@@ -523,7 +582,7 @@ async def batch_validate_keys_stream(key_ids: str):
             batch_size = 10
             validation_model_name = await config_manager.get_config("VALIDATION_MODEL") or "gemini-1.5-flash-latest"
 
-            async with aiosqlite.connect(DATABASE_URL) as db:
+            async with db_pool.reader() as db:
                 placeholders = ','.join('?' for _ in key_ids_list)
                 cursor = await db.execute(f"SELECT id, key FROM api_keys WHERE id IN ({placeholders})", key_ids_list)
                 keys_to_validate = await cursor.fetchall()
@@ -541,6 +600,8 @@ async def batch_validate_keys_stream(key_ids: str):
                     for (_, key_value), (is_valid, status_code, message) in zip(batch, results):
                         if is_valid:
                             await key_manager.record_success(key_value, validation_model_name)
+                        elif status_code == 429:
+                            await key_manager.record_rate_limited(key_value, validation_model_name, None, message)
                         else:
                             await key_manager.record_failure(key_value, validation_model_name, status_code, message)
                     
@@ -554,6 +615,8 @@ async def batch_validate_keys_stream(key_ids: str):
                     }
                     yield f"data: {json.dumps(progress_data)}\n\n"
             
+            # 验证改变了密钥状态，前端随后会刷新仪表盘
+            dashboard_snapshot.invalidate()
             # 发送完成事件
             done_data = {"status": "done", "message": "密钥验证完成。"}
             yield f"data: {json.dumps(done_data)}\n\n"
@@ -574,7 +637,7 @@ async def batch_validate_keys(payload: BatchKeyIDs):
     batch_size = 10
     validation_model_name = await config_manager.get_config("VALIDATION_MODEL") or "gemini-2.5-flash-lite"
 
-    async with aiosqlite.connect(DATABASE_URL) as db:
+    async with db_pool.reader() as db:
         placeholders = ','.join('?' for _ in payload.key_ids)
         cursor = await db.execute(f"SELECT id, key FROM api_keys WHERE id IN ({placeholders})", payload.key_ids)
         keys_to_validate = await cursor.fetchall()
@@ -589,6 +652,8 @@ async def batch_validate_keys(payload: BatchKeyIDs):
             for (_, key_value), (is_valid, status_code, message) in zip(batch, results):
                 if is_valid:
                     await key_manager.record_success(key_value, validation_model_name)
+                elif status_code == 429:
+                    await key_manager.record_rate_limited(key_value, validation_model_name, None, message)
                 else:
                     await key_manager.record_failure(key_value, validation_model_name, status_code, message)
             
@@ -621,7 +686,7 @@ async def set_admin_key(payload: NewAdminKey):
     if not payload.key:
         raise HTTPException(status_code=400, detail="密钥不能为空。")
         
-    async with aiosqlite.connect(DATABASE_URL) as db:
+    async with db_pool.writer() as db:
         async with db.execute("BEGIN"):
             # 1. 更新管理员密钥
             await db.execute(
@@ -631,7 +696,8 @@ async def set_admin_key(payload: NewAdminKey):
             # 2. 清除所有现有会话
             await db.execute("DELETE FROM admin_sessions")
         await db.commit()
-        
+    config_manager.update_cache("ADMIN_KEY", payload.key)
+
     return {"message": "Admin key updated successfully. All active sessions have been logged out."}
 
 @router.get("/config/api", response_model=ApiConfig)
@@ -659,6 +725,69 @@ async def set_api_config(payload: ApiConfig):
         
     return {"message": "API configuration updated successfully."}
 
+@router.get("/config/key-scheduler", response_model=KeySchedulerConfig)
+async def get_key_scheduler_config():
+    """获取密钥选择策略与按模型的速率限制"""
+    strategy = await config_manager.get_config("KEY_SELECTION_STRATEGY") or KEY_SELECTION_STRATEGY
+    limits = parse_rate_limits(await config_manager.get_config("KEY_RATE_LIMITS") or KEY_RATE_LIMITS)
+    return KeySchedulerConfig(
+        strategy=strategy if strategy in ("round_robin", "quota") else "round_robin",
+        rate_limits={model: ModelRateLimit(rpm=rpm, tpm=tpm) for model, (rpm, tpm) in limits.items()}
+    )
+
+@router.post("/config/key-scheduler")
+async def set_key_scheduler_config(payload: KeySchedulerConfig):
+    """设置密钥选择策略与按模型的速率限制"""
+    rate_limits = {model: limit.model_dump(exclude_none=True) for model, limit in payload.rate_limits.items()}
+    await config_manager.set_config("KEY_SELECTION_STRATEGY", payload.strategy)
+    await config_manager.set_config("KEY_RATE_LIMITS", json.dumps(rate_limits))
+    return {"message": "Key scheduler configuration updated successfully."}
+
+@router.get("/config/hedging", response_model=HedgingConfig)
+async def get_hedging_config():
+    """获取对冲请求配置"""
+    enabled = await config_manager.get_config("HEDGE_ENABLED")
+    return HedgingConfig(
+        enabled=HEDGE_ENABLED if enabled is None else enabled == "true",
+        budget_ratio=float(await config_manager.get_config("HEDGE_BUDGET_RATIO") or HEDGE_BUDGET_RATIO),
+        default_delay_ms=int(await config_manager.get_config("HEDGE_DEFAULT_DELAY_MS") or HEDGE_DEFAULT_DELAY_MS),
+        min_delay_ms=int(await config_manager.get_config("HEDGE_MIN_DELAY_MS") or HEDGE_MIN_DELAY_MS),
+    )
+
+@router.post("/config/hedging")
+async def set_hedging_config(payload: HedgingConfig):
+    """设置对冲请求配置"""
+    await config_manager.set_config("HEDGE_ENABLED", "true" if payload.enabled else "false")
+    await config_manager.set_config("HEDGE_BUDGET_RATIO", str(payload.budget_ratio))
+    await config_manager.set_config("HEDGE_DEFAULT_DELAY_MS", str(payload.default_delay_ms))
+    await config_manager.set_config("HEDGE_MIN_DELAY_MS", str(payload.min_delay_ms))
+    return {"message": "Hedging configuration updated successfully."}
+
+@router.get("/hedging/stats")
+async def get_hedging_stats():
+    """获取对冲请求统计与各模型的首字节时间 p95"""
+    return {**hedge_budget.stats(), "models": ttfb_tracker.snapshot()}
+
+@router.get("/config/upstream", response_model=UpstreamConfig)
+async def get_upstream_config():
+    """获取上游 HTTP 传输配置"""
+    await config_manager.get_config("UPSTREAM_HTTP2")  # 确保配置缓存已加载
+    return UpstreamConfig(**load_upstream_settings())
+
+@router.post("/config/upstream")
+async def set_upstream_config(payload: UpstreamConfig):
+    """设置上游 HTTP 传输配置，并在不中断在途请求的情况下重建连接池"""
+    for field, value in payload.model_dump().items():
+        stored = ("true" if value else "false") if isinstance(value, bool) else str(value)
+        await config_manager.set_config(f"UPSTREAM_{field.upper()}", stored)
+    await upstream_clients.reconfigure()
+    return {"message": "Upstream configuration updated successfully."}
+
+@router.get("/upstream/stats")
+async def get_upstream_stats():
+    """获取上游连接池的占用与饱和统计"""
+    return upstream_clients.stats()
+
 # --- ACCESS_KEY 管理 ---
 
 class DeleteAccessKey(BaseModel):
@@ -667,10 +796,7 @@ class DeleteAccessKey(BaseModel):
 @router.get("/access-keys", response_model=List[str])
 async def get_access_keys():
     """获取所有当前的 ACCESS_KEY"""
-    access_key_str = await config_manager.get_config("ACCESS_KEY")
-    if not access_key_str:
-        return []
-    return [key.strip() for key in access_key_str.split(',') if key.strip()]
+    return split_access_keys(await config_manager.get_config("ACCESS_KEY"))
 
 @router.post("/access-keys", status_code=201)
 async def add_access_key(payload: NewAccessKey):
@@ -678,8 +804,7 @@ async def add_access_key(payload: NewAccessKey):
     if not payload.key:
         raise HTTPException(status_code=400, detail="Key cannot be empty.")
     
-    access_key_str = await config_manager.get_config("ACCESS_KEY")
-    access_keys = [key.strip() for key in access_key_str.split(',') if key.strip()]
+    access_keys = split_access_keys(await config_manager.get_config("ACCESS_KEY"))
     
     if payload.key in access_keys:
         raise HTTPException(status_code=409, detail="访问密钥已存在。")
@@ -695,8 +820,7 @@ async def delete_access_key(payload: DeleteAccessKey):
     if not payload.key:
         raise HTTPException(status_code=400, detail="Key cannot be empty.")
 
-    access_key_str = await config_manager.get_config("ACCESS_KEY")
-    access_keys = [key.strip() for key in access_key_str.split(',') if key.strip()]
+    access_keys = split_access_keys(await config_manager.get_config("ACCESS_KEY"))
     
     if payload.key not in access_keys:
         raise HTTPException(status_code=404, detail="Access key not found.")
@@ -709,123 +833,144 @@ async def delete_access_key(payload: DeleteAccessKey):
 @router.delete("/error-logs", status_code=204)
 async def clear_all_error_logs():
     """清除所有错误日志记录"""
-    async with aiosqlite.connect(DATABASE_URL) as db:
+    async with db_pool.writer() as db:
         await db.execute("DELETE FROM error_logs")
         await db.commit()
     return None
 
-@router.get("/error-logs", response_model=PaginatedErrorLogs)
-async def get_error_logs(page: int = 1, size: int = 30):
-    """获取分页的错误日志"""
-    if page < 1: page = 1
-    if not 1 <= size <= 50: size = 50
-    offset = (page - 1) * size
-
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        # Get total count for pagination
-        count_cursor = await db.execute("SELECT COUNT(*) FROM error_logs")
-        total_count = (await count_cursor.fetchone())[0]
-        total_pages = (total_count + size - 1) // size
-
-        # Get paginated logs
-        cursor = await db.execute("""
-            SELECT e.id, a.key, e.model_name, e.identification_code, e.error_message, e.timestamp
-            FROM error_logs e
-            JOIN api_keys a ON e.key_id = a.id
-            ORDER BY e.timestamp DESC
-            LIMIT ? OFFSET ?
-        """, (size, offset))
-        rows = await cursor.fetchall()
+# 日志浏览的计数上限：超过后只返回下限，避免在大表上做全量 COUNT(*)
+LOG_COUNT_CAP = 10000
+
+def _encode_log_cursor(timestamp: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode().rstrip("=")
+
+def _decode_log_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def _utc_text(moment: datetime.datetime) -> str:
+    """将查询参数中的时间转换为与数据库一致的 UTC 字符串（无时区时按 UTC 处理）。"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+async def _browse_logs(table: str, columns: str, size: int, cursor: str | None, key_id: int | None, model: str | None,
+                       status_code: int | None, since: datetime.datetime | None, until: datetime.datetime | None):
+    """
+    按 (timestamp, id) 倒序的游标分页：每页都从索引上的游标位置开始读取 size 行，翻到多深都与第一页一样快。
+    返回 (当前页的行, 下一页游标, 计数, 计数是否精确)；每行的前两列固定为 id 与 key_id，最后一列为 timestamp。
+    """
+    conditions, params = [], []
+    if key_id is not None:
+        conditions.append("key_id = ?")
+        params.append(key_id)
+    if model:
+        conditions.append("model_name = ?")
+        params.append(model)
+    if status_code is not None:
+        conditions.append("identification_code = ?")
+        params.append(status_code)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(_utc_text(since))
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(_utc_text(until))
+    filters = " AND ".join(conditions) or "1"
+
+    page_conditions, page_params = filters, list(params)
+    if cursor:
+        page_conditions += " AND (timestamp, id) < (?, ?)"
+        page_params.extend(_decode_log_cursor(cursor))
+
+    async with db_pool.reader() as db:
+        page_cursor = await db.execute(
+            f"SELECT {columns} FROM {table} WHERE {page_conditions} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (*page_params, size + 1)
+        )
+        rows = await page_cursor.fetchall()
+        count_cursor = await db.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {filters} LIMIT ?)", (*params, LOG_COUNT_CAP + 1)
+        )
+        total = (await count_cursor.fetchone())[0]
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = _encode_log_cursor(rows[-1][-1], rows[-1][0])
+    return rows, next_cursor, min(total, LOG_COUNT_CAP), total <= LOG_COUNT_CAP
+
+def _log_key_partial(key_id: int) -> str:
+    """从内存密钥表解析脱敏密钥，避免为每页日志联表查询 api_keys。"""
+    state = key_manager.get_state_by_id(key_id)
+    return create_partial_key(state.key) if state is not None else "Deleted key"
 
+@router.get("/error-logs", response_model=PaginatedErrorLogs)
+async def get_error_logs(size: int = Query(30, ge=1, le=50), cursor: str | None = None, key_id: int | None = None, model: str | None = None,
+                         status_code: int | None = None, since: datetime.datetime | None = None, until: datetime.datetime | None = None):
+    """按游标分页获取错误日志，支持按密钥、模型、状态码与时间范围筛选"""
+    rows, next_cursor, total, exact = await _browse_logs(
+        "error_logs", "id, key_id, model_name, identification_code, error_message, timestamp",
+        size, cursor, key_id, model, status_code, since, until
+    )
     logs = [
         ErrorLogEntry(
             id=row[0],
-            key_partial=create_partial_key(row[1]),
+            key_partial=_log_key_partial(row[1]),
             model_name=row[2],
             identification_code=row[3],
             error_message=row[4],
             timestamp=row[5]
         ) for row in rows
     ]
-
-    return PaginatedErrorLogs(
-        logs=logs,
-        total_pages=total_pages,
-        current_page=page
-    )
+    return PaginatedErrorLogs(logs=logs, next_cursor=next_cursor, total_estimate=total, total_is_exact=exact)
 
 @router.get("/request-logs", response_model=PaginatedRequestLogs)
-async def get_request_logs(page: int = 1, size: int = 30):
-    """获取分页的全部请求日志"""
-    if page < 1: page = 1
-    if not 1 <= size <= 50: size = 50
-    offset = (page - 1) * size
-
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        # Get total count for pagination
-        count_cursor = await db.execute("SELECT COUNT(*) FROM api_call_history")
-        total_count = (await count_cursor.fetchone())[0]
-        total_pages = (total_count + size - 1) // size
-
-        # Get paginated logs
-        cursor = await db.execute("""
-            SELECT h.id, a.key, h.model_name, h.timestamp, h.identification_code
-            FROM api_call_history h
-            JOIN api_keys a ON h.key_id = a.id
-            ORDER BY h.timestamp DESC
-            LIMIT ? OFFSET ?
-        """, (size, offset))
-        rows = await cursor.fetchall()
-
+async def get_request_logs(size: int = Query(30, ge=1, le=50), cursor: str | None = None, key_id: int | None = None, model: str | None = None,
+                           status_code: int | None = None, since: datetime.datetime | None = None, until: datetime.datetime | None = None):
+    """按游标分页获取全部请求日志，支持按密钥、模型、状态码与时间范围筛选"""
+    rows, next_cursor, total, exact = await _browse_logs(
+        "api_call_history", "id, key_id, model_name, identification_code, timestamp",
+        size, cursor, key_id, model, status_code, since, until
+    )
     logs = [
         RequestLogEntry(
             id=row[0],
-            key_partial=create_partial_key(row[1]),
+            key_partial=_log_key_partial(row[1]),
             model_name=row[2],
-            identification_code=row[4],
-            timestamp=row[3]
+            identification_code=row[3],
+            timestamp=row[4]
         ) for row in rows
     ]
+    return PaginatedRequestLogs(logs=logs, next_cursor=next_cursor, total_estimate=total, total_is_exact=exact)
 
-    return PaginatedRequestLogs(
-        logs=logs,
-        total_pages=total_pages,
-        current_page=page
-    )
-
-@router.get("/available-models", response_model=List[AvailableModel])
-async def get_available_models():
-    """从 Google API 获取可用的模型列表。如果失败则返回空列表。"""
+async def _load_models_list() -> CachedResponse:
+    """使用可用密钥从上游获取模型列表，遇到失败的密钥自动轮换。"""
     max_retries = 5
     for attempt in range(max_retries):
-        try:
-            api_key = await key_manager.get_key()
-        except Exception:
-            # 没有可用密钥或全部失败
-            return []
+        api_key = await key_manager.get_key()  # 没有可用密钥时直接抛出
 
         url = await build_upstream_url("models")
         url += f"?key={api_key}"
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=15)
-                if response.status_code == 200:
-                    data = response.json()
-                    models = [
-                        AvailableModel(name=m.get('name', '').replace('models/', ''), displayName=m.get('displayName', ''))
-                        for m in data.get('models', [])
-                        if 'generateContent' in m.get('supportedGenerationMethods', []) and 'token' not in m.get('name', '').lower()
-                    ]
-                    return sorted(models, key=lambda x: x.displayName)
-                else:
-                    # Key failed, record it and loop to try another one.
-                    await key_manager.record_failure(
-                        key=api_key,
-                        model_name="model-discovery",
-                        status_code=response.status_code,
-                        error_message=response.text
-                    )
+            response = await upstream_clients.client_for(False).get(url, timeout=15)
+            if response.status_code == 200:
+                return CachedResponse(200, response.content, {"content-type": response.headers.get("content-type", "application/json")})
+            elif response.status_code == 429:
+                # Rate limited: quarantine the key without counting a failure.
+                await key_manager.record_rate_limited(api_key, "model-discovery", None, response.text)
+            else:
+                # Key failed, record it and loop to try another one.
+                await key_manager.record_failure(
+                    key=api_key,
+                    model_name="model-discovery",
+                    status_code=response.status_code,
+                    error_message=response.text
+                )
         except Exception as e:
             # Network error or timeout, record failure and loop to try another key.
             await key_manager.record_failure(
@@ -834,10 +979,158 @@ async def get_available_models():
                 status_code=500,
                 error_message=str(e)
             )
-    
-    # If all retries fail, return an empty list.
-    return []
+        finally:
+            key_manager.release_key(api_key)
+
+    raise ServiceUnavailableError(detail=f"Failed to fetch the model list after {max_retries} attempts.")
+
+@router.get("/available-models", response_model=List[AvailableModel])
+async def get_available_models():
+    """从 Google API 获取可用的模型列表（经元数据缓存，与代理的 GET v1beta/models 共享）。如果失败则返回空列表。"""
+    try:
+        entry, _ = await metadata_cache.fetch(metadata_cache.make_key("v1beta/models", {}), _load_models_list)
+        data = json.loads(entry.content)
+    except Exception:
+        # 没有可用密钥或全部失败
+        return []
+
+    models = [
+        AvailableModel(name=m.get('name', '').replace('models/', ''), displayName=m.get('displayName', ''))
+        for m in data.get('models', [])
+        if 'generateContent' in m.get('supportedGenerationMethods', []) and 'token' not in m.get('name', '').lower()
+    ]
+    return sorted(models, key=lambda x: x.displayName)
+
+@router.get("/config/response-cache", response_model=ResponseCacheConfig)
+async def get_response_cache_config():
+    """获取确定性响应缓存配置"""
+    enabled = await config_manager.get_config("RESPONSE_CACHE_ENABLED")
+    disabled_keys = await config_manager.get_config("RESPONSE_CACHE_DISABLED_ACCESS_KEYS")
+    return ResponseCacheConfig(
+        enabled=RESPONSE_CACHE_ENABLED if enabled is None else enabled == "true",
+        disabled_access_keys=split_access_keys(RESPONSE_CACHE_DISABLED_ACCESS_KEYS if disabled_keys is None else disabled_keys),
+    )
+
+@router.post("/config/response-cache")
+async def set_response_cache_config(payload: ResponseCacheConfig):
+    """设置确定性响应缓存配置"""
+    await config_manager.set_config("RESPONSE_CACHE_ENABLED", "true" if payload.enabled else "false")
+    await config_manager.set_config("RESPONSE_CACHE_DISABLED_ACCESS_KEYS", ",".join(payload.disabled_access_keys))
+    return {"message": "Response cache configuration updated successfully."}
+
+@router.get("/response-cache/stats")
+async def get_response_cache_stats():
+    """获取确定性响应缓存的命中统计"""
+    return response_cache.stats()
+
+@router.delete("/response-cache", status_code=204)
+async def clear_response_cache():
+    """清空确定性响应缓存（内存层与磁盘层）"""
+    await response_cache.clear()
+    return None
+
+@router.get("/config/single-flight", response_model=SingleFlightConfig)
+async def get_single_flight_config():
+    """获取相同并发请求合并配置"""
+    enabled = await config_manager.get_config("SINGLE_FLIGHT_ENABLED")
+    all_posts = await config_manager.get_config("SINGLE_FLIGHT_ALL_POSTS")
+    return SingleFlightConfig(
+        enabled=SINGLE_FLIGHT_ENABLED if enabled is None else enabled == "true",
+        all_posts=SINGLE_FLIGHT_ALL_POSTS if all_posts is None else all_posts == "true",
+    )
+
+@router.post("/config/single-flight")
+async def set_single_flight_config(payload: SingleFlightConfig):
+    """设置相同并发请求合并配置"""
+    await config_manager.set_config("SINGLE_FLIGHT_ENABLED", "true" if payload.enabled else "false")
+    await config_manager.set_config("SINGLE_FLIGHT_ALL_POSTS", "true" if payload.all_posts else "false")
+    return {"message": "Single-flight configuration updated successfully."}
+
+@router.get("/single-flight/stats")
+async def get_single_flight_stats():
+    """获取相同并发请求合并的统计"""
+    return single_flight.stats()
+
+@router.get("/config/embed-batching", response_model=EmbedBatchingConfig)
+async def get_embed_batching_config():
+    """获取 embedContent 微批处理配置"""
+    enabled = await config_manager.get_config("EMBED_BATCH_ENABLED")
+    return EmbedBatchingConfig(
+        enabled=EMBED_BATCH_ENABLED if enabled is None else enabled == "true",
+        window_ms=float(await config_manager.get_config("EMBED_BATCH_WINDOW_MS") or EMBED_BATCH_WINDOW_MS),
+        max_items=int(await config_manager.get_config("EMBED_BATCH_MAX_ITEMS") or EMBED_BATCH_MAX_ITEMS),
+    )
+
+@router.post("/config/embed-batching")
+async def set_embed_batching_config(payload: EmbedBatchingConfig):
+    """设置 embedContent 微批处理配置"""
+    await config_manager.set_config("EMBED_BATCH_ENABLED", "true" if payload.enabled else "false")
+    await config_manager.set_config("EMBED_BATCH_WINDOW_MS", str(payload.window_ms))
+    await config_manager.set_config("EMBED_BATCH_MAX_ITEMS", str(payload.max_items))
+    return {"message": "Embed batching configuration updated successfully."}
+
+@router.get("/embed-batching/stats")
+async def get_embed_batching_stats():
+    """获取 embedContent 微批处理统计"""
+    return embed_batcher.stats()
+
+@router.get("/key-leases/stats")
+async def get_key_lease_stats():
+    """获取跨进程密钥租约统计"""
+    return key_manager.lease_stats()
+
+@router.get("/embedding-cache/stats")
+async def get_embedding_cache_stats():
+    """获取嵌入向量缓存的命中统计"""
+    return embedding_cache.stats()
+
+@router.delete("/embedding-cache", status_code=204)
+async def clear_embedding_cache():
+    """清空嵌入向量缓存"""
+    if embedding_cache.is_open:
+        embedding_cache.clear()
+    return None
+
+@router.get("/metadata-cache/stats")
+async def get_metadata_cache_stats():
+    """获取模型元数据缓存的命中统计"""
+    return metadata_cache.stats()
+
+@router.delete("/metadata-cache", status_code=204)
+async def clear_metadata_cache():
+    """清空模型元数据缓存"""
+    metadata_cache.clear()
+    return None
 
+@router.get("/stats/live")
+async def get_live_stats():
+    """获取本进程内存中的实时调用统计：各时间窗口的总数及按模型、状态类别的明细"""
+    return {**live_stats.breakdown(), "process_local": WORKERS > 1}
+
+@router.get("/retention/stats")
+async def get_retention_stats():
+    """获取日志保留清理的配置与各表最近一次运行的进度（仅运行定时任务的进程有记录）"""
+    return retention_engine.stats()
+
+@router.get("/rollups/status")
+async def get_rollup_status():
+    """获取调用统计汇总表的历史回填进度"""
+    return {**await rollups.backfill_status(), "running": _rollup_backfill_task is not None and not _rollup_backfill_task.done()}
+
+_rollup_backfill_task: asyncio.Task | None = None
+
+@router.post("/rollups/backfill", status_code=202)
+async def start_rollup_backfill():
+    """在后台分块回填升级前的调用历史到汇总表（可重复调用，已完成的部分不会重复计入）"""
+    global _rollup_backfill_task
+    if _rollup_backfill_task is None or _rollup_backfill_task.done():
+        _rollup_backfill_task = asyncio.create_task(rollups.backfill_rollups())
+    return await get_rollup_status()
+
+@router.get("/db-pool/stats")
+async def get_db_pool_stats():
+    """获取数据库连接池的检出延迟统计"""
+    return db_pool.stats()
 
 @router.get("/scheduler/config", response_model=SchedulerConfig)
 async def get_scheduler_config():
@@ -21,6 +21,169 @@ GOOGLE_API_KEYS = os.environ.get('GOOGLE_API_KEYS', '')
 # 数据库文件路径
 DATABASE_URL = os.environ.get("DATABASE_URL", "data.db")
 
+# --- 多工作进程 ---
+# uvicorn 工作进程数；0 表示使用全部 CPU 核心。也兼容 uvicorn 的 WEB_CONCURRENCY。
+# 这是唯一解析工作进程数的地方：run.py 与 Dockerfile 都用这里的结果启动 uvicorn，
+# 并把解析后的值写回 WORKERS 环境变量，保证各工作进程看到的值与实际进程数一致
+WORKERS = int(os.environ.get("WORKERS") or os.environ.get("WEB_CONCURRENCY") or 1)
+if WORKERS <= 0:
+    WORKERS = os.cpu_count() or 1
+# 多进程模式下，各进程从数据库同步配置与密钥状态的间隔（秒）
+WORKER_SYNC_INTERVAL_SECONDS = float(os.environ.get("WORKER_SYNC_INTERVAL_SECONDS", 5))
+# 调度器领导者租约时长（秒）；领导者每隔三分之一租约续期一次
+SCHEDULER_LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", 30))
+# 共享同一数据库的多个进程/实例之间通过租约表认领互不重叠的密钥批次；默认在多工作进程时开启
+KEY_LEASE_ENABLED = os.environ.get("KEY_LEASE_ENABLED", "true" if WORKERS > 1 else "false").lower() == "true"
+# 密钥租约时长（秒）；进程崩溃时，其认领的密钥在租约到期后可被其他进程认领
+KEY_LEASE_SECONDS = float(os.environ.get("KEY_LEASE_SECONDS", 120))
+
+# --- 数据库连接池 ---
+# 只读连接数量（WAL 模式下可与写连接并发读取）
+DB_READER_POOL_SIZE = max(1, int(os.environ.get("DB_READER_POOL_SIZE", 4)))
+# 每个连接的页缓存大小（KB）
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 4096))
+# 每个连接的内存映射大小（MB），0 表示禁用
+DB_MMAP_SIZE_MB = int(os.environ.get("DB_MMAP_SIZE_MB", 64))
+
+# --- 密钥选择策略 ---
+# "round_robin": 按最后使用时间轮询；"quota": 按每个密钥的 RPM/TPM 余量与在途请求数选择
+KEY_SELECTION_STRATEGY = os.environ.get("KEY_SELECTION_STRATEGY", "round_robin")
+# 每个模型的单密钥速率限制（JSON），例如 {"default": {"rpm": 15, "tpm": 1000000}}
+KEY_RATE_LIMITS = os.environ.get("KEY_RATE_LIMITS", "{}")
+
+# --- 429 限流冷却 ---
+# 上游未给出 Retry-After / retryDelay 时的默认冷却时间（秒）
+RATE_LIMIT_COOLDOWN_SECONDS = int(os.environ.get("RATE_LIMIT_COOLDOWN_SECONDS", 60))
+# 冷却时间上限（秒），防止异常的上游提示让密钥长期闲置
+RATE_LIMIT_MAX_COOLDOWN_SECONDS = int(os.environ.get("RATE_LIMIT_MAX_COOLDOWN_SECONDS", 3600))
+
+# --- 非流式请求对冲 ---
+# 是否启用对冲请求（默认关闭）
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+# 每个访问密钥允许的对冲比例（对冲请求数 / 请求总数）
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", 0.1))
+# 模型首字节时间样本不足时的默认对冲等待时间（毫秒）
+HEDGE_DEFAULT_DELAY_MS = int(os.environ.get("HEDGE_DEFAULT_DELAY_MS", 5000))
+# 对冲等待时间下限（毫秒）
+HEDGE_MIN_DELAY_MS = int(os.environ.get("HEDGE_MIN_DELAY_MS", 500))
+
+# --- 上游 HTTP 传输 ---
+# 是否启用 HTTP/2 多路复用（需要安装 h2，即 httpx[http2]）
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "true").lower() == "true"
+# 建立连接 / 读取 / 等待连接池空闲连接的超时（秒）
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 10))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 300))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", 30))
+# 空闲 keepalive 连接的保留时间（秒）
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", 60))
+# 流式请求连接池
+UPSTREAM_STREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_STREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_STREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_STREAM_MAX_KEEPALIVE", 50))
+# 非流式请求连接池
+UPSTREAM_UNARY_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_UNARY_MAX_CONNECTIONS", 100))
+UPSTREAM_UNARY_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_UNARY_MAX_KEEPALIVE", 50))
+# 热更新后旧连接池等待在途请求结束的最长时间（秒），超时后强制关闭
+UPSTREAM_RETIRE_TIMEOUT = float(os.environ.get("UPSTREAM_RETIRE_TIMEOUT", 900))
+
+# --- 模型元数据缓存 ---
+# models 列表 / models/{name} 的新鲜期（秒）
+METADATA_CACHE_TTL_SECONDS = int(os.environ.get("METADATA_CACHE_TTL_SECONDS", 300))
+# 过期后仍可返回旧值并在后台刷新的时间窗口（秒）
+METADATA_CACHE_SWR_SECONDS = int(os.environ.get("METADATA_CACHE_SWR_SECONDS", 3600))
+# 未知模型 404 的负缓存时间（秒）
+METADATA_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get("METADATA_CACHE_NEGATIVE_TTL_SECONDS", 30))
+# 单条缓存的最大字节数，超过则不缓存
+METADATA_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("METADATA_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+# 最大缓存条目数
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", 256))
+
+# --- 确定性响应缓存 ---
+# 是否缓存 temperature 为 0 的非流式 generateContent 响应（默认关闭）
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+# 不使用响应缓存的访问密钥（逗号分隔）
+RESPONSE_CACHE_DISABLED_ACCESS_KEYS = os.environ.get("RESPONSE_CACHE_DISABLED_ACCESS_KEYS", "")
+# 缓存条目有效期（秒）
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 86400))
+# 内存层字节预算
+RESPONSE_CACHE_MEMORY_BYTES = int(os.environ.get("RESPONSE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+# 单条响应的最大字节数，超过则不缓存
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+# 磁盘层 SQLite 文件路径，留空则仅使用内存层
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH", "")
+
+# --- 嵌入向量缓存 ---
+# 是否缓存 embedContent / batchEmbedContents 的结果（默认关闭）
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "false").lower() == "true"
+# 向量存储文件路径（float32，内存映射）
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.bin")
+# 存储文件上限（字节），达到上限后清空重来
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# --- 相同并发请求合并 ---
+# 是否合并相同的进行中请求（默认仅合并幂等或确定性的调用）
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# 是否同时合并非确定性的 POST 请求（例如 temperature > 0 的生成请求），需显式开启
+SINGLE_FLIGHT_ALL_POSTS = os.environ.get("SINGLE_FLIGHT_ALL_POSTS", "false").lower() == "true"
+
+# --- embedContent 微批处理 ---
+# 是否将并发的单条 embedContent 合并为 batchEmbedContents（默认关闭）
+EMBED_BATCH_ENABLED = os.environ.get("EMBED_BATCH_ENABLED", "false").lower() == "true"
+# 攒批等待窗口（毫秒）
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", 5))
+# 单批最大条目数（达到后立即发送）
+EMBED_BATCH_MAX_ITEMS = int(os.environ.get("EMBED_BATCH_MAX_ITEMS", 100))
+
+# --- 调用统计异步写入 ---
+# 缓冲区刷新间隔（毫秒）
+TELEMETRY_FLUSH_INTERVAL_MS = int(os.environ.get("TELEMETRY_FLUSH_INTERVAL_MS", 500))
+# 缓冲事件达到该数量时立即触发刷新
+TELEMETRY_BATCH_SIZE = int(os.environ.get("TELEMETRY_BATCH_SIZE", 200))
+# 缓冲区上限；达到上限时写入方会等待一次同步刷新（背压）
+TELEMETRY_QUEUE_MAX_SIZE = int(os.environ.get("TELEMETRY_QUEUE_MAX_SIZE", 5000))
+
+# --- 调用统计汇总表 ---
+# 分钟汇总保留时长（小时），至少 2 小时
+ROLLUP_MINUTE_RETENTION_HOURS = int(os.environ.get("ROLLUP_MINUTE_RETENTION_HOURS", 48))
+# 小时汇总保留天数；日汇总永久保留
+ROLLUP_HOUR_RETENTION_DAYS = int(os.environ.get("ROLLUP_HOUR_RETENTION_DAYS", 90))
+
+# --- 日志保留清理 ---
+# 每个删除事务最多删除的行数
+RETENTION_CHUNK_ROWS = int(os.environ.get("RETENTION_CHUNK_ROWS", 5000))
+# 两个删除事务之间让出写连接的时间（毫秒）
+RETENTION_CHUNK_PAUSE_MS = float(os.environ.get("RETENTION_CHUNK_PAUSE_MS", 50))
+# 单次清理的时间预算（秒），用尽后剩余的过期行留到下一次清理
+RETENTION_TIME_BUDGET_SECONDS = float(os.environ.get("RETENTION_TIME_BUDGET_SECONDS", 120))
+# 清理后执行 PRAGMA incremental_vacuum 归还空闲页（需要数据库处于 auto_vacuum=INCREMENTAL 模式）
+RETENTION_INCREMENTAL_VACUUM = os.environ.get("RETENTION_INCREMENTAL_VACUUM", "false").lower() == "true"
+# 每次 incremental_vacuum 释放的页数
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", 2000))
+
+# --- 管理仪表盘 ---
+# /admin/dashboard-data 快照的最长复用时间（秒），所有管理会话共享同一份快照
+DASHBOARD_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get("DASHBOARD_SNAPSHOT_INTERVAL_SECONDS", 5))
+# /admin/dashboard/stream 采集并推送增量的间隔（秒）
+DASHBOARD_STREAM_INTERVAL_SECONDS = float(os.environ.get("DASHBOARD_STREAM_INTERVAL_SECONDS", 2))
+
+# --- Prometheus 指标 ---
+# /metrics 端点的抓取令牌（Bearer Token），留空则禁用该端点
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# --- 请求日志 ---
+# 日志级别（DEBUG / INFO / WARNING / ERROR）
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# 可选的滚动日志文件路径，留空则只输出到 stderr
+LOG_FILE = os.environ.get("LOG_FILE", "")
+# 单个日志文件的最大字节数与保留的备份数量
+LOG_FILE_MAX_BYTES = int(os.environ.get("LOG_FILE_MAX_BYTES", 10 * 1024 * 1024))
+LOG_FILE_BACKUP_COUNT = int(os.environ.get("LOG_FILE_BACKUP_COUNT", 5))
+# 成功请求的日志采样率（0~1）；错误与慢请求始终记录
+LOG_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("LOG_SAMPLE_RATE", 1.0))))
+# 超过该耗时（毫秒）的请求始终记录
+LOG_SLOW_REQUEST_MS = float(os.environ.get("LOG_SLOW_REQUEST_MS", 1000))
+# 是否在请求日志中包含（非敏感的）请求头
+LOG_REQUEST_HEADERS = os.environ.get("LOG_REQUEST_HEADERS", "false").lower() == "true"
+
 # Google Gemini API 的基础 URL
 GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
 
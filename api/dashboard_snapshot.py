@@ -0,0 +1,173 @@
+"""
+管理仪表盘的共享快照与增量推送。
+
+- DashboardSnapshot：/admin/dashboard-data 的响应体最多每 DASHBOARD_SNAPSHOT_INTERVAL_SECONDS 秒计算一次，
+  所有管理会话共享；重建期间到达的请求等待同一次计算。响应带 ETag，内容未变化的轮询返回 304。
+  管理接口的写操作会使快照失效，下一次读取立即重建。
+- DashboardFeed：/admin/dashboard/stream 的 SSE 推送。存在订阅者时，后台任务每隔
+  DASHBOARD_STREAM_INTERVAL_SECONDS 秒采集一次统计与密钥状态，与上一次比较后只把变化的部分
+  推送给所有订阅者；采集只有一份，与打开的仪表盘数量无关。没有订阅者时任务退出。
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable
+
+from api.config import DASHBOARD_SNAPSHOT_INTERVAL_SECONDS, DASHBOARD_STREAM_INTERVAL_SECONDS
+
+class Snapshot:
+    __slots__ = ("body", "etag", "built_at", "generation")
+
+    def __init__(self, body: bytes, generation: int):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.built_at = time.monotonic()
+        self.generation = generation
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """If-None-Match 是否包含当前 ETag（忽略弱校验前缀 W/）。"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+class DashboardSnapshot:
+    """按时间与失效代数复用的仪表盘响应体，重建按代数去重。"""
+
+    def __init__(self, interval: float = DASHBOARD_SNAPSHOT_INTERVAL_SECONDS):
+        self.interval = interval
+        self._current: Snapshot | None = None
+        self._building: asyncio.Task | None = None
+        self._building_generation = -1
+        # 每次失效加一；只有与当前代数相同的快照和重建任务可以复用
+        self._generation = 0
+        self.hits = 0
+        self.builds = 0
+
+    def invalidate(self):
+        self._generation += 1
+
+    def _is_fresh(self, snapshot: Snapshot | None) -> bool:
+        return (
+            snapshot is not None
+            and snapshot.generation == self._generation
+            and time.monotonic() - snapshot.built_at < self.interval
+        )
+
+    async def get(self, build: Callable[[], Awaitable[bytes]]) -> Snapshot:
+        snapshot = self._current
+        if self._is_fresh(snapshot):
+            self.hits += 1
+            return snapshot
+        if self._building is None or self._building_generation != self._generation:
+            self._building_generation = self._generation
+            self._building = asyncio.create_task(self._build(build, self._generation))
+        # 屏蔽取消：某个请求断开不应中断其他会话正在等待的重建
+        return await asyncio.shield(self._building)
+
+    async def _build(self, build: Callable[[], Awaitable[bytes]], generation: int) -> Snapshot:
+        try:
+            snapshot = Snapshot(await build(), generation)
+            self.builds += 1
+            self._current = snapshot
+            return snapshot
+        finally:
+            if self._building is asyncio.current_task():
+                self._building = None
+
+    def stats(self) -> dict:
+        current = self._current
+        return {
+            "interval_seconds": self.interval,
+            "hits": self.hits,
+            "builds": self.builds,
+            "age_seconds": round(time.monotonic() - current.built_at, 3) if current else None,
+            "etag": current.etag if current else None,
+        }
+
+class DashboardFeed:
+    """
+    仪表盘增量的发布者。collector 返回 {"stats": {...}, "keys": {key_id: {...}}}，
+    每次采集与上一次比较，生成 {"stats": 变化的统计分组, "keys": 变化的密钥, "removed_keys": 被删除的密钥 ID}。
+    """
+
+    def __init__(self, interval: float = DASHBOARD_STREAM_INTERVAL_SECONDS, queue_size: int = 64):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._collector: Callable[[], Awaitable[dict]] | None = None
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+        self._last: dict | None = None
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def set_collector(self, collector: Callable[[], Awaitable[dict]]):
+        self._collector = collector
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        if self._last is not None:
+            # 新订阅者的页面快照可能比上一次采集更旧，先补发完整的统计（体积很小）
+            queue.put_nowait({"stats": self._last["stats"]})
+        if self._task is None or self._task.done():
+            self._last = None
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def is_subscribed(self, queue: asyncio.Queue) -> bool:
+        return queue in self._subscribers
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                delta = self._diff(await self._collector())
+                if delta:
+                    self._publish(delta)
+            except Exception as e:
+                logging.error(f"Failed to collect dashboard updates: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _diff(self, state: dict) -> dict | None:
+        previous, self._last = self._last, state
+        if previous is None:
+            return None
+        delta = {}
+        stats = {group: values for group, values in state["stats"].items() if previous["stats"].get(group) != values}
+        if stats:
+            delta["stats"] = stats
+        keys = [info for key_id, info in state["keys"].items() if previous["keys"].get(key_id) != info]
+        if keys:
+            delta["keys"] = keys
+        removed = [key_id for key_id in previous["keys"] if key_id not in state["keys"]]
+        if removed:
+            delta["removed_keys"] = removed
+        return delta
+
+    def _publish(self, delta: dict):
+        self.published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # 消费过慢的连接直接断开，浏览器重连后会重新加载快照
+                self._subscribers.discard(queue)
+                self.dropped_subscribers += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+dashboard_snapshot = DashboardSnapshot()
+dashboard_feed = DashboardFeed()
@@ -1,14 +1,390 @@
 import asyncio
 import aiosqlite
+import datetime
+import heapq
 import logging
-from collections import deque
+import os
+import socket
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable
 from zoneinfo import ZoneInfo
 from api.config import (
     DATABASE_URL, GOOGLE_API_KEYS, ACCESS_KEY, ADMIN_KEY, MAX_FAILURE_COUNT,
     MAX_RETRY_COUNT, GEMINI_API_BASE_URL, VALIDATION_MODEL, KEY_VALIDATION_INTERVAL_HOURS,
-    SCHEDULER_TIMEZONE, ERROR_LOG_RETENTION_DAYS, REQUEST_LOG_RETENTION_DAYS
+    SCHEDULER_TIMEZONE, ERROR_LOG_RETENTION_DAYS, REQUEST_LOG_RETENTION_DAYS,
+    DB_READER_POOL_SIZE, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB,
+    TELEMETRY_FLUSH_INTERVAL_MS, TELEMETRY_BATCH_SIZE, TELEMETRY_QUEUE_MAX_SIZE,
+    KEY_SELECTION_STRATEGY, KEY_RATE_LIMITS,
+    RATE_LIMIT_COOLDOWN_SECONDS, RATE_LIMIT_MAX_COOLDOWN_SECONDS,
+    WORKERS, WORKER_SYNC_INTERVAL_SECONDS, KEY_LEASE_ENABLED, KEY_LEASE_SECONDS,
+    RETENTION_INCREMENTAL_VACUUM
 )
-from api.exceptions import AllKeysFailedError
+from api.exceptions import AllKeysFailedError, AllKeysRateLimitedError
+from api.key_scheduler import QuotaKeySelector, STRATEGY_QUOTA, parse_rate_limits
+from api.metrics import db_write_latency, key_outcomes
+from api.rollups import (
+    create_rollup_tables, init_backfill_marker, write_rollups, status_class, minute_bucket,
+    BACKFILL_UNTIL_KEY, BACKFILL_CURSOR_KEY
+)
+from api.live_stats import live_stats
+
+class CheckoutStats:
+    """记录连接检出等待时间的简单计数器（单事件循环内访问，无需加锁）。"""
+    __slots__ = ("checkouts", "total_wait", "max_wait", "in_use")
+
+    # 超过该等待时间（秒）的检出会被记录为警告
+    SLOW_CHECKOUT_SECONDS = 0.5
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+
+    def record(self, wait: float, role: str):
+        self.checkouts += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        if wait > self.SLOW_CHECKOUT_SECONDS:
+            logging.warning(f"Slow database {role} checkout: waited {wait * 1000:.1f} ms.")
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+class DatabasePool:
+    """
+    持久化的 aiosqlite 连接池，由所有管理器和路由共享。
+    - 一个专用写连接，由 asyncio.Lock 串行化，取代各处的临时连接与写锁。
+    - N 个只读连接，借助 WAL 模式与写连接并发读取。
+    每个连接的 PRAGMA 只在打开时设置一次。
+    """
+
+    def __init__(self, db_url=DATABASE_URL, reader_count=DB_READER_POOL_SIZE):
+        self.db_url = db_url
+        self.reader_count = max(1, reader_count)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._reader_conns: list[aiosqlite.Connection] = []
+        # 当前写事务回滚时需要执行的回调
+        self._rollback_hooks: list[Callable[[], None]] = []
+        self.writer_stats = CheckoutStats()
+        self.reader_stats = CheckoutStats()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _apply_common_pragmas(self, db: aiosqlite.Connection):
+        await db.execute("PRAGMA busy_timeout = 5000;")
+        await db.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB};")
+        await db.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE_MB * 1024 * 1024};")
+        await db.execute("PRAGMA temp_store = MEMORY;")
+
+    async def open(self):
+        """打开写连接与全部只读连接。重复调用是安全的。"""
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = await aiosqlite.connect(self.db_url)
+            if RETENTION_INCREMENTAL_VACUUM:
+                # 只对尚未建表的新数据库生效；已有数据库需要停机执行一次 VACUUM 才能切换
+                await writer.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            await writer.execute("PRAGMA journal_mode=WAL;")
+            await writer.execute("PRAGMA synchronous = NORMAL;")
+            await self._apply_common_pragmas(writer)
+
+            # 只读连接以 URI 的 mode=ro 打开，确保不会意外写入
+            reader_uri = f"{Path(self.db_url).absolute().as_uri()}?mode=ro"
+            for _ in range(self.reader_count):
+                reader = await aiosqlite.connect(reader_uri, uri=True)
+                await self._apply_common_pragmas(reader)
+                self._reader_conns.append(reader)
+                self._readers.put_nowait(reader)
+
+            self._writer = writer
+            logging.info(f"Database pool opened with 1 writer and {self.reader_count} reader connections.")
+
+    async def close(self):
+        """关闭所有连接。"""
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            async with self._write_lock:
+                await self._writer.close()
+                self._writer = None
+            for reader in self._reader_conns:
+                await reader.close()
+            self._reader_conns.clear()
+            self._readers = asyncio.Queue()
+            logging.info("Database pool closed.")
+
+    @asynccontextmanager
+    async def writer(self):
+        """
+        独占检出写连接。离开上下文时，未提交的事务会被提交；发生异常时回滚。
+        """
+        if self._writer is None:
+            await self.open()
+        started = time.perf_counter()
+        async with self._write_lock:
+            self.writer_stats.record(time.perf_counter() - started, "writer")
+            self.writer_stats.in_use += 1
+            db = self._writer
+            acquired = time.perf_counter()
+            self._rollback_hooks = []
+            try:
+                yield db
+                if db.in_transaction:
+                    await db.commit()
+            except BaseException:
+                if db.in_transaction:
+                    await db.rollback()
+                self._run_rollback_hooks()
+                raise
+            finally:
+                self._rollback_hooks = []
+                self.writer_stats.in_use -= 1
+                db_write_latency.observe(time.perf_counter() - acquired)
+
+    def on_rollback(self, hook: Callable[[], None]):
+        """注册一个回调，在当前写事务回滚（或提交失败）时执行。只能在 writer() 上下文中调用。"""
+        self._rollback_hooks.append(hook)
+
+    def _run_rollback_hooks(self):
+        for hook in self._rollback_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logging.error(f"Rollback hook failed: {e}")
+
+    @asynccontextmanager
+    async def reader(self):
+        """检出一个只读连接，用完后归还池中。"""
+        if self._writer is None:
+            await self.open()
+        started = time.perf_counter()
+        db = await self._readers.get()
+        self.reader_stats.record(time.perf_counter() - started, "reader")
+        self.reader_stats.in_use += 1
+        try:
+            yield db
+        finally:
+            self.reader_stats.in_use -= 1
+            self._readers.put_nowait(db)
+
+    def stats(self) -> dict:
+        """返回连接池检出延迟统计。"""
+        return {
+            "writer": self.writer_stats.as_dict(),
+            "reader": self.reader_stats.as_dict(),
+            "reader_pool_size": self.reader_count,
+            "readers_idle": self._readers.qsize(),
+        }
+
+def utc_timestamp() -> str:
+    """返回与 SQLite CURRENT_TIMESTAMP 格式一致的 UTC 时间字符串。"""
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def current_stats_month() -> str:
+    """返回月度统计使用的年月（统一以上海时区为准）。"""
+    return datetime.datetime.now(ZoneInfo("Asia/Shanghai")).strftime('%Y-%m')
+
+class TelemetryQueue:
+    """
+    调用统计的写后缓冲队列。
+    record_success / record_failure 产生的写操作按顺序缓存在内存中，
+    由后台任务按数量或时间触发，在单个事务中以 executemany 批量落库。
+    连续的同一条 SQL 会被合并为一次 executemany，月度统计与调用汇总（rollup）则先在内存中聚合。
+    写入失败或所在事务回滚时，批次放回缓冲区重试。
+    """
+    # 连续刷新失败达到该次数后，重试时只保留密钥状态更新
+    MAX_FLUSH_FAILURES = 3
+    _KEY_STATE_SQL = "UPDATE api_keys"
+
+    def __init__(self, flush_interval_ms=TELEMETRY_FLUSH_INTERVAL_MS,
+                 batch_size=TELEMETRY_BATCH_SIZE, max_size=TELEMETRY_QUEUE_MAX_SIZE):
+        self.flush_interval = max(10, flush_interval_ms) / 1000
+        self.batch_size = max(1, batch_size)
+        self.max_size = max(self.batch_size, max_size)
+        self._statements: list[tuple[str, tuple]] = []
+        self._monthly_calls: Counter = Counter()
+        # (分钟桶, key_id, model_name, 状态类别) -> 调用次数
+        self._rollups: Counter = Counter()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.flushed_statements = 0
+        self.dropped_statements = 0
+        self.requeued_statements = 0
+        # 连续刷新失败的次数，成功一次即清零
+        self.failed_flushes = 0
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    async def put(self, sql: str, params: tuple):
+        """加入一条待写语句。缓冲区已满时就地刷新一次，对写入方形成背压。"""
+        if len(self._statements) >= self.max_size:
+            await self.flush()
+        self._statements.append((sql, params))
+        if len(self._statements) >= self.batch_size:
+            self._wakeup.set()
+
+    def add_monthly_call(self, year_month: str, count: int = 1):
+        """累加月度调用次数，刷新时合并为每月一条 UPSERT。"""
+        self._monthly_calls[year_month] += count
+
+    def add_call_rollup(self, timestamp: str, key_id: int, model_name: str, status_code: int | None):
+        """累加一次调用到分钟汇总，刷新时再合并出小时与日汇总。"""
+        self._rollups[(minute_bucket(timestamp), key_id, model_name, status_class(status_code))] += 1
+
+    def _drain(self) -> tuple[list[tuple[str, tuple]], Counter, Counter]:
+        statements, self._statements = self._statements, []
+        monthly, self._monthly_calls = self._monthly_calls, Counter()
+        rollups, self._rollups = self._rollups, Counter()
+        return statements, monthly, rollups
+
+    def _requeue(self, statements: list[tuple[str, tuple]], monthly: Counter, rollups: Counter):
+        """
+        把未能提交的批次放回缓冲区头部，保持与之后到达的写入之间的顺序。
+        连续多次刷新失败或超出容量时丢弃日志类语句，始终保留密钥状态更新。
+        """
+        if self.failed_flushes >= self.MAX_FLUSH_FAILURES:
+            kept = [item for item in statements if item[0].lstrip().startswith(self._KEY_STATE_SQL)]
+            self.dropped_statements += len(statements) - len(kept)
+            statements = kept
+        self._statements[:0] = statements
+        self.requeued_statements += len(statements)
+        overflow = len(self._statements) - self.max_size
+        if overflow > 0:
+            kept = []
+            for item in self._statements:
+                if overflow > 0 and not item[0].lstrip().startswith(self._KEY_STATE_SQL):
+                    overflow -= 1
+                    self.dropped_statements += 1
+                    continue
+                kept.append(item)
+            self._statements = kept
+        self._monthly_calls.update(monthly)
+        self._rollups.update(rollups)
+
+    async def flush_into(self, db: aiosqlite.Connection) -> int:
+        """
+        在调用方已检出的写连接上写入全部缓冲内容（由调用方负责提交）。
+        该事务回滚时，取出的内容会被放回缓冲区，而不是随事务一起丢失。
+        """
+        statements, monthly, rollups = self._drain()
+        if not statements and not monthly and not rollups:
+            return 0
+        db_pool.on_rollback(lambda: self._requeue(statements, monthly, rollups))
+        i = 0
+        while i < len(statements):
+            sql = statements[i][0]
+            j = i
+            while j < len(statements) and statements[j][0] == sql:
+                j += 1
+            await db.executemany(sql, [params for _, params in statements[i:j]])
+            i = j
+        if monthly:
+            await db.executemany("""
+                INSERT INTO monthly_stats (year_month, call_count) VALUES (?, ?)
+                ON CONFLICT(year_month) DO UPDATE SET call_count = call_count + excluded.call_count
+            """, list(monthly.items()))
+        await write_rollups(db, rollups)
+        self.flushed_statements += len(statements)
+        return len(statements)
+
+    async def flush(self) -> int:
+        """将缓冲内容在一个事务中写入数据库。"""
+        async with self._flush_lock:
+            pending = len(self._statements)
+            if not pending and not self._monthly_calls and not self._rollups:
+                return 0
+            try:
+                async with db_pool.writer() as db:
+                    flushed = await self.flush_into(db)
+            except Exception as e:
+                # 统计数据不应阻塞代理主流程：本批次已由回滚回调放回缓冲区，等待下次刷新
+                self.failed_flushes += 1
+                logging.error(f"Failed to flush telemetry batch of {pending} statements, requeued for retry: {e}")
+                return 0
+            self.failed_flushes = 0
+            return flushed
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """启动后台刷新任务。"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并刷新剩余的全部事件。"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logging.info(f"Telemetry queue stopped after flushing {self.flushed_statements} statements.")
+
+class WorkerStateSync:
+    """
+    多工作进程模式下，各进程的配置快照与密钥表都在自己的内存中。
+    该后台任务定期从数据库刷新两者，使在任一进程上的管理操作（增删密钥、访问密钥、配置）
+    在数秒内对所有进程生效。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # 先落盘本进程排队中的写入，避免被数据库中的旧值覆盖；
+                # 此后才在本进程发生变化的密钥状态不会被本轮读到的旧行覆盖
+                since = key_manager.change_seq
+                await telemetry_queue.flush()
+                await config_manager.refresh()
+                await key_manager.sync_key_states(since)
+            except Exception as e:
+                logging.error(f"Worker state sync failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
 
 class ConfigManager:
     """
@@ -26,6 +402,12 @@ class ConfigManager:
         if hasattr(self, '_initialized') and self._initialized:
             return
         self.db_url = db_url
+        # 进程内配置快照：启动时整体加载一次，之后由 set_config 写穿更新。
+        # 热路径（鉴权、URL 构建、重试次数等）只读内存，不再访问数据库。
+        self._cache: dict[str, str] = {}
+        self._loaded = False
+        # 每次快照变化时递增，供依赖配置的派生结构判断是否需要重建
+        self.version = 0
         # 批量更新深度与调度器重启防抖任务
         self._bulk_depth = 0
         self._debounce_task: asyncio.Task | None = None
@@ -58,41 +440,98 @@ class ConfigManager:
 
         self._debounce_task = asyncio.create_task(_debounced())
 
+    async def load(self):
+        """从数据库整体加载配置快照，替换当前的内存副本。"""
+        async with db_pool.reader() as db:
+            cursor = await db.execute("SELECT key, value FROM config_settings")
+            rows = await cursor.fetchall()
+        self._cache = {key: value for key, value in rows}
+        self._loaded = True
+        self.version += 1
+        logging.info(f"Loaded {len(self._cache)} config entries into memory.")
+
+    async def refresh(self):
+        """
+        多进程模式下重新读取配置表，以获取其他工作进程写入的修改。
+        内容有变化时才替换快照并递增版本；调度器相关配置变化时触发（防抖的）调度器重启。
+        """
+        async with db_pool.reader() as db:
+            cursor = await db.execute("SELECT key, value FROM config_settings")
+            rows = await cursor.fetchall()
+        latest = {key: value for key, value in rows}
+        if latest == self._cache:
+            return
+        changed = {key for key in latest.keys() | self._cache.keys() if latest.get(key) != self._cache.get(key)}
+        self._cache = latest
+        self.version += 1
+        logging.info(f"Config changed in another worker: {sorted(changed)}.")
+        if changed & SCHEDULER_CONFIG_KEYS:
+            self._schedule_debounced_restart(delay=0.5)
+
+    def update_cache(self, key: str, value: str):
+        """在绕过 set_config 直接写库后（例如与其他语句同一事务），同步内存快照。"""
+        if self._cache.get(key) != value:
+            self._cache[key] = value
+            self.version += 1
+
+    def get_cached(self, key: str, default: str | None = None) -> str | None:
+        """同步读取内存快照中的配置值，供无法 await 的热路径使用。"""
+        return self._cache.get(key, default)
+
     async def get_config(self, key: str) -> str | None:
-        """从数据库获取一个配置项的值"""
-        async with aiosqlite.connect(self.db_url) as db:
-            cursor = await db.execute("SELECT value FROM config_settings WHERE key = ?", (key,))
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        """获取一个配置项的值。首次调用时加载快照，此后只读内存。"""
+        if not self._loaded:
+            await self.load()
+        return self._cache.get(key)
 
     async def set_config(self, key: str, value: str):
-        """在数据库中设置一个配置项的值，并在必要时重启调度器"""
-        async with aiosqlite.connect(self.db_url) as db:
+        """在数据库中设置一个配置项的值，写穿更新内存快照，并在必要时重启调度器"""
+        async with db_pool.writer() as db:
             await db.execute(
                 "INSERT INTO config_settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
                 (key, value)
             )
             await db.commit()
             logging.info(f"Persisted config for key='{key}'.")
+        self.update_cache(key, value)
 
         # 如果更新的是调度器相关的配置，则触发重启
-        scheduler_keys = [
-            "VALIDATION_MODEL",
-            "KEY_VALIDATION_INTERVAL_HOURS",
-            "SCHEDULER_TIMEZONE",
-            "ERROR_LOG_RETENTION_DAYS",
-            "REQUEST_LOG_RETENTION_DAYS"
-        ]
-        if key in scheduler_keys:
+        if key in SCHEDULER_CONFIG_KEYS:
             if self._bulk_depth > 0:
                 # 批量更新模式下，不在每次 set 时重启
                 return
             logging.info(f"Scheduler-related config '{key}' changed. Debouncing scheduler restart.")
             self._schedule_debounced_restart(delay=0.5)
 
+# 修改后需要重启调度器的配置项
+SCHEDULER_CONFIG_KEYS = frozenset({
+    "VALIDATION_MODEL",
+    "KEY_VALIDATION_INTERVAL_HOURS",
+    "SCHEDULER_TIMEZONE",
+    "ERROR_LOG_RETENTION_DAYS",
+    "REQUEST_LOG_RETENTION_DAYS",
+})
+
+class KeyState:
+    """单个 API 密钥的内存状态。使用 __slots__ 保持紧凑，避免每个实例携带 __dict__。"""
+    __slots__ = ("id", "key", "is_valid", "failure_count", "last_used", "changed_seq")
+
+    def __init__(self, key_id: int, key: str, is_valid: bool, failure_count: int, last_used: str | None):
+        self.id = key_id
+        self.key = key
+        self.is_valid = bool(is_valid)
+        self.failure_count = failure_count
+        # 与数据库一致的 UTC 时间字符串 'YYYY-MM-DD HH:MM:SS'，可直接按字典序比较
+        self.last_used = last_used
+        # 本进程最近一次修改该状态时的变更序号，多进程同步据此跳过尚未落盘的本地修改
+        self.changed_seq = 0
+
 class KeyManager:
     """
     封装了所有与 API 密钥相关的数据库操作和内存池管理。
+    密钥状态（ID、有效性、失败次数、最后使用时间）以内存表为准，
+    失败计数与失效判定在内存中完成，再经由写后缓冲队列异步持久化；数据库仅作为持久化镜像。
+    多进程模式下失败计数例外：在数据库中原子累加，以数据库为准。
     这是一个单例模式的实现，以确保在整个应用中只有一个密钥管理器实例。
     """
     _instance = None
@@ -112,220 +551,593 @@ class KeyManager:
         self.pool_size = pool_size
         
         self.key_queue = deque()
+        # 内存中的权威密钥状态表，分别以密钥值和 ID 索引
+        self._states: dict[str, KeyState] = {}
+        self._states_by_id: dict[int, KeyState] = {}
+        # 有效密钥列表缓存，密钥增删或有效性变化时置空重建
+        self._roster: list[KeyState] | None = None
+        # 每个密钥的在途请求数
+        self._in_flight: dict[int, int] = {}
+        # 本进程内密钥状态的变更序号，每次本地修改递增
+        self.change_seq = 0
+        # 429 冷却隔离：key_id -> 解除时间（monotonic），以及按解除时间排序的最小堆
+        self._cooldowns: dict[int, float] = {}
+        self._cooldown_heap: list[tuple[float, int]] = []
+        # quota 策略的选择器，其限制随配置快照版本同步
+        self.selector = QuotaKeySelector()
+        self._selector_config_version = -1
         # 在单进程模式下，使用内存锁 (asyncio.Lock) 以获得最佳性能
         self.refill_lock = asyncio.Lock()
-        # 添加一个专用的数据库写操作锁，以防止并发写入导致的 "database is locked" 错误
-        self.db_write_lock = asyncio.Lock()
+        # 跨进程密钥租约：本进程的持有者标识，以及最近一次认领的统计
+        self.lease_enabled = KEY_LEASE_ENABLED
+        self.lease_holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_claims = 0
+        self.lease_fallbacks = 0
+        self.leased_keys = 0
+        self._lease_expires_at = 0.0
+        # 数据库写操作由 db_pool 的专用写连接串行化，以防止 "database is locked" 错误
         self._initialized = True
         logging.info("KeyManager initialized.")
 
+    # --- 内存状态表 ---
+
+    async def load_key_states(self):
+        """从数据库加载全部密钥状态，替换内存表。"""
+        async with db_pool.reader() as db:
+            cursor = await db.execute("SELECT id, key, is_valid, failure_count, last_used FROM api_keys")
+            rows = await cursor.fetchall()
+        self._states = {}
+        self._states_by_id = {}
+        self._roster = None
+        for row in rows:
+            self._remember(KeyState(*row))
+        logging.info(f"Loaded {len(rows)} key states into memory.")
+
+    async def sync_key_states(self, since: int | None = None):
+        """
+        多进程模式下与数据库对齐密钥表：应用其他工作进程的增删、有效性与失败计数变化，
+        同时保留本进程的在途计数、冷却与令牌桶状态。
+        传入 since 时，变更序号大于它的状态（在落盘之后才被本进程修改）保持内存中的值。
+        """
+        async with db_pool.reader() as db:
+            cursor = await db.execute("SELECT id, key, is_valid, failure_count, last_used FROM api_keys")
+            rows = await cursor.fetchall()
+        seen = set()
+        for key_id, key, is_valid, failure_count, last_used in rows:
+            seen.add(key_id)
+            state = self._states_by_id.get(key_id)
+            if state is None:
+                self._remember(KeyState(key_id, key, is_valid, failure_count, last_used))
+                continue
+            if since is not None and state.changed_seq > since:
+                continue
+            self._set_valid(state, bool(is_valid))
+            state.failure_count = failure_count
+            if last_used and (state.last_used is None or last_used > state.last_used):
+                state.last_used = last_used
+        for state in [state for state in self.list_states() if state.id not in seen]:
+            self._forget(state)
+
+    def _touch(self, state: KeyState):
+        """标记该状态在本进程中被修改。"""
+        self.change_seq += 1
+        state.changed_seq = self.change_seq
+
+    def _remember(self, state: KeyState):
+        self._states[state.key] = state
+        self._states_by_id[state.id] = state
+        self._roster = None
+
+    def _forget(self, state: KeyState):
+        self._states.pop(state.key, None)
+        self._states_by_id.pop(state.id, None)
+        self._in_flight.pop(state.id, None)
+        self._cooldowns.pop(state.id, None)
+        self.selector.forget(state.id)
+        self._discard_from_pool(state.key)
+        self._roster = None
+
+    def _set_valid(self, state: KeyState, is_valid: bool):
+        if state.is_valid != is_valid:
+            state.is_valid = is_valid
+            self._roster = None
+        if not is_valid:
+            self._discard_from_pool(state.key)
+
+    def _valid_roster(self) -> list[KeyState]:
+        if self._roster is None:
+            self._roster = [state for state in self.list_states() if state.is_valid]
+        return self._roster
+
+    def get_state(self, key: str) -> KeyState | None:
+        return self._states.get(key)
+
+    def get_state_by_id(self, key_id: int) -> KeyState | None:
+        return self._states_by_id.get(key_id)
+
+    def list_states(self) -> list[KeyState]:
+        """按 ID 升序返回所有密钥状态。"""
+        return sorted(self._states_by_id.values(), key=lambda state: state.id)
+
+    def count_keys(self) -> tuple[int, int]:
+        """返回 (总数, 有效数)。"""
+        valid = sum(1 for state in self._states_by_id.values() if state.is_valid)
+        return len(self._states_by_id), valid
+
+    def invalid_keys(self) -> list[tuple[int, str]]:
+        """返回所有无效密钥的 (id, key)。"""
+        return [(state.id, state.key) for state in self.list_states() if not state.is_valid]
+
+    # --- 内存池 ---
+
     async def _refill_key_pool(self):
         """
-        从数据库填充密钥池。在一个事务中完成，以保证原子性。
+        从内存状态表填充密钥池：按最后使用时间升序选取有效密钥，不访问数据库。
+        启用密钥租约时，改为在数据库中原子认领一批其他进程未持有的密钥。
         """
-        async with self.db_write_lock:
-            async with aiosqlite.connect(self.db_url) as db:
-                async with db.execute("BEGIN IMMEDIATE"):
-                    cursor = await db.execute("""
-                        SELECT id, key FROM api_keys
-                        WHERE is_valid = 1
-                        ORDER BY last_used ASC, id ASC
-                        LIMIT ?
-                    """, (self.pool_size,))
-                    rows = await cursor.fetchall()
-
-                    if not rows:
-                        return
-
-                    keys = [row[1] for row in rows]
-                    await db.commit()
+        self._expire_cooldowns()
+        cooldowns = self._cooldowns
+        if self.lease_enabled:
+            chosen = await self._claim_key_batch()
+            if chosen:
+                for state in chosen:
+                    self.key_queue.append(state.key)
+                logging.info(f"Refilled pool with {len(chosen)} leased keys.")
+                return
+            # 其他进程已认领全部密钥时退回共享使用，而不是直接报错
+            self.lease_fallbacks += 1
+            logging.info("No unleased keys available. Falling back to shared key selection.")
+
+        candidates = [state for state in self._valid_roster() if state.id not in cooldowns]
+        if not candidates:
+            return
 
-                    for key in keys:
-                        self.key_queue.append(key)
-                    logging.info(f"Refilled pool with {len(keys)} keys.")
+        chosen = heapq.nsmallest(self.pool_size, candidates, key=lambda state: (state.last_used or "", state.id))
+        for state in chosen:
+            self.key_queue.append(state.key)
+        logging.info(f"Refilled pool with {len(chosen)} keys.")
 
-    async def get_key(self) -> str:
+    async def _claim_key_batch(self) -> list[KeyState]:
+        """
+        在一个写事务中释放本进程的旧租约与所有过期租约，再认领最久未使用的一批空闲密钥。
+        SQLite 的写锁跨进程串行化该事务，因此各进程拿到的批次互不重叠。
+        """
+        now = time.time()
+        excluded = list(self._cooldowns)
+        cooldown_filter = f"AND k.id NOT IN ({','.join('?' for _ in excluded)})" if excluded else ""
+        try:
+            async with db_pool.writer() as db:
+                # 先落盘缓冲的 last_used，使认领顺序与内存状态一致
+                await telemetry_queue.flush_into(db)
+                await db.execute(
+                    "DELETE FROM key_leases WHERE holder = ? OR expires_at < ?", (self.lease_holder, now)
+                )
+                cursor = await db.execute(
+                    f"""
+                    INSERT INTO key_leases (key_id, holder, expires_at)
+                    SELECT k.id, ?, ? FROM api_keys k
+                    WHERE k.is_valid = 1
+                      AND NOT EXISTS (SELECT 1 FROM key_leases l WHERE l.key_id = k.id)
+                      {cooldown_filter}
+                    ORDER BY k.last_used IS NOT NULL, k.last_used, k.id
+                    LIMIT ?
+                    RETURNING key_id
+                    """,
+                    (self.lease_holder, now + KEY_LEASE_SECONDS, *excluded, self.pool_size)
+                )
+                rows = await cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Failed to claim key leases: {e}")
+            return []
+        self.lease_claims += 1
+        self.leased_keys = len(rows)
+        self._lease_expires_at = now + KEY_LEASE_SECONDS
+        chosen = [self._states_by_id[row[0]] for row in rows if row[0] in self._states_by_id]
+        chosen = [state for state in chosen if state.is_valid]
+        chosen.sort(key=lambda state: (state.last_used or "", state.id))
+        return chosen
+
+    async def release_key_leases(self):
+        """进程退出时归还本进程认领的密钥，其他进程无需等待租约过期即可使用。"""
+        if not self.lease_enabled:
+            return
+        async with db_pool.writer() as db:
+            await db.execute("DELETE FROM key_leases WHERE holder = ?", (self.lease_holder,))
+        self.key_queue.clear()
+        self.leased_keys = 0
+
+    def pool_metrics(self) -> dict[tuple, float]:
+        """供 /metrics 抓取时读取的密钥池深度。"""
+        total, valid = self.count_keys()
+        return {
+            ("total",): total,
+            ("valid",): valid,
+            ("cooling",): self.cooling_count(),
+            ("pooled",): len(self.key_queue),
+            ("in_use",): self.in_flight_total,
+        }
+
+    def lease_stats(self) -> dict:
+        return {
+            "enabled": self.lease_enabled,
+            "holder": self.lease_holder,
+            "lease_seconds": KEY_LEASE_SECONDS,
+            "leased_keys": self.leased_keys,
+            "claims": self.lease_claims,
+            "fallbacks": self.lease_fallbacks,
+        }
+
+    def _discard_from_pool(self, key: str):
+        """从内存池中移除一个密钥（如果存在）。"""
+        try:
+            self.key_queue.remove(key)
+        except ValueError:
+            pass
+
+    # --- 429 冷却隔离 ---
+
+    def quarantine(self, key: str, seconds: float | None = None):
+        """
+        将被限流的密钥暂时隔离，冷却结束前 get_key 不会再返回它。
+        不修改 is_valid 与失败计数。
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        if seconds is None or seconds <= 0:
+            seconds = RATE_LIMIT_COOLDOWN_SECONDS
+        seconds = min(seconds, RATE_LIMIT_MAX_COOLDOWN_SECONDS)
+        release_at = time.monotonic() + seconds
+        if release_at > self._cooldowns.get(state.id, 0.0):
+            self._cooldowns[state.id] = release_at
+            heapq.heappush(self._cooldown_heap, (release_at, state.id))
+        self._discard_from_pool(key)
+        logging.info(f"Key ...{key[-4:]} (ID: {state.id}) quarantined for {seconds:.1f}s after rate limiting.")
+
+    def _expire_cooldowns(self):
+        """弹出所有已到期的冷却记录。堆中被更长冷却覆盖的旧条目在此被跳过。"""
+        heap = self._cooldown_heap
+        if not heap:
+            return
+        now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            release_at, key_id = heapq.heappop(heap)
+            if self._cooldowns.get(key_id) == release_at:
+                del self._cooldowns[key_id]
+
+    def cooling_count(self) -> int:
+        self._expire_cooldowns()
+        return len(self._cooldowns)
+
+    def _raise_no_available_key(self):
+        """没有可返回的密钥时，区分“全部冷却中”与“没有有效密钥”两种情况。"""
+        cooling = [self._cooldowns[state.id] for state in self._valid_roster() if state.id in self._cooldowns]
+        if cooling:
+            retry_after = max(1, int(min(cooling) - time.monotonic() + 0.999))
+            logging.warning(f"All {len(cooling)} valid keys are cooling down. Earliest release in {retry_after}s.")
+            raise AllKeysRateLimitedError(retry_after)
+        logging.error("No valid keys available to refill the pool.")
+        raise AllKeysFailedError()
+
+    def _sync_selector_config(self):
+        version = config_manager.version
+        if version != self._selector_config_version:
+            self.selector.configure(parse_rate_limits(config_manager.get_cached("KEY_RATE_LIMITS", KEY_RATE_LIMITS)))
+            self._selector_config_version = version
+
+    @property
+    def strategy(self) -> str:
+        return config_manager.get_cached("KEY_SELECTION_STRATEGY") or KEY_SELECTION_STRATEGY
+
+    @property
+    def in_flight_total(self) -> int:
+        return sum(self._in_flight.values())
+
+    async def get_key(self, model_name: str | None = None, est_tokens: int = 0) -> str:
+        """
+        按当前策略获取一个密钥，并将其计入在途请求。调用方用完后必须调用 release_key。
+        如果已没有可用密钥，则抛出 AllKeysFailedError。
+        """
+        self._expire_cooldowns()
+        if self.strategy == STRATEGY_QUOTA:
+            self._sync_selector_config()
+            state = self.selector.select(self._valid_roster(), model_name, est_tokens, self._in_flight, self._cooldowns)
+            if state is None:
+                self._raise_no_available_key()
+            self.selector.charge(state.id, model_name, est_tokens)
+            key = state.key
+        else:
+            key = await self._get_key_round_robin()
+            state = self._states[key]
+        self._in_flight[state.id] = self._in_flight.get(state.id, 0) + 1
+        return key
+
+    def release_key(self, key: str, model_name: str | None = None, est_tokens: int = 0, tokens_used: int | None = None):
+        """
+        结束一次密钥使用：减少在途计数，并在得知实际 token 用量时修正 TPM 令牌桶。
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        remaining = self._in_flight.get(state.id, 0) - 1
+        if remaining > 0:
+            self._in_flight[state.id] = remaining
+        else:
+            self._in_flight.pop(state.id, None)
+        if tokens_used is not None and self.strategy == STRATEGY_QUOTA:
+            self.selector.adjust_tokens(state.id, model_name, tokens_used - est_tokens)
+
+    async def _get_key_round_robin(self) -> str:
         """
         从内存池中获取一个密钥。如果池为空，则触发填充。
-        如果数据库中也没有可用密钥，则抛出 AllKeysFailedError。
         """
-        if not self.key_queue:
-            try:
-                # 获取内存锁
-                await self.refill_lock.acquire()
-                # 再次检查，因为在等待锁的时候可能已经被其他协程填充了
-                if not self.key_queue:
-                    logging.info("Key pool is empty. Refilling from database...")
-                    await self._refill_key_pool()
-            finally:
-                # 释放内存锁
-                self.refill_lock.release()
+        while True:
+            # 租约到期后池中剩余的密钥可能已被其他进程认领，丢弃并重新认领
+            if self.lease_enabled and self.key_queue and time.time() >= self._lease_expires_at:
+                self.key_queue.clear()
+            if not self.key_queue:
+                try:
+                    # 获取内存锁
+                    await self.refill_lock.acquire()
+                    # 再次检查，因为在等待锁的时候可能已经被其他协程填充了
+                    if not self.key_queue:
+                        logging.info("Key pool is empty. Refilling from key state table...")
+                        await self._refill_key_pool()
+                finally:
+                    # 释放内存锁
+                    self.refill_lock.release()
 
-        if not self.key_queue:
-            logging.error("Database contains no valid keys to refill the pool.")
-            raise AllKeysFailedError()
+            if not self.key_queue:
+                self._raise_no_available_key()
 
-        return self.key_queue.popleft()
+            key = self.key_queue.popleft()
+            # 入池后可能已被删除、禁用或进入冷却
+            state = self._states.get(key)
+            if state is not None and state.is_valid and state.id not in self._cooldowns:
+                return key
 
     async def initialize_from_env(self):
         """只有当数据库为空时，才从环境变量同步初始密钥"""
-        async with aiosqlite.connect(self.db_url) as db:
+        async with db_pool.reader() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM api_keys")
             count = await cursor.fetchone()
-            if count[0] == 0:
-                logging.info("Database is empty. Seeding GOOGLE_API_KEYS from environment variable...")
-                if self.initial_keys:
-                    keys = [key.strip() for key in self.initial_keys.split(',') if key.strip()]
-                    for key in keys:
-                        await self.add_key(key)
-            else:
-                logging.info("Database already contains keys. Skipping seed from environment variable.")
+        if count[0] == 0:
+            logging.info("Database is empty. Seeding GOOGLE_API_KEYS from environment variable...")
+            if self.initial_keys:
+                keys = [key.strip() for key in self.initial_keys.split(',') if key.strip()]
+                for key in keys:
+                    await self.add_key(key)
+        else:
+            logging.info("Database already contains keys. Skipping seed from environment variable.")
 
     async def prewarm_pool(self):
         """预热密钥池"""
         logging.info("Pre-warming key pool...")
         await self._refill_key_pool()
 
+    # --- 管理操作（同步写库并更新内存表） ---
+    # 先在同一事务中落盘缓冲的事件，避免其随后覆盖管理员的修改。
+
     async def add_key(self, key: str):
         """向数据库中添加一个新的 API 密钥，如果它不存在的话"""
-        async with self.db_write_lock:
-            async with aiosqlite.connect(self.db_url) as db:
-                cursor = await db.execute("""
-                    INSERT INTO api_keys (key) VALUES (?)
-                    ON CONFLICT(key) DO UPDATE SET
-                        is_valid = 1,
-                        failure_count = 0,
-                        last_used = NULL
-                """, (key,))
-                await db.commit()
-                if cursor.rowcount > 0:
-                    logging.info(f"Upserted and activated key: ...{key[-4:]}")
+        async with db_pool.writer() as db:
+            await telemetry_queue.flush_into(db)
+            cursor = await db.execute("""
+                INSERT INTO api_keys (key) VALUES (?)
+                ON CONFLICT(key) DO UPDATE SET
+                    is_valid = 1,
+                    failure_count = 0,
+                    last_used = NULL
+            """, (key,))
+            upserted = cursor.rowcount
+            cursor = await db.execute("SELECT id FROM api_keys WHERE key = ?", (key,))
+            key_id = (await cursor.fetchone())[0]
+        self._remember(KeyState(key_id, key, True, 0, None))
+        if upserted > 0:
+            logging.info(f"Upserted and activated key: ...{key[-4:]}")
+
+    async def delete_keys(self, key_ids: list[int]) -> int:
+        """按 ID 批量删除密钥，返回删除数量。"""
+        async with db_pool.writer() as db:
+            await telemetry_queue.flush_into(db)
+            placeholders = ','.join('?' for _ in key_ids)
+            cursor = await db.execute(f"DELETE FROM api_keys WHERE id IN ({placeholders})", key_ids)
+            deleted_count = cursor.rowcount
+        for key_id in key_ids:
+            state = self._states_by_id.get(key_id)
+            if state is not None:
+                self._forget(state)
+        return deleted_count
+
+    async def delete_keys_by_value(self, keys: list[str]) -> int:
+        """按密钥值批量删除密钥，返回删除数量。"""
+        async with db_pool.writer() as db:
+            await telemetry_queue.flush_into(db)
+            placeholders = ','.join('?' for _ in keys)
+            cursor = await db.execute(f"DELETE FROM api_keys WHERE key IN ({placeholders})", keys)
+            deleted_count = cursor.rowcount
+        for key in keys:
+            state = self._states.get(key)
+            if state is not None:
+                self._forget(state)
+        return deleted_count
+
+    async def set_keys_valid(self, key_ids: list[int], is_valid: bool, reset_failures: bool = False):
+        """批量设置密钥有效性；reset_failures 为真时同时清零失败计数。"""
+        async with db_pool.writer() as db:
+            await telemetry_queue.flush_into(db)
+            placeholders = ','.join('?' for _ in key_ids)
+            if reset_failures:
+                await db.execute(
+                    f"UPDATE api_keys SET is_valid = ?, failure_count = 0 WHERE id IN ({placeholders})",
+                    [is_valid, *key_ids]
+                )
+            else:
+                await db.execute(f"UPDATE api_keys SET is_valid = ? WHERE id IN ({placeholders})", [is_valid, *key_ids])
+        for key_id in key_ids:
+            state = self._states_by_id.get(key_id)
+            if state is None:
+                continue
+            self._touch(state)
+            self._set_valid(state, is_valid)
+            if reset_failures:
+                state.failure_count = 0
+
+    # --- 调用结果记录（内存判定，异步持久化） ---
+
+    async def _record_call(self, key_id: int, model_name: str, status_code: int | None, timestamp: str):
+        """写入一条调用历史，并累加月度统计、调用汇总与内存中的实时窗口。"""
+        await telemetry_queue.put(
+            "INSERT INTO api_call_history (key_id, model_name, identification_code, timestamp) VALUES (?, ?, ?, ?)",
+            (key_id, model_name, status_code, timestamp)
+        )
+        telemetry_queue.add_monthly_call(current_stats_month())
+        telemetry_queue.add_call_rollup(timestamp, key_id, model_name, status_code)
+        live_stats.record(model_name, status_class(status_code))
+
+    _INCREMENT_FAILURE_SQL = """
+        UPDATE api_keys SET
+            failure_count = failure_count + 1,
+            is_valid = CASE WHEN failure_count + 1 >= ? THEN 0 ELSE is_valid END
+        WHERE id = ?
+    """
+
+    async def _increment_failure(self, state: KeyState, max_failure_count: int) -> tuple[int, bool]:
+        """在数据库中原子累加失败次数，返回累加后的 (失败次数, 有效性)。写库失败时退回内存计数并排队写入。"""
+        try:
+            async with db_pool.writer() as db:
+                # 先落盘本进程缓冲的写入（如此前的成功清零），保证累加基于最新的值
+                await telemetry_queue.flush_into(db)
+                cursor = await db.execute(
+                    self._INCREMENT_FAILURE_SQL + " RETURNING failure_count, is_valid",
+                    (max_failure_count, state.id)
+                )
+                row = await cursor.fetchone()
+        except Exception as e:
+            logging.error(f"Failed to record failure for key ID {state.id} in database: {e}")
+            row = None
+            await telemetry_queue.put(self._INCREMENT_FAILURE_SQL, (max_failure_count, state.id))
+        if row is None:
+            failure_count = state.failure_count + 1
+            return failure_count, state.is_valid and failure_count < max_failure_count
+        return row[0], bool(row[1])
 
     async def record_failure(self, key: str, model_name: str | None = None, status_code: int | None = None, error_message: str | None = None):
         """
         记录一次密钥失败。如果连续失败次数达到阈值，则将其标记为无效。
-        同时，将详细的错误信息记录到 error_logs 表中。
+        计数与失效判定在内存状态表中立即完成，状态更新、错误日志、调用历史与月度统计进入写后缓冲队列；
+        多进程模式下失败计数直接在数据库中原子累加，避免各进程的计数互相覆盖。
         """
-        import datetime
-        max_failure_count_str = await config_manager.get_config("MAX_FAILURE_COUNT")
-        max_failure_count = int(max_failure_count_str)
+        max_failure_count = int(config_manager.get_cached("MAX_FAILURE_COUNT") or MAX_FAILURE_COUNT)
 
         # If model_name is not provided, try to get it from config
         if not model_name:
-            model_name = await config_manager.get_config("VALIDATION_MODEL")
-
-        async with self.db_write_lock:
-            async with aiosqlite.connect(self.db_url) as db:
-                async with db.execute("BEGIN"):
-                    # 1. 获取密钥 ID 和当前的失败次数
-                    cursor = await db.execute("SELECT id, failure_count FROM api_keys WHERE key = ?", (key,))
-                    row = await cursor.fetchone()
-                    if not row:
-                        logging.warning(f"Attempted to record failure for a key that does not exist: {key}")
-                        return
-
-                    key_id, current_failures = row
-                    new_failures = current_failures + 1
-
-                    # 2. 更新密钥状态
-                    if new_failures >= max_failure_count:
-                        await db.execute(
-                            "UPDATE api_keys SET is_valid = 0, failure_count = ? WHERE id = ?",
-                            (new_failures, key_id)
-                        )
-                        logging.warning(f"Key ...{key[-4:]} (ID: {key_id}) has been invalidated after {new_failures} failures.")
-                    else:
-                        await db.execute(
-                            "UPDATE api_keys SET failure_count = ? WHERE id = ?",
-                            (new_failures, key_id)
-                        )
-                        logging.info(f"Recorded failure {new_failures}/{max_failure_count} for key ...{key[-4:]} (ID: {key_id}).")
-
-                    # 3. 插入错误日志
-                    if status_code and error_message:
-                        await db.execute(
-                            "INSERT INTO error_logs (key_id, model_name, identification_code, error_message) VALUES (?, ?, ?, ?)",
-                            (key_id, model_name, status_code, error_message)
-                        )
-                        logging.info(f"Logged error for key ID {key_id}: Status {status_code}")
-
-                    # 4. 记录调用历史和月度统计 (仅当模型名称存在时)
-                    if model_name:
-                        await db.execute(
-                            "INSERT INTO api_call_history (key_id, model_name, identification_code) VALUES (?, ?, ?)",
-                            (key_id, model_name, status_code)
-                        )
-                        current_month = datetime.datetime.now(ZoneInfo("Asia/Shanghai")).strftime('%Y-%m')
-                        await db.execute("""
-                            INSERT INTO monthly_stats (year_month, call_count) VALUES (?, 1)
-                            ON CONFLICT(year_month) DO UPDATE SET call_count = call_count + 1
-                        """, (current_month,))
-
-                await db.commit()
+            model_name = config_manager.get_cached("VALIDATION_MODEL")
+
+        # 1. 获取密钥状态
+        state = self._states.get(key)
+        if state is None:
+            logging.warning(f"Attempted to record failure for a key that does not exist: ...{key[-4:]}")
+            return
+
+        # 2. 更新失败次数与有效性
+        key_outcomes.inc(str(state.id), "failure")
+        self._touch(state)
+        if WORKERS > 1:
+            # 多进程模式下以数据库为准：原子累加失败次数，并采用返回的计数与有效性
+            failure_count, is_valid = await self._increment_failure(state, max_failure_count)
+        else:
+            failure_count, is_valid = state.failure_count + 1, state.is_valid and state.failure_count + 1 < max_failure_count
+            await telemetry_queue.put(self._INCREMENT_FAILURE_SQL, (max_failure_count, state.id))
+        state.failure_count = failure_count
+        if not is_valid:
+            # 立即从内存池中移除，避免失效密钥被再次取出
+            self._set_valid(state, False)
+            logging.warning(f"Key ...{key[-4:]} (ID: {state.id}) has been invalidated after {state.failure_count} failures.")
+        else:
+            logging.info(f"Recorded failure {state.failure_count}/{max_failure_count} for key ...{key[-4:]} (ID: {state.id}).")
+
+        timestamp = utc_timestamp()
+        # 3. 插入错误日志
+        if status_code and error_message:
+            await telemetry_queue.put(
+                "INSERT INTO error_logs (key_id, model_name, identification_code, error_message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (state.id, model_name, status_code, error_message, timestamp)
+            )
+            logging.info(f"Logged error for key ID {state.id}: Status {status_code}")
+
+        # 4. 记录调用历史和月度统计 (仅当模型名称存在时)
+        if model_name:
+            await self._record_call(state.id, model_name, status_code, timestamp)
+
+    async def record_rate_limited(self, key: str, model_name: str | None, retry_after: float | None = None, error_message: str | None = None):
+        """
+        记录一次上游 429：将密钥隔离到冷却结束，并记录错误日志与调用历史，
+        但不增加失败计数，避免仅被限流的密钥被永久判定为无效。
+        """
+        self.quarantine(key, retry_after)
+        state = self._states.get(key)
+        if state is None:
+            return
+        key_outcomes.inc(str(state.id), "rate_limited")
+
+        timestamp = utc_timestamp()
+        if error_message:
+            await telemetry_queue.put(
+                "INSERT INTO error_logs (key_id, model_name, identification_code, error_message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (state.id, model_name, 429, error_message, timestamp)
+            )
+        if model_name:
+            await self._record_call(state.id, model_name, 429, timestamp)
 
     async def log_request_failure(self, key: str, model_name: str | None, status_code: int, error_message: str):
         """
         纯粹地记录一次请求失败到 error_logs，不影响密钥的失败计数或有效状态。
-        这用于记录那些被内部重试机制处理的临时性失败。
+        这用于记录那些被内部重试机制处理的临时性失败。写入经由写后缓冲队列完成。
         """
-        async with self.db_write_lock:
-            async with aiosqlite.connect(self.db_url) as db:
-                cursor = await db.execute("SELECT id FROM api_keys WHERE key = ?", (key,))
-                row = await cursor.fetchone()
-                if not row:
-                    logging.warning(f"Attempted to log failure for a key that does not exist: {key}")
-                    return
-                
-                key_id = row[0]
-                await db.execute(
-                    "INSERT INTO error_logs (key_id, model_name, identification_code, error_message) VALUES (?, ?, ?, ?)",
-                    (key_id, model_name, status_code, error_message)
-                )
-                await db.commit()
-                logging.info(f"Logged temporary failure for key ID {key_id}: Status {status_code}")
+        state = self._states.get(key)
+        if state is None:
+            logging.warning(f"Attempted to log failure for a key that does not exist: ...{key[-4:]}")
+            return
+
+        await telemetry_queue.put(
+            "INSERT INTO error_logs (key_id, model_name, identification_code, error_message, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (state.id, model_name, status_code, error_message, utc_timestamp())
+        )
+        logging.info(f"Queued temporary failure for key ID {state.id}: Status {status_code}")
 
     async def record_success(self, key: str, model_name: str | None):
         """
         在密钥成功使用后，重置其失败计数，更新其最后使用时间，记录模型调用历史，并更新月度统计。
+        内存状态立即更新，所有写操作进入写后缓冲队列，不阻塞响应返回。
         """
-        import datetime
-
-        async with self.db_write_lock:
-            async with aiosqlite.connect(self.db_url) as db:
-                async with db.execute("BEGIN"):
-                    # 1. 重置失败计数并更新时间戳
-                    await db.execute(
-                        "UPDATE api_keys SET is_valid = 1, failure_count = 0, last_used = CURRENT_TIMESTAMP WHERE key = ?",
-                        (key,)
-                    )
-                    
-                    # 2. 记录详细调用历史和月度统计 (仅当模型名称存在时)
-                    if model_name:
-                        cursor = await db.execute("SELECT id FROM api_keys WHERE key = ?", (key,))
-                        row = await cursor.fetchone()
-                        if row:
-                            key_id = row[0]
-                            await db.execute(
-                                "INSERT INTO api_call_history (key_id, model_name, identification_code) VALUES (?, ?, ?)",
-                                (key_id, model_name, 200)
-                            )
-                            current_month = datetime.datetime.now(ZoneInfo("Asia/Shanghai")).strftime('%Y-%m')
-                            await db.execute("""
-                                INSERT INTO monthly_stats (year_month, call_count) VALUES (?, 1)
-                                ON CONFLICT(year_month) DO UPDATE SET call_count = call_count + 1
-                            """, (current_month,))
-
-                await db.commit()
+        state = self._states.get(key)
+        if state is None:
+            logging.warning(f"Attempted to record success for a key that does not exist: ...{key[-4:]}")
+            return
+
+        # 1. 重置失败计数并更新时间戳
+        key_outcomes.inc(str(state.id), "success")
+        timestamp = utc_timestamp()
+        self._touch(state)
+        self._set_valid(state, True)
+        state.failure_count = 0
+        state.last_used = timestamp
+        await telemetry_queue.put(
+            "UPDATE api_keys SET is_valid = 1, failure_count = 0, last_used = ? WHERE id = ?",
+            (timestamp, state.id)
+        )
+
+        # 2. 记录详细调用历史和月度统计 (仅当模型名称存在时)
+        if model_name:
+            await self._record_call(state.id, model_name, 200, timestamp)
 
 async def initialize_database():
     """初始化所有数据库相关的管理器和表"""
     logging.info("Initializing database...")
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        await db.execute("PRAGMA journal_mode=WAL;")
-        await db.execute("PRAGMA synchronous = NORMAL;")
-        await db.execute("PRAGMA cache_size = -4096;")
-        await db.execute("PRAGMA temp_store = MEMORY;")
-        await db.execute("PRAGMA busy_timeout = 5000;")
+    # 打开共享连接池；WAL 及各连接的 PRAGMA 在此一次性设置
+    await db_pool.open()
+    async with db_pool.writer() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS api_keys (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -376,10 +1188,45 @@ async def initialize_database():
             )
         """)
         await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON admin_sessions (expires_at)")
+        # 跨进程密钥租约：每个密钥至多被一个进程持有（过期后可被重新认领）
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS key_leases (
+                key_id INTEGER PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_key_leases_holder ON key_leases (holder)")
+        # 多进程模式下的调度器领导者租约（单行）
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_lease (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
         # 为 api_keys 表添加索引以优化密钥获取性能
         await db.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_validation ON api_keys (is_valid, last_used)")
+        # 日志浏览的游标分页按 (timestamp, id) 倒序读取，按密钥、模型或状态码筛选时使用带对应前缀的索引
+        for table in ("error_logs", "api_call_history"):
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp, id)")
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_key_timestamp ON {table} (key_id, timestamp, id)")
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_model_timestamp ON {table} (model_name, timestamp, id)")
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_code_timestamp ON {table} (identification_code, timestamp, id)")
+        # 调用统计的分钟/小时/日汇总表，以及升级前历史数据的回填标记
+        await create_rollup_tables(db)
+        await init_backfill_marker(db)
         await db.commit()
 
+    # 表结构就绪后一次性加载配置快照
+    await config_manager.load()
+    if int(config_manager.get_cached(BACKFILL_CURSOR_KEY) or 0) < int(config_manager.get_cached(BACKFILL_UNTIL_KEY) or 0):
+        logging.warning("Call statistics rollups are missing history from before the upgrade. Run `python -m api.rollups backfill` or POST /admin/rollups/backfill.")
+    # 用最近 24 小时的分钟汇总预热实时统计窗口
+    async with db_pool.reader() as db:
+        seeded = await live_stats.seed(db)
+    logging.info(f"Seeded live call stats from {seeded} rollup rows.")
+
     # 在初始化期间，批量植入配置，避免多次重启调度器
     config_manager.begin_bulk_update()
     try:
@@ -456,8 +1303,15 @@ async def initialize_database():
 
     # 初始化 KeyManager
     await key_manager.initialize_from_env()
+    await key_manager.load_key_states()
     await key_manager.prewarm_pool()
 
+    # 启动调用统计的后台批量写入
+    telemetry_queue.start()
+
 # 创建单例
+db_pool = DatabasePool()
+telemetry_queue = TelemetryQueue()
 config_manager = ConfigManager()
-key_manager = KeyManager(pool_size=30)
\ No newline at end of file
+key_manager = KeyManager(pool_size=30)
+worker_state_sync = WorkerStateSync(WORKER_SYNC_INTERVAL_SECONDS)
\ No newline at end of file
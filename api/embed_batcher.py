@@ -0,0 +1,119 @@
+"""
+单条 embedContent 请求的透明微批处理。
+
+在一个很短的时间窗口内（或攒满 N 条时），把同一模型、同一访问密钥的并发 embedContent 请求合并为一次上游
+batchEmbedContents 调用，再把结果按顺序拆分给各个等待中的客户端。这样上游请求数（以及单个密钥的
+RPM 压力）可以下降一个数量级。上游因请求内容拒绝整个批次（4xx）时，逐条重新发送，
+一条格式错误的请求不会连累同批的其他请求。
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import httpx
+
+# send_batch(model, access_key, items) -> 与 items 一一对应的向量列表
+SendBatch = Callable[[str, str | None, list[dict]], Awaitable[list[list[float]]]]
+
+def _is_client_error(error: BaseException) -> bool:
+    """上游以 4xx（限流除外）拒绝了请求内容。"""
+    return isinstance(error, httpx.HTTPStatusError) and 400 <= error.response.status_code < 500 and error.response.status_code != 429
+
+class _PendingBatch:
+    __slots__ = ("items", "futures", "timer")
+
+    def __init__(self):
+        self.items: list[dict] = []
+        self.futures: list[asyncio.Future] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+class EmbedBatcher:
+    def __init__(self):
+        # (模型, 访问密钥) -> 当前窗口的批次
+        self._pending: dict[tuple[str, str | None], _PendingBatch] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.failed_batches = 0
+        self.split_batches = 0
+
+    def submit(self, model: str, access_key: str | None, item: dict, send_batch: SendBatch, window_seconds: float, max_items: int) -> asyncio.Future:
+        """加入当前窗口，返回该条目的向量 Future。不同访问密钥的请求不会合并，以便按访问密钥统计。"""
+        group = (model, access_key)
+        batch = self._pending.get(group)
+        if batch is None:
+            batch = self._pending[group] = _PendingBatch()
+            batch.timer = asyncio.get_running_loop().call_later(window_seconds, self._flush, group, send_batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= max_items:
+            self._flush(group, send_batch)
+        return future
+
+    def _flush(self, group: tuple[str, str | None], send_batch: SendBatch):
+        batch = self._pending.pop(group, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._send(group, batch, send_batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, group: tuple[str, str | None], batch: _PendingBatch, send_batch: SendBatch):
+        model, access_key = group
+        self.batches += 1
+        self.items += len(batch.items)
+        try:
+            results = await send_batch(model, access_key, batch.items)
+            if len(results) != len(batch.items):
+                raise ValueError(f"Expected {len(batch.items)} embeddings, got {len(results)}.")
+        except BaseException as e:
+            self.failed_batches += 1
+            logging.warning(f"Batched embedContent call for model {model} ({len(batch.items)} items) failed: {e}")
+            if isinstance(e, asyncio.CancelledError):
+                self._fail(batch.futures, e)
+                raise
+            if len(batch.items) > 1 and _is_client_error(e):
+                # 整批被拒绝时无法确定是哪一条请求有问题：逐条发送，每条得到自己的结果或错误
+                self.split_batches += 1
+                await asyncio.gather(*(
+                    self._send_single(model, access_key, item, future, send_batch)
+                    for item, future in zip(batch.items, batch.futures)
+                ))
+                return
+            self._fail(batch.futures, e)
+            return
+        for future, values in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(values)
+
+    async def _send_single(self, model: str, access_key: str | None, item: dict, future: asyncio.Future, send_batch: SendBatch):
+        try:
+            results = await send_batch(model, access_key, [item])
+            if len(results) != 1:
+                raise ValueError(f"Expected 1 embedding, got {len(results)}.")
+        except Exception as e:
+            self._fail([future], e)
+            return
+        if not future.done():
+            future.set_result(results[0])
+
+    @staticmethod
+    def _fail(futures: list[asyncio.Future], error: BaseException):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "failed_batches": self.failed_batches,
+            "split_batches": self.split_batches,
+            "pending_models": len(self._pending),
+        }
+
+embed_batcher = EmbedBatcher()
@@ -0,0 +1,150 @@
+"""
+内容寻址的嵌入向量缓存（embedContent / batchEmbedContents）。
+
+同一模型、任务类型、输出维度与文本的嵌入结果是确定的。向量以 float32 追加写入一个
+内存映射文件，每条记录为 32 字节的 SHA-256 键 + 4 字节维度 + dim 个 float32；
+启动时顺序扫描文件重建内存索引（键 -> 偏移量）。
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+
+from api.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES
+
+_HEADER = struct.Struct("<32sI")
+
+def embedding_key(model: str | None, request: dict) -> bytes:
+    """按 (模型, taskType, outputDimensionality, title, content) 计算缓存键。"""
+    model = (model or "").removeprefix("models/")
+    canonical = json.dumps(
+        [model, request.get("taskType"), request.get("outputDimensionality"), request.get("title"), request.get("content")],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).digest()
+
+def values_json(values) -> str:
+    """float32 最多 9 位有效数字即可无损往返，避免 float64 形式的冗长小数。"""
+    return "[" + ",".join(f"{v:.9g}" for v in values) + "]"
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._mm: mmap.mmap | None = None
+        self._size = 0
+        # 键 -> (向量起始偏移, 维度)
+        self._index: dict[bytes, tuple[int, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def open(self):
+        self._file = open(self.path, "a+b")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._remap()
+        self._rebuild_index()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._size:
+            self._mm = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def _rebuild_index(self):
+        offset = 0
+        while offset + _HEADER.size <= self._size:
+            key, dim = _HEADER.unpack_from(self._mm, offset)
+            end = offset + _HEADER.size + dim * 4
+            if end > self._size:
+                break
+            self._index[key] = (offset + _HEADER.size, dim)
+            offset = end
+        if offset != self._size:
+            # 上次写入中断留下的不完整记录
+            logging.warning(f"Truncating {self._size - offset} trailing bytes of incomplete records in {self.path}.")
+            self._file.truncate(offset)
+            self._size = offset
+            self._remap()
+        logging.info(f"Embedding cache loaded {len(self._index)} vectors ({self._size} bytes) from {self.path}.")
+
+    def get(self, key: bytes) -> tuple[float, ...] | None:
+        """直接从内存映射中解码 float32 向量，未命中返回 None。"""
+        location = self._index.get(key)
+        if location is None:
+            self.misses += 1
+            return None
+        offset, dim = location
+        # 多个工作进程共享同一文件，每次读取前都对照文件的实际大小
+        actual = os.fstat(self._file.fileno()).st_size
+        mapped = len(self._mm) if self._mm is not None else 0
+        if actual < mapped:
+            # 其他进程清空了文件：旧映射中超出文件末尾的页一经访问就会触发 SIGBUS，索引也已全部失效
+            self._index.clear()
+            self._size = actual
+            self._remap()
+            self.misses += 1
+            return None
+        if offset + dim * 4 > mapped:
+            self._size = actual
+            self._remap()
+        # 文件被清空后又被重新写入时，记录头中的键将不再匹配
+        if self._mm is None or offset + dim * 4 > len(self._mm) or self._mm[offset - _HEADER.size:offset - 4] != key:
+            del self._index[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        return struct.unpack_from(f"<{dim}f", self._mm, offset)
+
+    def put(self, key: bytes, values: list[float]):
+        if key in self._index or not values:
+            return
+        record = _HEADER.pack(key, len(values)) + struct.pack(f"<{len(values)}f", *values)
+        if self._size + len(record) > self.max_bytes:
+            logging.warning(f"Embedding cache reached {self.max_bytes} bytes. Starting over.")
+            self.clear()
+            self.resets += 1
+        # 追加模式下单次 write 是原子的；写入后的文件位置即本条记录的结尾（其他进程可能也在追加）
+        self._file.write(record)
+        self._file.flush()
+        end = self._file.tell()
+        self._index[key] = (end - len(record) + _HEADER.size, len(values))
+        # 新记录在下次读取越界时才重新映射，批量写入只需一次 remap
+        self._size = max(self._size, end)
+
+    def clear(self):
+        self._index.clear()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.truncate(0)
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.is_open,
+            "vectors": len(self._index),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "resets": self.resets,
+        }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES)
@@ -41,4 +41,14 @@ class ServiceUnavailableError(APIError):
 class AllKeysFailedError(ServiceUnavailableError):
     """所有 API Key 均失败的特定错误"""
     def __init__(self, detail: str = "All available API keys have failed. Please check key validity or add new keys."):
-        super().__init__(detail=detail, status_code=503)
\ No newline at end of file
+        super().__init__(detail=detail, status_code=503)
+
+class AllKeysRateLimitedError(APIError):
+    """所有可用 API Key 均处于限流冷却期的错误 (429)，附带建议的重试等待秒数"""
+    def __init__(self, retry_after: int, detail: str | None = None):
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=429,
+            detail=detail or f"All available API keys are cooling down after upstream rate limiting. Retry after {retry_after} seconds.",
+            error_code="rate_limited",
+        )
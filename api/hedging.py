@@ -0,0 +1,78 @@
+"""
+非流式 generateContent 的对冲请求（hedged requests）。
+
+主请求在动态阈值（该模型近期首字节时间的 p95）内仍未收到响应头时，使用另一个密钥
+发送相同的请求体，取先完成者并取消另一个。每个访问密钥都有独立的对冲预算，
+以限制额外的上游开销。
+"""
+import math
+from collections import deque
+
+# 每个模型保留的首字节时间样本数
+TTFB_SAMPLE_SIZE = 200
+# 样本少于该数量时使用默认阈值
+TTFB_MIN_SAMPLES = 20
+# 对冲预算的最大积攒额度（次）
+HEDGE_BUDGET_BURST = 10.0
+
+class TtfbTracker:
+    """按模型记录最近的首字节时间（秒），用于计算对冲阈值。"""
+
+    def __init__(self, sample_size: int = TTFB_SAMPLE_SIZE):
+        self._sample_size = sample_size
+        self._samples: dict[str, deque] = {}
+
+    def observe(self, model: str | None, seconds: float):
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=self._sample_size)
+        samples.append(seconds)
+
+    def percentile(self, model: str | None, q: float = 0.95) -> float | None:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < TTFB_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def threshold(self, model: str | None, default: float, minimum: float) -> float:
+        """返回该模型的对冲等待时间：p95 首字节时间，样本不足时使用 default，不低于 minimum。"""
+        p95 = self.percentile(model)
+        return max(minimum, p95 if p95 is not None else default)
+
+    def snapshot(self) -> dict:
+        return {
+            model: {"samples": len(samples), "p95_seconds": self.percentile(model)}
+            for model, samples in self._samples.items()
+        }
+
+class HedgeBudget:
+    """
+    按访问密钥的对冲预算：每个符合条件的请求存入 ratio 次额度（上限 HEDGE_BUDGET_BURST），
+    每次对冲消耗 1 次，因此长期来看对冲请求数不超过请求总数的 ratio 倍。
+    """
+
+    def __init__(self):
+        self._credits: dict[str, float] = {}
+        self.launched = 0
+        self.won = 0
+        self.denied = 0
+
+    def deposit(self, access_key: str | None, ratio: float):
+        credits = self._credits.get(access_key, 0.0) + ratio
+        self._credits[access_key] = min(HEDGE_BUDGET_BURST, credits)
+
+    def withdraw(self, access_key: str | None) -> bool:
+        credits = self._credits.get(access_key, 0.0)
+        if credits < 1.0:
+            self.denied += 1
+            return False
+        self._credits[access_key] = credits - 1.0
+        self.launched += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"launched": self.launched, "won": self.won, "denied_by_budget": self.denied}
+
+ttfb_tracker = TtfbTracker()
+hedge_budget = HedgeBudget()
@@ -1,20 +1,37 @@
 from fastapi import FastAPI, Request, Response, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import httpx
 import logging
+import logging.handlers
+import queue
 import asyncio
 import os
+import re
+import json
+import hashlib
 import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from api.path_builder import build_upstream_url
 
-from api.database import key_manager, config_manager, initialize_database
-from api.config import ENVIRONMENT
+from api.database import key_manager, config_manager, initialize_database, db_pool, telemetry_queue, worker_state_sync
+from api.config import ENVIRONMENT, WORKERS, LOG_LEVEL, LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT, HEDGE_ENABLED, HEDGE_BUDGET_RATIO, HEDGE_DEFAULT_DELAY_MS, HEDGE_MIN_DELAY_MS, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_DISABLED_ACCESS_KEYS, EMBEDDING_CACHE_ENABLED, SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_ALL_POSTS, EMBED_BATCH_ENABLED, EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_ITEMS
+from api.hedging import ttfb_tracker, hedge_budget
+from api.upstream import upstream_clients
+from api.metadata_cache import metadata_cache, CachedResponse
+from api.response_cache import response_cache, is_deterministic, cache_key
+from api.embedding_cache import embedding_cache, embedding_key, values_json
+from api.single_flight import single_flight
+from api.embed_batcher import embed_batcher
+from api.metrics import registry as metrics_registry, model_labels, upstream_latency, upstream_ttfb, stream_duration, key_acquire_wait, key_rotations, upstream_retries, rate_limited, key_pool, upstream_pool
+from api.utils import split_access_keys
 from api.security import security_service
 from api.exceptions import APIError, ServiceUnavailableError, UnretryableError, AllKeysFailedError, NotFoundError
 from api.admin import router as admin_router
-from api.scheduler import start_scheduler, stop_scheduler
+from api.scheduler import start_scheduler, stop_scheduler, release_scheduler_lease
+from api.request_logging import RequestLoggingMiddleware
 from pydantic import BaseModel
 import mimetypes
 
@@ -28,91 +45,86 @@ mimetypes.add_type("application/javascript", ".js")
 class UTCFormatter(logging.Formatter):
     converter = time.gmtime
 
-# 配置日志记录器
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s.%(msecs)03dZ - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%dT%H:%M:%S'
-)
-
-# 将 UTC Formatter 应用到根 logger
-logging.getLogger().handlers[0].setFormatter(UTCFormatter(
-    fmt='%(asctime)s.%(msecs)03dZ - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%dT%H:%M:%S'
-))
-logger = logging.getLogger(__name__)
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    只把日志记录放入队列，格式化与 I/O 都交给后台监听线程。
+    默认的 QueueHandler.prepare 会在调用线程（即事件循环）中格式化消息；这里仅预先渲染异常堆栈，
+    其余格式化推迟到监听线程。调用方需使用 %-style 的不可变参数。
+    """
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
 
-# --- 全局变量 ---
-client: httpx.AsyncClient | None = None
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    配置基于队列的日志管道：根 logger 只做入队（永不阻塞），后台线程负责写入 stderr
+    以及可选的滚动日志文件，缓慢的终端或磁盘 I/O 不会阻塞事件循环。
+    """
+    formatter = UTCFormatter(
+        fmt='%(asctime)s.%(msecs)03dZ - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%S'
+    )
+    sinks: list[logging.Handler] = [logging.StreamHandler()]
+    if LOG_FILE:
+        sinks.append(logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT, encoding="utf-8"))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
 
 # --- 应用生命周期管理 ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """管理应用的生命周期事件，确保资源被正确初始化和关闭。"""
-    global client
     logger.info("Initializing database and managers...")
     await initialize_database()
     logger.info("Database and managers initialized.")
+    # 多个工作进程时只有持有数据库租约的进程运行调度器
     await start_scheduler()
+    if WORKERS > 1:
+        # 各进程的配置与密钥状态在内存中，定期与数据库对齐
+        worker_state_sync.start()
     
-    limits = httpx.Limits(max_connections=120, max_keepalive_connections=20)
-    client = httpx.AsyncClient(timeout=300, limits=limits)
+    await upstream_clients.start()
+    await response_cache.start()
+    if EMBEDDING_CACHE_ENABLED:
+        embedding_cache.open()
     yield
     
-    if client:
-        await client.aclose()
-        logger.info("HTTP client closed.")
+    await upstream_clients.close()
+    logger.info("HTTP clients closed.")
+    await response_cache.close()
+    embedding_cache.close()
+    await worker_state_sync.stop()
     stop_scheduler()
+    await release_scheduler_lease()
+    await key_manager.release_key_leases()
+    # 关闭连接池前刷新尚未落盘的调用统计
+    await telemetry_queue.stop()
+    await db_pool.close()
+    # 停止监听线程前会写完队列中剩余的日志
+    log_listener.stop()
 
 # --- FastAPI 应用实例 ---
 app = FastAPI(lifespan=lifespan)
 
 # --- 日志中间件 ---
-@app.middleware("http")
-async def detailed_logging_middleware(request: Request, call_next):
-    """记录每个请求和响应的详细信息。"""
-    import time
-    import json
-
-    start_time = time.time()
-    
-    # 准备请求日志详情
-    request_details = {
-        "client": request.client.host if request.client else "unknown",
-        "method": request.method,
-        "path": request.url.path,
-    }
-    
-    # 过滤敏感头部
-    sensitive_headers = {"authorization", "x-goog-api-key", "cookie", "set-cookie"}
-    headers = {k: v for k, v in request.headers.items() if k.lower() not in sensitive_headers}
-    request_details["headers"] = headers
-
-    # 掩蔽敏感查询参数
-    try:
-        qp = dict(request.query_params)
-        if "key" in qp:
-            qp["key"] = "***"
-        request_details["query"] = qp
-    except Exception:
-        request_details["query"] = str(request.query_params)
-    
-    logger.info(f"Request received: {json.dumps(request_details, indent=2, ensure_ascii=False)}")
-    # 不再记录请求体，避免敏感信息泄露
-
-
-    response = await call_next(request)
-
-    process_time = (time.time() - start_time) * 1000
-    
-    # 准备响应日志详情
-    response_details = {
-        "status_code": response.status_code,
-        "process_time_ms": f"{process_time:.2f}",
-    }
-    logger.info(f"Response sent: {json.dumps(response_details, indent=2, ensure_ascii=False)}")
-
-    return response
+# 纯 ASGI 中间件：不缓冲响应、不影响流式背压，按采样率记录每个请求的一条日志
+app.add_middleware(RequestLoggingMiddleware)
 
 # --- 挂载管理 API ---
 app.include_router(admin_router)
@@ -154,6 +166,16 @@ async def login(payload: LoginPayload):
         logger.error(f"Login error: {e}")
         raise APIError(status_code=500, detail="An internal error occurred during login.")
 
+# --- Prometheus 指标 ---
+# 量表在抓取时读取各模块的实时状态
+key_pool.set_function(key_manager.pool_metrics)
+upstream_pool.set_function(upstream_clients.pool_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(_=Depends(security_service.verify_metrics_token)):
+    """以 Prometheus 文本格式导出进程内指标（使用独立的 METRICS_TOKEN 鉴权）。"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/logout")
 async def logout(request: Request):
     """管理员登出端点，清除 Cookie 和数据库中的会话。"""
@@ -170,9 +192,11 @@ async def logout(request: Request):
 async def api_error_handler(request: Request, exc: APIError):
     """处理自定义的 API 错误"""
     logger.error(f"API Error: {exc.detail} (Code: {exc.error_code})", exc_info=False)
+    retry_after = getattr(exc, "retry_after", None)
     return JSONResponse(
         status_code=exc.status_code,
         content={"error": {"code": exc.error_code, "message": exc.detail}},
+        headers={"Retry-After": str(retry_after)} if retry_after else None,
     )
 
 @app.exception_handler(Exception)
@@ -190,6 +214,35 @@ async def general_exception_handler(request: Request, exc: Exception):
     )
 
 # --- 核心代理服务 ---
+# 从响应中提取实际 token 用量，用于修正密钥的 TPM 令牌桶
+_TOTAL_TOKENS_RE = re.compile(rb'"totalTokenCount"\s*:\s*(\d+)')
+
+def _extract_token_usage(data: bytes | None) -> int | None:
+    """返回响应体中最后一个 totalTokenCount 的值（流式响应的最后一块包含累计用量）。"""
+    if not data:
+        return None
+    matches = _TOTAL_TOKENS_RE.findall(data)
+    return int(matches[-1]) if matches else None
+
+# Gemini 429 错误体中 google.rpc.RetryInfo 的 retryDelay，例如 "retryDelay": "12s"
+_RETRY_DELAY_RE = re.compile(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"')
+
+def _parse_retry_delay(response: httpx.Response) -> float | None:
+    """从 Retry-After 头（秒数或 HTTP 日期）或错误体的 retryDelay 中解析建议的冷却秒数。"""
+    retry_after = response.headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    match = _RETRY_DELAY_RE.search(response.text)
+    if match:
+        return float(match.group(1))
+    return None
+
 class ProxyService:
     """封装代理逻辑，使其更清晰、可测试。"""
     MAX_KEY_ROTATIONS = 10
@@ -199,27 +252,51 @@ class ProxyService:
 
     def _parse_model_name(self, path: str) -> str | None:
         """从请求路径中解析出模型名称。"""
-        import re
         # 使用更健壮的正则表达式，以处理 tunedModels 和不带冒号的路径
         match = re.search(r"(?:models|tunedModels)/([^:/]+)", path)
         if match:
             return match.group(1)
         return None
 
-    async def _stream_generator(self, response: httpx.Response):
-        """安全的异步生成器，用于代理流式响应并确保连接被关闭。"""
+    # 不应透传给客户端的逐跳头部及由 ASGI 服务器重新生成的头部
+    HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade", "content-length", "date", "server"}
+
+    def _client_accepts_encoding(self, accept_encoding: str, encoding: str) -> bool:
+        """判断客户端的 Accept-Encoding 是否接受指定编码（忽略 q=0 的条目）。"""
+        for item in accept_encoding.lower().split(","):
+            token, _, params = item.strip().partition(";")
+            if token.strip() in (encoding, "*"):
+                return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+        return False
+
+    async def _stream_generator(self, response: httpx.Response, key: str, model_name: str | None, est_tokens: int, raw: bool = False):
+        """
+        安全的异步生成器，用于代理流式响应并确保连接被关闭、密钥的在途计数被释放。
+        raw 为 True 时直接转发上游的原始字节（不解压、不重新分块），此时无法从压缩数据中读取 token 用量。
+        """
+        last_chunk = None
+        started = time.monotonic()
         try:
-            async for chunk in response.aiter_bytes():
+            async for chunk in (response.aiter_raw() if raw else response.aiter_bytes()):
+                last_chunk = chunk
                 yield chunk
         finally:
+            stream_duration.observe(time.monotonic() - started, model_labels.label(model_name))
             await response.aclose()
-            logger.info("Stream closed and connection released.")
+            key_manager.release_key(key, model_name, est_tokens, _extract_token_usage(last_chunk))
+            logger.debug("Stream closed and connection released.")
 
-    async def _send_request_with_single_key(self, method: str, url: str, headers: dict, params: dict, content: bytes, key: str, model_name: str | None) -> Response:
-        """使用单个密钥发送请求，并内置重试逻辑。"""
-        global client
-        assert client is not None, "HTTP Client not initialized."
-        
+    def _estimate_tokens(self, method: str, body: bytes) -> int:
+        """粗略估算请求消耗的 token 数（约 4 字节 / token），用于 TPM 令牌桶预扣。"""
+        if method != "POST" or not body:
+            return 0
+        return len(body) // 4
+
+    async def _send_request_with_single_key(self, method: str, url: str, headers: dict, params: dict, content: bytes, key: str, model_name: str | None, est_tokens: int = 0, headers_event: asyncio.Event | None = None) -> Response:
+        """
+        使用单个密钥发送请求，并内置重试逻辑。
+        传入 headers_event 时，首次收到上游的成功响应头即置位，并记录该模型的首字节时间（用于对冲阈值）。
+        """
         max_retry_count_str = await config_manager.get_config("MAX_RETRY_COUNT")
         max_retries = int(max_retry_count_str) if max_retry_count_str else 3
         
@@ -228,20 +305,44 @@ class ProxyService:
         last_exception = None
 
         for attempt in range(max_retries):
+            if attempt > 0:
+                upstream_retries.inc(model_labels.label(model_name))
             try:
-                logger.info(f"Sending request to upstream (Key: ...{key[-4:]}, Attempt: {attempt + 1}/{max_retries})")
+                logger.info("Sending request to upstream (Key: ...%s, Attempt: %d/%d)", key[-4:], attempt + 1, max_retries)
+                # 流式与非流式请求使用各自的连接池；每次尝试都重新获取，退避期间连接池可能已被热更新替换并关闭
+                client = upstream_clients.client_for(is_streaming)
                 req = client.build_request(method=method, url=url, headers=headers, params=params, content=content)
+                sent_at = time.monotonic()
                 r = await client.send(req, stream=True)
+                if 200 <= r.status_code < 300:
+                    model_labels.mark_seen(model_name)
+                upstream_ttfb.observe(time.monotonic() - sent_at, model_labels.label(model_name))
+                # 只有成功的响应头才算"已响应"：出错后主请求还要退避重试，仍应允许对冲
+                if headers_event is not None and not headers_event.is_set() and r.status_code < 400:
+                    headers_event.set()
+                    ttfb_tracker.observe(model_name, time.monotonic() - sent_at)
 
                 # 成功
                 if r.status_code < 400:
                     await key_manager.record_success(key, model_name)
-                    logger.info(f"Key ...{key[-4:]} succeeded with status {r.status_code} for model {model_name}.")
+                    logger.info("Key ...%s succeeded with status %d for model %s.", key[-4:], r.status_code, model_name)
                     
                     if is_streaming:
-                        return StreamingResponse(self._stream_generator(r), status_code=r.status_code, media_type=r.headers.get("content-type"))
+                        # 客户端接受上游的压缩编码时原样透传字节，否则解压后再转发
+                        encoding = r.headers.get("content-encoding", "").lower()
+                        raw = not encoding or encoding == "identity" or self._client_accepts_encoding(headers.get("accept-encoding", ""), encoding)
+                        stream_headers = {
+                            k: v for k, v in r.headers.items()
+                            if k.lower() not in self.HOP_BY_HOP_HEADERS and (raw or k.lower() != "content-encoding")
+                        }
+                        return StreamingResponse(self._stream_generator(r, key, model_name, est_tokens, raw), status_code=r.status_code, headers=stream_headers, media_type=r.headers.get("content-type"))
                     
-                    response_content = await r.aread()
+                    try:
+                        response_content = await r.aread()
+                    finally:
+                        # 对冲落败时任务可能在读取响应体期间被取消，确保连接被释放
+                        await r.aclose()
+                    upstream_latency.observe(time.monotonic() - sent_at, model_labels.label(model_name))
                     final_headers = {k: v for k, v in r.headers.items() if k.lower() not in ['content-encoding', 'transfer-encoding', 'content-length']}
                     final_headers['content-length'] = str(len(response_content))
                     return Response(content=response_content, status_code=r.status_code, headers=final_headers, media_type=r.headers.get("content-type"))
@@ -259,7 +360,7 @@ class ProxyService:
                 # 如果是明确的、不可重试的客户端错误，立即向上抛出，终止此密钥的所有重试
                 # 403 (权限) 和 429 (速率限制) 错误应立即触发密钥轮换，而不是在同一个密钥上重试
                 if r.status_code in {400, 403, 429}:
-                    logger.warning(f"Key rotation triggered for status {r.status_code} for key ...{key[-4:]}. Rotating immediately.")
+                    logger.warning("Key rotation triggered for status %d for key ...%s. Rotating immediately.", r.status_code, key[-4:])
                     raise httpx.HTTPStatusError(f"Status {r.status_code}: {error_body.decode()}", request=req, response=r) # Re-raise to trigger rotation
 
                 # 404 错误透传为 NotFound（避免错误映射为 400）
@@ -267,18 +368,18 @@ class ProxyService:
                     logger.warning("Upstream returned 404. Failing fast without retry for this key.")
                     raise NotFoundError(detail=error_body.decode())
 
-                logger.warning(f"Attempt {attempt + 1}/{max_retries} for key ...{key[-4:]} failed: {last_exception}")
+                logger.warning("Attempt %d/%d for key ...%s failed: %s", attempt + 1, max_retries, key[-4:], last_exception)
 
             except httpx.RequestError as e:
                 # 网络错误（例如超时、连接失败）现在也会利用重试循环
                 last_exception = e
-                logger.warning(f"Attempt {attempt + 1}/{max_retries} for key ...{key[-4:]} failed with a network error: {e}")
+                logger.warning("Attempt %d/%d for key ...%s failed with a network error: %s", attempt + 1, max_retries, key[-4:], e)
                 # 让循环继续，以便在下一次尝试前应用退避等待
             
             if attempt < max_retries - 1:
                 # 为 5xx 和网络错误的重试应用指数退避策略
                 wait_time = 2 ** attempt
-                logger.info(f"Waiting for {wait_time} seconds before next retry.")
+                logger.info("Waiting for %d seconds before next retry.", wait_time)
                 await asyncio.sleep(wait_time)
             
 
@@ -289,12 +390,97 @@ class ProxyService:
         raise Exception("Request failed after all retries with a single key.")
 
 
+    async def _record_key_error(self, key: str, model_name: str | None, exc: Exception):
+        """记录可轮换的密钥错误：429 隔离到冷却结束（不计入失败次数），其余计入密钥失败。"""
+        status_code = exc.response.status_code if isinstance(exc, httpx.HTTPStatusError) else None
+        error_message = exc.response.text if isinstance(exc, httpx.HTTPStatusError) else str(exc)
+
+        if status_code == 429:
+            rate_limited.inc(model_labels.label(model_name))
+            await key_manager.record_rate_limited(key, model_name, _parse_retry_delay(exc.response), error_message)
+        else:
+            await key_manager.record_failure(key, model_name, status_code, error_message)
+
+    def _should_hedge(self, method: str, path: str, params: dict) -> bool:
+        """仅对非流式 generateContent 启用对冲。"""
+        if method != "POST" or not path.endswith(":generateContent") or params.get("alt") == "sse":
+            return False
+        enabled = config_manager.get_cached("HEDGE_ENABLED")
+        return HEDGE_ENABLED if enabled is None else enabled == "true"
+
+    async def _send_hedged(self, send_kwargs: dict, key: str, model_name: str | None, est_tokens: int, access_key: str | None) -> tuple[Response, str]:
+        """
+        对冲发送：主请求在阈值（该模型首字节时间 p95）内未收到响应头时，用另一个密钥发送相同请求，
+        返回先成功者及产生该响应的密钥，并取消另一个。主请求的异常照常抛出，由调用方轮换密钥；
+        对冲密钥的记录与释放在此完成。
+        """
+        hedge_budget.deposit(access_key, float(config_manager.get_cached("HEDGE_BUDGET_RATIO") or HEDGE_BUDGET_RATIO))
+        delay = ttfb_tracker.threshold(
+            model_name,
+            int(config_manager.get_cached("HEDGE_DEFAULT_DELAY_MS") or HEDGE_DEFAULT_DELAY_MS) / 1000,
+            int(config_manager.get_cached("HEDGE_MIN_DELAY_MS") or HEDGE_MIN_DELAY_MS) / 1000,
+        )
+
+        headers_event = asyncio.Event()
+        primary = asyncio.create_task(self._send_request_with_single_key(**send_kwargs, key=key, headers_event=headers_event))
+        hedge = None
+        hedge_key = None
+        try:
+            header_wait = asyncio.create_task(headers_event.wait())
+            try:
+                done, _ = await asyncio.wait({primary, header_wait}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                header_wait.cancel()
+
+            if done or not hedge_budget.withdraw(access_key):
+                return await primary, key
+            try:
+                hedge_key = await key_manager.get_key(model_name, est_tokens)
+            except APIError:
+                # 没有其他可用密钥，只能继续等待主请求
+                return await primary, key
+            if hedge_key == key:
+                key_manager.release_key(hedge_key, model_name, est_tokens)
+                hedge_key = None
+                return await primary, key
+
+            logger.info(f"No response headers from key ...{key[-4:]} after {delay:.2f}s. Hedging with key ...{hedge_key[-4:]} for model {model_name}.")
+            hedge_kwargs = {**send_kwargs, "headers": dict(send_kwargs["headers"])}
+            hedge = asyncio.create_task(self._send_request_with_single_key(**hedge_kwargs, key=hedge_key))
+
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if primary in done and primary.exception() is None:
+                    return primary.result(), key
+                if hedge in done and hedge.exception() is None:
+                    hedge_budget.won += 1
+                    if primary.done() and not isinstance(primary.exception(), (APIError, httpx.RequestError)):
+                        await self._record_key_error(key, model_name, primary.exception())
+                    return hedge.result(), hedge_key
+            # 两者都失败：主请求的异常交由调用方处理并轮换
+            raise primary.exception()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+            if hedge_key is not None:
+                hedge_response = None
+                if hedge is not None and hedge.done() and not hedge.cancelled():
+                    hedge_error = hedge.exception()
+                    if hedge_error is None:
+                        hedge_response = hedge.result()
+                    elif not isinstance(hedge_error, (APIError, httpx.RequestError)):
+                        await self._record_key_error(hedge_key, model_name, hedge_error)
+                tokens_used = _extract_token_usage(hedge_response.body) if hedge_response is not None else None
+                key_manager.release_key(hedge_key, model_name, est_tokens, tokens_used)
+
     async def forward_request(self, request: Request, path: str) -> Response:
         """
         核心处理流程：获取密钥、轮换、重试、代理请求。
         """
         client_ip = request.client.host if request.client else "unknown"
-        logger.info(f"Received {request.method} request from {client_ip} for path: /{path}")
+        logger.info("Received %s request from %s for path: /%s", request.method, client_ip, path)
 
         target_url = await self._determine_target_url(path)
         
@@ -305,25 +491,254 @@ class ProxyService:
         headers = {k: v for k, v in request.headers.items() if k.lower() not in excluded_headers}
         
         request_body = await request.body()
-        
+        access_key = getattr(request.state, "access_key", None)
+        method = request.method
+
+        async def dispatch() -> Response:
+            return await self._dispatch(method, path, target_url, headers, query_params, request_body, access_key)
+
+        # 相同的并发请求合并为一次上游调用
+        flight_key = self._single_flight_key(method, path, headers, query_params, request_body, access_key)
+        if flight_key is not None:
+            return await single_flight.do(flight_key, dispatch)
+        return await dispatch()
+
+    def _single_flight_key(self, method: str, path: str, headers: dict, params: dict, body: bytes, access_key: str | None) -> str | None:
+        """
+        返回可合并请求的规范化哈希；不可合并时返回 None。
+        默认只合并幂等或确定性的调用：元数据 GET、嵌入与 countTokens、temperature 为 0 的生成请求。
+        其余 POST 仅在启用 SINGLE_FLIGHT_ALL_POSTS 时合并。
+        """
+        enabled = config_manager.get_cached("SINGLE_FLIGHT_ENABLED")
+        if not (SINGLE_FLIGHT_ENABLED if enabled is None else enabled == "true"):
+            return None
+        cache_control = headers.get("cache-control", "").lower()
+        if "no-cache" in cache_control or "no-store" in cache_control:
+            return None
+
+        if method == "GET":
+            if not self._is_metadata_request(method, path):
+                return None
+            # 元数据与密钥无关，可以跨访问密钥合并
+            access_key = None
+            payload = None
+        elif method == "POST":
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return None
+            all_posts = config_manager.get_cached("SINGLE_FLIGHT_ALL_POSTS")
+            if not (SINGLE_FLIGHT_ALL_POSTS if all_posts is None else all_posts == "true"):
+                action = path.rsplit(":", 1)[-1]
+                idempotent = action in ("embedContent", "batchEmbedContents", "countTokens")
+                deterministic = action in ("generateContent", "streamGenerateContent") and isinstance(payload, dict) and is_deterministic(payload)
+                if not (idempotent or deterministic):
+                    return None
+        else:
+            return None
+
+        # 上游响应的编码取决于 Accept-Encoding（流式原样透传），因此也计入键
+        canonical = json.dumps(
+            [method, path, sorted(params.items()), headers.get("accept-encoding", ""), access_key, payload],
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    async def _dispatch(self, method: str, path: str, target_url: str, headers: dict, query_params: dict, request_body: bytes, access_key: str | None) -> Response:
+        """依次尝试元数据缓存、嵌入缓存与响应缓存，最后按密钥轮换请求上游。"""
+        if self._is_metadata_request(method, path):
+            return await self._forward_metadata(path, target_url, headers, query_params)
+        if method == "POST" and path.endswith(":embedContent") and (embedding_cache.is_open or self._embed_batching_enabled()):
+            return await self._forward_embed(path, target_url, headers, query_params, request_body, access_key)
+        if embedding_cache.is_open and method == "POST":
+            if path.endswith(":batchEmbedContents"):
+                return await self._forward_batch_embed(path, target_url, headers, query_params, request_body, access_key)
+
+        # 确定性请求命中响应缓存时，不获取密钥也不请求上游
+        response_key = self._response_cache_key(method, path, headers, query_params, request_body, access_key)
+        if response_key is not None:
+            cached = await response_cache.get(response_key)
+            if cached is not None:
+                entry, tier = cached
+                return Response(content=entry.content, status_code=200, headers={**entry.headers, "X-Cache": "HIT", "X-Cache-Tier": tier})
+
+        response = await self._forward(method, path, target_url, headers, query_params, request_body, access_key)
+        if response_key is not None and response.status_code == 200 and not isinstance(response, StreamingResponse):
+            await response_cache.put(response_key, response.body, {k: v for k, v in response.headers.items() if k.lower() != "content-length"})
+            response.headers["X-Cache"] = "MISS"
+        return response
+
+    def _response_cache_key(self, method: str, path: str, headers: dict, params: dict, body: bytes, access_key: str | None) -> str | None:
+        """返回可缓存请求的缓存键；不满足条件（未启用、非确定性、客户端要求不缓存等）时返回 None。"""
+        if method != "POST" or not path.endswith(":generateContent") or params.get("alt") == "sse":
+            return None
+        enabled = config_manager.get_cached("RESPONSE_CACHE_ENABLED")
+        if not (RESPONSE_CACHE_ENABLED if enabled is None else enabled == "true"):
+            return None
+        disabled_keys = config_manager.get_cached("RESPONSE_CACHE_DISABLED_ACCESS_KEYS", RESPONSE_CACHE_DISABLED_ACCESS_KEYS)
+        if access_key in split_access_keys(disabled_keys):
+            return None
+        if "no-store" in headers.get("cache-control", "").lower():
+            return None
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or not is_deterministic(payload):
+            return None
+        return cache_key(access_key, self._parse_model_name(path), payload, params)
+
+    def _is_metadata_request(self, method: str, path: str) -> bool:
+        """模型列表与单个模型信息的 GET 请求与密钥无关，可以缓存。"""
+        return method == "GET" and re.fullmatch(r"v1beta/models(?:/[^:/]+)?", path) is not None
+
+    async def _forward_metadata(self, path: str, target_url: str, headers: dict, query_params: dict) -> Response:
+        """通过元数据缓存代理 GET 请求；缓存的 404 与直接请求一样以 NotFoundError 返回。"""
+        async def loader() -> CachedResponse:
+            try:
+                response = await self._forward("GET", path, target_url, dict(headers), dict(query_params), b"", None)
+            except NotFoundError as e:
+                return CachedResponse(404, e.detail.encode())
+            response_headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+            return CachedResponse(response.status_code, response.body, response_headers)
+
+        entry, cache_status = await metadata_cache.fetch(metadata_cache.make_key(path, query_params), loader)
+        if entry.status_code == 404:
+            raise NotFoundError(detail=entry.content.decode(errors="ignore"))
+        return Response(content=entry.content, status_code=entry.status_code, headers={**entry.headers, "X-Cache": cache_status})
+
+    def _embedding_response(self, content: str, cache_status: str, hits: int) -> Response:
+        # 仅启用了微批处理而没有嵌入缓存时，不返回缓存状态头
+        headers = {"X-Cache": cache_status, "X-Cache-Hits": str(hits)} if embedding_cache.is_open else {}
+        return Response(content=content, media_type="application/json", headers=headers)
+
+    def _embed_batching_enabled(self) -> bool:
+        enabled = config_manager.get_cached("EMBED_BATCH_ENABLED")
+        return EMBED_BATCH_ENABLED if enabled is None else enabled == "true"
+
+    async def _send_embed_batch(self, model: str, access_key: str | None, items: list[dict]) -> list[list[float]]:
+        """
+        将微批中的 embedContent 请求作为一次 batchEmbedContents 发往上游（由 _forward 负责密钥轮换）。
+        多条合并的批次遇到 400 时不轮换、不记录密钥失败，由微批处理器逐条重发。
+        """
+        path = f"v1beta/models/{model}:batchEmbedContents"
+        body = json.dumps({"requests": [{**item, "model": f"models/{model}"} for item in items]}).encode()
+        response = await self._forward(
+            "POST", path, await self._determine_target_url(path), {"content-type": "application/json"}, {}, body, access_key,
+            rotate_on_client_error=len(items) == 1
+        )
+        try:
+            return [embedding["values"] for embedding in json.loads(response.body)["embeddings"]]
+        except (ValueError, KeyError, TypeError):
+            raise ServiceUnavailableError(detail="Unexpected batchEmbedContents response from upstream.")
+
+    async def _forward_embed(self, path: str, target_url: str, headers: dict, query_params: dict, request_body: bytes, access_key: str | None) -> Response:
+        """
+        embedContent：命中嵌入缓存时直接返回；未命中时经微批处理（如已启用）或直接请求上游，并缓存结果。
+        """
+        try:
+            payload = json.loads(request_body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            return await self._forward("POST", path, target_url, headers, query_params, request_body, access_key)
+
+        model_name = self._parse_model_name(path)
+        key = embedding_key(model_name, payload)
+        if embedding_cache.is_open:
+            values = embedding_cache.get(key)
+            if values is not None:
+                return self._embedding_response('{"embedding":{"values":%s}}' % values_json(values), "HIT", 1)
+
+        if self._embed_batching_enabled() and model_name and not query_params:
+            window_ms = float(config_manager.get_cached("EMBED_BATCH_WINDOW_MS") or EMBED_BATCH_WINDOW_MS)
+            max_items = int(config_manager.get_cached("EMBED_BATCH_MAX_ITEMS") or EMBED_BATCH_MAX_ITEMS)
+            item = {k: v for k, v in payload.items() if k != "model"}
+            values = await embed_batcher.submit(model_name, access_key, item, self._send_embed_batch, window_ms / 1000, max_items)
+            if embedding_cache.is_open:
+                embedding_cache.put(key, values)
+            return self._embedding_response('{"embedding":{"values":%s}}' % values_json(values), "MISS", 0)
+
+        response = await self._forward("POST", path, target_url, headers, query_params, request_body, access_key)
+        try:
+            if embedding_cache.is_open:
+                embedding_cache.put(key, json.loads(response.body)["embedding"]["values"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Unexpected embedContent response from upstream. Not cached.")
+        if embedding_cache.is_open:
+            response.headers["X-Cache"] = "MISS"
+        return response
+
+    async def _forward_batch_embed(self, path: str, target_url: str, headers: dict, query_params: dict, request_body: bytes, access_key: str | None) -> Response:
+        """batchEmbedContents：缓存命中的条目直接返回，仅将未命中的条目发往上游，再按原顺序合并。"""
+        try:
+            payload = json.loads(request_body)
+        except ValueError:
+            payload = None
+        items = payload.get("requests") if isinstance(payload, dict) else None
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return await self._forward("POST", path, target_url, headers, query_params, request_body, access_key)
+
+        path_model = self._parse_model_name(path)
+        keys = [embedding_key(item.get("model") or path_model, item) for item in items]
+        vectors = [embedding_cache.get(key) for key in keys]
+        misses = [i for i, values in enumerate(vectors) if values is None]
+
+        if misses:
+            miss_body = json.dumps({**payload, "requests": [items[i] for i in misses]}).encode()
+            response = await self._forward("POST", path, target_url, headers, query_params, miss_body, access_key)
+            try:
+                fetched = [embedding["values"] for embedding in json.loads(response.body)["embeddings"]]
+            except (ValueError, KeyError, TypeError):
+                fetched = None
+            if fetched is None or len(fetched) != len(misses):
+                if len(misses) == len(items):
+                    return response
+                raise ServiceUnavailableError(detail="Unexpected batchEmbedContents response from upstream.")
+            for i, values in zip(misses, fetched):
+                embedding_cache.put(keys[i], values)
+                vectors[i] = values
+
+        content = '{"embeddings":[' + ",".join('{"values":%s}' % values_json(values) for values in vectors) + ']}'
+        cache_status = "HIT" if not misses else ("MISS" if len(misses) == len(items) else "PARTIAL")
+        return self._embedding_response(content, cache_status, len(items) - len(misses))
+
+    async def _forward(self, method: str, path: str, target_url: str, headers: dict, query_params: dict, request_body: bytes, access_key: str | None,
+                       rotate_on_client_error: bool = True) -> Response:
+        """
+        按密钥轮换发送请求，直到成功、遇到不可重试的错误或达到轮换上限。
+        rotate_on_client_error 为 False 时，上游的 400 直接抛出 httpx.HTTPStatusError，不轮换也不记录密钥失败。
+        """
         last_error_details = ""
         model_name = self._parse_model_name(path)
+        est_tokens = self._estimate_tokens(method, request_body)
+        hedging = self._should_hedge(method, path, query_params)
 
         for i in range(self.MAX_KEY_ROTATIONS):
-            gemini_key = await key_manager.get_key() # May raise AllKeysFailedError
+            acquire_started = time.perf_counter()
+            gemini_key = await key_manager.get_key(model_name, est_tokens) # May raise AllKeysFailedError
+            key_acquire_wait.observe(time.perf_counter() - acquire_started)
             
-            logger.info(f"Attempting with key ...{gemini_key[-4:]} (Rotation {i+1}/{self.MAX_KEY_ROTATIONS}) for model {model_name}")
+            logger.info("Attempting with key ...%s (Rotation %d/%d) for model %s", gemini_key[-4:], i + 1, self.MAX_KEY_ROTATIONS, model_name)
+            response = None
+            # 产生响应的密钥：对冲请求胜出时为对冲密钥
+            served_by = gemini_key
             try:
                 # 尝试使用一个密钥发送请求（内置重试逻辑）
-                return await self._send_request_with_single_key(
-                    method=request.method,
+                send_kwargs = dict(
+                    method=method,
                     url=target_url,
                     headers=headers,
                     params=query_params,
                     content=request_body,
-                    key=gemini_key,
-                    model_name=model_name
+                    model_name=model_name,
+                    est_tokens=est_tokens
                 )
+                if hedging:
+                    response, served_by = await self._send_hedged(send_kwargs, gemini_key, model_name, est_tokens, access_key)
+                else:
+                    response = await self._send_request_with_single_key(**send_kwargs, key=gemini_key)
+                return response
             except UnretryableError as e:
                 # 如果是不可重试的错误(404)，直接抛出给全局处理器，不再轮换密钥
                 logger.error(f"Unretryable error received from upstream. Aborting rotations. Details: {e.detail}")
@@ -339,13 +754,19 @@ class ProxyService:
                 # 抛出 ServiceUnavailableError 以向客户端返回 502 错误
                 raise ServiceUnavailableError(detail=f"A network error occurred and was not resolved by retries: {e}") from e
             except Exception as e:
+                if not rotate_on_client_error and isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400:
+                    raise
                 # 其他所有可轮换的错误（主要是 HTTPStatusError）：记录密钥失败并继续轮换
-                status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
-                error_message = e.response.text if isinstance(e, httpx.HTTPStatusError) else str(e)
-                
-                await key_manager.record_failure(gemini_key, model_name, status_code, error_message)
+                await self._record_key_error(gemini_key, model_name, e)
+                key_rotations.inc(model_labels.label(model_name))
                 last_error_details = str(e)
-                logger.warning(f"Key ...{gemini_key[-4:]} failed. Rotating to next key. Error: {e}")
+                logger.warning("Key ...%s failed. Rotating to next key. Error: %s", gemini_key[-4:], e)
+            finally:
+                # 流式响应由生成器在结束时释放；其余情况在此释放密钥的在途计数
+                if not isinstance(response, StreamingResponse):
+                    # 对冲请求胜出时，实际用量已记在对冲密钥上，被取消的主请求不计令牌
+                    tokens_used = _extract_token_usage(response.body) if response is not None and served_by == gemini_key else None
+                    key_manager.release_key(gemini_key, model_name, est_tokens, tokens_used)
 
         # 如果所有密钥轮换都失败了
         logger.error(f"Request failed after trying {self.MAX_KEY_ROTATIONS} keys. Last error: {last_error_details}")
@@ -0,0 +1,182 @@
+"""
+配额感知的密钥选择引擎。
+
+KeyManager 支持两种可插拔的选择策略：
+- round_robin: 按最后使用时间轮询（原有行为）。
+- quota: 为每个 (密钥, 模型) 维护 RPM / TPM 令牌桶，结合在途请求数，选择余量最大的密钥，
+  从而在触发上游 429 之前主动避开即将达到速率限制的密钥。
+"""
+import json
+import logging
+import time
+
+from api.metrics import model_labels
+
+STRATEGY_ROUND_ROBIN = "round_robin"
+STRATEGY_QUOTA = "quota"
+STRATEGIES = (STRATEGY_ROUND_ROBIN, STRATEGY_QUOTA)
+
+# 未单独配置的模型使用该条目的限制
+DEFAULT_LIMITS_KEY = "default"
+
+class TokenBucket:
+    """按分钟匀速补充的令牌桶。"""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: int, now: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def headroom(self, cost: float) -> float:
+        """扣除 cost 后剩余令牌占容量的比例；可能为负，表示需要等待。"""
+        return (self.tokens - cost) / self.capacity
+
+    def full_headroom(self, cost: float) -> float:
+        """桶满时扣除 cost 后的余量，即 headroom 可能达到的最大值。"""
+        return (self.capacity - cost) / self.capacity
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+def parse_rate_limits(value: str | None) -> dict[str, tuple[int | None, int | None]]:
+    """
+    解析 KEY_RATE_LIMITS 配置（JSON）：
+    {"default": {"rpm": 15, "tpm": 1000000}, "gemini-2.5-pro": {"rpm": 5}}
+    返回 {模型: (rpm, tpm)}，缺省或非正数表示不限制。
+    """
+    if not value:
+        return {}
+    try:
+        raw = json.loads(value)
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid KEY_RATE_LIMITS value: {value!r}. Ignoring per-model limits.")
+        return {}
+    if not isinstance(raw, dict):
+        return {}
+
+    limits = {}
+    for model, entry in raw.items():
+        if not isinstance(entry, dict):
+            continue
+        rpm = entry.get("rpm")
+        tpm = entry.get("tpm")
+        limits[model] = (
+            int(rpm) if isinstance(rpm, (int, float)) and rpm > 0 else None,
+            int(tpm) if isinstance(tpm, (int, float)) and tpm > 0 else None,
+        )
+    return limits
+
+class QuotaKeySelector:
+    """
+    基于令牌桶余量与在途请求数的密钥选择器。
+    所有状态仅在事件循环线程内访问，无需加锁。
+    """
+
+    def __init__(self):
+        self._limits: dict[str, tuple[int | None, int | None]] = {}
+        # (key_id, model) -> (rpm_bucket, tpm_bucket)
+        self._buckets: dict[tuple[int, str], tuple[TokenBucket | None, TokenBucket | None]] = {}
+        # 每次选择从不同位置开始扫描，避免空闲时总是命中同一个密钥
+        self._cursor = 0
+
+    def configure(self, limits: dict[str, tuple[int | None, int | None]]):
+        """替换模型限制。容量可能变化，因此清空现有令牌桶。"""
+        if limits != self._limits:
+            self._limits = limits
+            self._buckets.clear()
+
+    def _bucket_model(self, model: str | None) -> str:
+        """
+        令牌桶按模型区分的键：只有单独配置了限制或上游成功响应过的模型才有自己的桶，
+        其余（包括客户端随意填写的模型名）共用默认条目，避免令牌桶随客户端输入无限增长。
+        """
+        if model and (model in self._limits or model_labels.is_known(model)):
+            return model
+        return DEFAULT_LIMITS_KEY
+
+    def _limits_for(self, model: str) -> tuple[int | None, int | None]:
+        return self._limits.get(model) or self._limits.get(DEFAULT_LIMITS_KEY) or (None, None)
+
+    def _buckets_for(self, key_id: int, model: str, now: float):
+        entry = self._buckets.get((key_id, model))
+        if entry is None:
+            rpm, tpm = self._limits_for(model)
+            entry = (
+                TokenBucket(rpm, now) if rpm else None,
+                TokenBucket(tpm, now) if tpm else None,
+            )
+            self._buckets[(key_id, model)] = entry
+        rpm_bucket, tpm_bucket = entry
+        if rpm_bucket:
+            rpm_bucket.refill(now)
+        if tpm_bucket:
+            tpm_bucket.refill(now)
+        return entry
+
+    def select(self, candidates: list, model: str | None, est_tokens: int, in_flight: dict[int, int], excluded=()):
+        """
+        在候选密钥（KeyState 列表）中选择余量最大的一个，跳过 excluded 中的密钥 ID（例如冷却中的密钥）。
+        得分 = min(RPM 余量, TPM 余量) / (1 + 在途请求数)；遇到（在一秒补充量以内）满额且空闲的密钥即提前返回。
+        """
+        if not candidates:
+            return None
+        model = self._bucket_model(model)
+        now = time.monotonic()
+        count = len(candidates)
+        start = self._cursor % count
+        self._cursor = start + 1
+
+        best = None
+        best_score = float("-inf")
+        for offset in range(count):
+            state = candidates[(start + offset) % count]
+            if state.id in excluded:
+                continue
+            rpm_bucket, tpm_bucket = self._buckets_for(state.id, model, now)
+            headroom = 1.0
+            # 桶满时的余量：容量小或单次扣除多时，满额的密钥余量也明显小于 1
+            full = 1.0
+            if rpm_bucket:
+                headroom = min(headroom, rpm_bucket.headroom(1))
+                full = min(full, rpm_bucket.full_headroom(1))
+            if tpm_bucket:
+                headroom = min(headroom, tpm_bucket.headroom(est_tokens))
+                full = min(full, tpm_bucket.full_headroom(est_tokens))
+            busy = in_flight.get(state.id, 0)
+            score = headroom / (1 + busy) if headroom > 0 else headroom - busy
+            if score > best_score:
+                best, best_score = state, score
+                # 允许一秒的补充量（容量的 1/60）作为误差
+                if busy == 0 and headroom >= full - 1 / 60:
+                    break
+
+        if best is not None and best_score <= 0:
+            logging.warning(f"All {count} candidate keys are at their rate limits for model {model}. Using the one with the most headroom.")
+        return best
+
+    def charge(self, key_id: int, model: str | None, tokens: int):
+        """为一次请求扣除 1 个请求令牌与估算的 token 数。"""
+        rpm_bucket, tpm_bucket = self._buckets_for(key_id, self._bucket_model(model), time.monotonic())
+        if rpm_bucket:
+            rpm_bucket.consume(1)
+        if tpm_bucket and tokens:
+            tpm_bucket.consume(tokens)
+
+    def adjust_tokens(self, key_id: int, model: str | None, delta: int):
+        """根据上游返回的实际用量修正 TPM 桶（delta 可为负，表示退还多扣的估算）。"""
+        entry = self._buckets.get((key_id, self._bucket_model(model)))
+        if entry and entry[1] and delta:
+            entry[1].consume(delta)
+
+    def forget(self, key_id: int):
+        """移除已删除密钥的令牌桶。"""
+        for bucket_key in [k for k in self._buckets if k[0] == key_id]:
+            del self._buckets[bucket_key]
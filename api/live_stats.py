@@ -0,0 +1,116 @@
+"""
+实时调用统计的内存滑动窗口。
+
+每次调用按 (model_name, 状态类别) 计入两个环形缓冲区：60 个秒级桶与 1440 个分钟级桶。
+最近一分钟读秒级桶，最近一小时与 24 小时读分钟级桶，查询只遍历桶，与历史表大小无关。
+启动时从分钟汇总表（call_rollup_minute）回放最近 24 小时的计数作为初始值。
+统计仅覆盖本进程处理的调用，多工作进程时管理接口改为读取汇总表。
+"""
+import datetime
+import time
+from collections import Counter
+
+import aiosqlite
+
+from api.rollups import MINUTE_TABLE
+
+class RingCounter:
+    """
+    固定数量的时间桶组成的环：桶 i 保存纪元 epoch（= 时间 // 桶宽）对应的计数，
+    写入时发现桶中是旧纪元的数据就先清空，因此无需后台任务滚动窗口。
+    """
+    __slots__ = ("width", "slots", "_epochs", "_totals", "_breakdown")
+
+    def __init__(self, width: int, slots: int):
+        self.width = width
+        self.slots = slots
+        self._epochs = [-1] * slots
+        self._totals = [0] * slots
+        self._breakdown: list[Counter | None] = [None] * slots
+
+    def add(self, moment: float, group: tuple, count: int = 1):
+        epoch = int(moment // self.width)
+        i = epoch % self.slots
+        if self._epochs[i] != epoch:
+            if self._epochs[i] > epoch:
+                # 比环中已有数据更旧，已滑出窗口
+                return
+            self._epochs[i] = epoch
+            self._totals[i] = 0
+            self._breakdown[i] = Counter()
+        self._totals[i] += count
+        self._breakdown[i][group] += count
+
+    def _live_slots(self, now: float, seconds: int):
+        current = int(now // self.width)
+        oldest = current - min(self.slots, max(1, seconds // self.width)) + 1
+        for i, epoch in enumerate(self._epochs):
+            if oldest <= epoch <= current:
+                yield i
+
+    def total(self, now: float, seconds: int) -> int:
+        return sum(self._totals[i] for i in self._live_slots(now, seconds))
+
+    def breakdown(self, now: float, seconds: int) -> Counter:
+        merged = Counter()
+        for i in self._live_slots(now, seconds):
+            merged.update(self._breakdown[i])
+        return merged
+
+class LiveCallStats:
+    """最近一分钟 / 一小时 / 24 小时的调用计数。"""
+
+    WINDOWS = {"last_minute": 60, "last_hour": 3600, "last_24_hours": 86400}
+
+    def __init__(self):
+        self._seconds = RingCounter(1, 60)
+        self._minutes = RingCounter(60, 1440)
+        self.seeded = False
+
+    def record(self, model_name: str, status_class: str, moment: float | None = None, count: int = 1):
+        moment = time.time() if moment is None else moment
+        group = (model_name, status_class)
+        self._seconds.add(moment, group, count)
+        self._minutes.add(moment, group, count)
+
+    def _ring_for(self, seconds: int) -> RingCounter:
+        return self._seconds if seconds <= 60 else self._minutes
+
+    def counts(self, now: float | None = None) -> dict[str, int]:
+        now = time.time() if now is None else now
+        return {name: self._ring_for(seconds).total(now, seconds) for name, seconds in self.WINDOWS.items()}
+
+    def breakdown(self, now: float | None = None) -> dict[str, dict]:
+        """按窗口返回总数以及 {model: {status_class: count}} 的明细。"""
+        now = time.time() if now is None else now
+        result = {}
+        for name, seconds in self.WINDOWS.items():
+            ring = self._ring_for(seconds)
+            by_model: dict[str, dict[str, int]] = {}
+            for (model_name, klass), count in ring.breakdown(now, seconds).items():
+                by_model.setdefault(model_name, {})[klass] = count
+            result[name] = {"total": ring.total(now, seconds), "by_model": by_model}
+        return result
+
+    async def seed(self, db: aiosqlite.Connection):
+        """
+        从分钟汇总表载入最近 24 小时的计数。秒级环只能得到分钟精度：
+        最近一分钟内的分钟桶整体计入该分钟的最后一秒（不晚于当前时间）。
+        """
+        now = time.time()
+        since = datetime.datetime.fromtimestamp(now - 86400, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:00")
+        cursor = await db.execute(
+            f"SELECT bucket, model_name, status_class, SUM(call_count) FROM {MINUTE_TABLE} WHERE bucket >= ? GROUP BY bucket, model_name, status_class",
+            (since,)
+        )
+        rows = await cursor.fetchall()
+        for bucket, model_name, klass, count in rows:
+            start = datetime.datetime.strptime(bucket, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc).timestamp()
+            group = (model_name, klass)
+            self._minutes.add(start, group, count)
+            if start + 60 > now - 60:
+                self._seconds.add(min(start + 59, now), group, count)
+        self.seeded = True
+        return len(rows)
+
+live_stats = LiveCallStats()
@@ -0,0 +1,114 @@
+"""
+上游模型元数据 GET 请求（models 列表、models/{name}）的 TTL 缓存。
+
+- 新鲜期内直接返回缓存；过期后在 stale-while-revalidate 窗口内先返回旧值，并在后台刷新。
+- 未知模型的 404 做短时间的负缓存，避免 SDK 反复探测同一个不存在的模型。
+- 超过单条大小上限的响应不缓存；条目数超过上限时淘汰最久未使用的条目。
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from api.config import (
+    METADATA_CACHE_TTL_SECONDS, METADATA_CACHE_SWR_SECONDS, METADATA_CACHE_NEGATIVE_TTL_SECONDS,
+    METADATA_CACHE_MAX_ENTRY_BYTES, METADATA_CACHE_MAX_ENTRIES,
+)
+
+class CachedResponse:
+    """缓存的上游响应。status_code 为 404 时表示负缓存条目。"""
+    __slots__ = ("status_code", "content", "headers", "fresh_until", "stale_until")
+
+    def __init__(self, status_code: int, content: bytes, headers: dict | None = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.fresh_until = 0.0
+        self.stale_until = 0.0
+
+class MetadataCache:
+    """单事件循环内使用的 LRU + TTL 缓存，后台刷新按键去重。"""
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._refreshing: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.oversized = 0
+
+    @staticmethod
+    def make_key(path: str, params: dict) -> tuple:
+        return (path, tuple(sorted(params.items())))
+
+    def _store(self, key: tuple, entry: CachedResponse):
+        if len(entry.content) > METADATA_CACHE_MAX_ENTRY_BYTES:
+            self.oversized += 1
+            self._entries.pop(key, None)
+            return
+        now = time.monotonic()
+        if entry.status_code == 404:
+            entry.fresh_until = entry.stale_until = now + METADATA_CACHE_NEGATIVE_TTL_SECONDS
+        else:
+            entry.fresh_until = now + METADATA_CACHE_TTL_SECONDS
+            entry.stale_until = entry.fresh_until + METADATA_CACHE_SWR_SECONDS
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > METADATA_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    async def _refresh(self, key: tuple, loader: Callable[[], Awaitable[CachedResponse]]):
+        try:
+            self._store(key, await loader())
+            self.refreshes += 1
+        except Exception as e:
+            # 刷新失败时保留旧值，直到 SWR 窗口结束
+            logging.warning(f"Background refresh of metadata cache entry {key[0]} failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    async def fetch(self, key: tuple, loader: Callable[[], Awaitable[CachedResponse]]) -> tuple[CachedResponse, str]:
+        """
+        返回 (响应, 缓存状态)，状态为 "HIT" / "STALE" / "MISS"。
+        loader 仅在成功（2xx）或 404 时返回 CachedResponse，其余错误直接抛出且不缓存。
+        """
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            if now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                if entry.status_code == 404:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return entry, "HIT"
+            if now < entry.stale_until:
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(self._refresh(key, loader))
+                return entry, "STALE"
+
+        self.misses += 1
+        entry = await loader()
+        self._store(key, entry)
+        return entry, "MISS"
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(len(entry.content) for entry in self._entries.values()),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "background_refreshes": self.refreshes,
+            "oversized_skipped": self.oversized,
+        }
+
+metadata_cache = MetadataCache()
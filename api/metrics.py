@@ -0,0 +1,230 @@
+"""
+Prometheus 兼容的进程内指标。
+
+所有指标都只在事件循环线程内更新，计数器就是普通的整数/浮点数加法，不需要任何锁；
+直方图使用固定的桶边界，观测时二分查找对应的桶。抓取时才把当前值渲染为
+Prometheus 文本格式（0.0.4），量表（gauge）可以注册回调，在抓取时读取各模块的实时状态。
+"""
+import bisect
+import math
+from typing import Callable, Iterable
+
+# 延迟类直方图的默认桶边界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 流式响应持续时间的桶边界（秒）
+STREAM_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# 本地等待（密钥获取、SQLite 写入）的桶边界（秒）
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """单调递增的计数器，按标签值元组分别计数。"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+class Gauge(_Metric):
+    """
+    可增可减的量表。既可以直接 set/inc/dec，也可以注册回调，
+    在抓取时返回 {标签值元组: 数值}，用于读取其他模块的实时状态。
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        # 无标签的量表从 0 开始导出
+        self._values: dict[tuple, float] = {} if labels else {(): 0}
+        self._callback: Callable[[], dict[tuple, float]] | None = None
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def set_function(self, callback: Callable[[], dict[tuple, float]]):
+        self._callback = callback
+
+    def render(self) -> list[str]:
+        values = self._values
+        if self._callback is not None:
+            values = {**values, **self._callback()}
+        lines = self.header()
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, bucket_count: int):
+        # 每个桶的非累计计数，最后一个为 +Inf 桶；渲染时再累加
+        self.counts = [0] * (bucket_count + 1)
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram(_Metric):
+    """固定桶边界的直方图。"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, _HistogramSeries] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = _HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), series.counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表：按注册顺序渲染全部指标。"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class ModelLabels:
+    """
+    可作为指标标签的模型名集合。路径中的模型名由客户端任意填写，只有上游成功（2xx）响应过的模型
+    才作为标签，其余记为 "other"，避免时间序列随客户端输入无限增长。
+    """
+    # 最多记录的模型数，达到后新出现的模型也记为 "other"
+    MAX_MODELS = 256
+    OTHER = "other"
+
+    def __init__(self):
+        self._known: set[str] = set()
+
+    def mark_seen(self, model: str | None):
+        if model and model not in self._known and len(self._known) < self.MAX_MODELS:
+            self._known.add(model)
+
+    def is_known(self, model: str | None) -> bool:
+        return model in self._known
+
+    def label(self, model: str | None) -> str:
+        if not model:
+            return "unknown"
+        return model if model in self._known else self.OTHER
+
+registry = MetricsRegistry()
+model_labels = ModelLabels()
+
+# --- 热路径直方图 ---
+upstream_latency = registry.histogram(
+    "synapse_upstream_latency_seconds", "Time from sending an upstream request to the full non-streaming response body.", ("model",))
+upstream_ttfb = registry.histogram(
+    "synapse_upstream_ttfb_seconds", "Time from sending an upstream request to receiving its response headers.", ("model",))
+stream_duration = registry.histogram(
+    "synapse_stream_duration_seconds", "Duration of proxied SSE streams from first byte to close.", ("model",), STREAM_BUCKETS)
+key_acquire_wait = registry.histogram(
+    "synapse_key_acquire_wait_seconds", "Time spent waiting for KeyManager.get_key.", (), WAIT_BUCKETS)
+retention_chunk_duration = registry.histogram(
+    "synapse_retention_chunk_seconds", "Time the writer connection is held per log retention delete chunk.", ("table",), WAIT_BUCKETS)
+db_write_latency = registry.histogram(
+    "synapse_db_write_seconds", "Time the shared SQLite writer connection is held per write transaction.", (), WAIT_BUCKETS)
+
+# --- 计数器 ---
+key_rotations = registry.counter(
+    "synapse_key_rotations_total", "Requests rotated to another key after a key-level failure.", ("model",))
+upstream_retries = registry.counter(
+    "synapse_upstream_retries_total", "Retries of an upstream request with the same key.", ("model",))
+rate_limited = registry.counter(
+    "synapse_upstream_rate_limited_total", "Upstream 429 responses.", ("model",))
+retention_deleted = registry.counter(
+    "synapse_retention_deleted_rows_total", "Rows removed by the log retention cleanup.", ("table",))
+retention_runs = registry.counter(
+    "synapse_retention_runs_total", "Log retention runs by result (complete, budget_exhausted, failed).", ("table", "result"))
+key_outcomes = registry.counter(
+    "synapse_key_outcomes_total", "Recorded call outcomes per key (success, failure, rate_limited).", ("key_id", "outcome"))
+
+# --- 量表 ---
+requests_in_flight = registry.gauge(
+    "synapse_requests_in_flight", "Proxy requests currently being handled.")
+key_pool = registry.gauge(
+    "synapse_key_pool", "Key counts by state (total, valid, cooling, pooled, in_use).", ("state",))
+upstream_pool = registry.gauge(
+    "synapse_upstream_pool", "httpx pool usage by pool (stream, unary) and field (in_flight, max_connections).", ("pool", "field"))
@@ -0,0 +1,81 @@
+"""
+纯 ASGI 的请求日志中间件。
+
+与 BaseHTTPMiddleware 不同，它不会为每个请求创建额外的任务和内存流，响应消息（包括流式响应的
+每个分块）直接透传给服务器，不影响背压。每个请求在结束时最多输出一条日志：
+错误（>= 400）与慢请求始终记录，其余按 LOG_SAMPLE_RATE 采样；日志参数仅在确实输出时才格式化。
+"""
+import logging
+import random
+import re
+import time
+
+from api.config import LOG_SAMPLE_RATE, LOG_SLOW_REQUEST_MS, LOG_REQUEST_HEADERS
+from api.metrics import requests_in_flight
+
+logger = logging.getLogger(__name__)
+
+# 掩蔽查询字符串中的 key 参数
+_KEY_PARAM_RE = re.compile(r"(^|&)key=[^&]*")
+# 不记录的敏感头部
+_SENSITIVE_HEADERS = {b"authorization", b"x-goog-api-key", b"cookie", b"set-cookie"}
+
+class RequestLoggingMiddleware:
+    def __init__(self, app, sample_rate: float = LOG_SAMPLE_RATE, slow_request_ms: float = LOG_SLOW_REQUEST_MS, log_headers: bool = LOG_REQUEST_HEADERS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_request_seconds = slow_request_ms / 1000
+        self.log_headers = log_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        headers_sent_at = None
+        # 代理请求的在途数量包含流式响应的整个传输过程
+        proxied = scope["path"].startswith("/v1beta/")
+        if proxied:
+            requests_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status_code, headers_sent_at
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers_sent_at = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if proxied:
+                requests_in_flight.dec()
+            self._log(scope, status_code, started, headers_sent_at)
+
+    def _log(self, scope, status_code: int, started: float, headers_sent_at: float | None):
+        elapsed = time.perf_counter() - started
+        if status_code < 400 and elapsed < self.slow_request_seconds and self.sample_rate < 1.0:
+            if random.random() >= self.sample_rate:
+                return
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        if query:
+            query = "?" + _KEY_PARAM_RE.sub(r"\1key=***", query)
+        client = scope.get("client")
+        ttfb_ms = (headers_sent_at - started) * 1000 if headers_sent_at is not None else -1.0
+
+        if self.log_headers:
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", ()) if k not in _SENSITIVE_HEADERS}
+            logger.info(
+                "%s %s%s -> %d in %.2fms (headers %.2fms, client %s) %s",
+                scope["method"], scope["path"], query, status_code, elapsed * 1000, ttfb_ms, client[0] if client else "unknown", headers,
+            )
+        else:
+            logger.info(
+                "%s %s%s -> %d in %.2fms (headers %.2fms, client %s)",
+                scope["method"], scope["path"], query, status_code, elapsed * 1000, ttfb_ms, client[0] if client else "unknown",
+            )
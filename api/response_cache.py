@@ -0,0 +1,156 @@
+"""
+确定性 generateContent 响应缓存。
+
+对 temperature 为 0 的非流式 generateContent 请求，按 (访问密钥, 模型, 规范化请求体, 查询参数) 的哈希
+缓存成功响应。命中时不获取密钥、不请求上游。
+- 内存层：按字节预算淘汰的 LRU。
+- 磁盘层（可选）：独立的 SQLite 文件，进程重启后仍可命中，命中时回填内存层。
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import aiosqlite
+
+from api.config import (
+    RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MEMORY_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES, RESPONSE_CACHE_DB_PATH,
+)
+
+class CachedEntry:
+    __slots__ = ("content", "headers", "expires_at")
+
+    def __init__(self, content: bytes, headers: dict, expires_at: float):
+        self.content = content
+        self.headers = headers
+        self.expires_at = expires_at
+
+def is_deterministic(body: dict) -> bool:
+    """仅缓存显式设置 temperature 为 0 的请求。"""
+    config = body.get("generationConfig") or body.get("generation_config") or {}
+    return isinstance(config, dict) and config.get("temperature") == 0
+
+def cache_key(access_key: str | None, model: str | None, body: dict, params: dict) -> str:
+    """规范化请求体（键排序、去除空白）后计算哈希，使字段顺序不同的相同请求命中同一条目。"""
+    canonical = json.dumps(
+        [access_key, model, body, sorted(params.items())],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ResponseCache:
+    def __init__(self):
+        self._memory: OrderedDict[str, CachedEntry] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: aiosqlite.Connection | None = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def start(self):
+        """打开磁盘层（如已配置）。"""
+        if not RESPONSE_CACHE_DB_PATH:
+            return
+        self._disk = await aiosqlite.connect(RESPONSE_CACHE_DB_PATH)
+        await self._disk.execute("PRAGMA journal_mode=WAL")
+        await self._disk.execute("PRAGMA synchronous=NORMAL")
+        # 多个工作进程共享同一个缓存文件
+        await self._disk.execute("PRAGMA busy_timeout=5000")
+        await self._disk.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                headers TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await self._disk.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+        await self._disk.commit()
+
+    async def close(self):
+        if self._disk is not None:
+            await self._disk.close()
+            self._disk = None
+
+    def _remember(self, key: str, entry: CachedEntry):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old.content)
+        self._memory[key] = entry
+        self._memory_bytes += len(entry.content)
+        while self._memory_bytes > RESPONSE_CACHE_MEMORY_BYTES and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.content)
+
+    def _drop(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry.content)
+
+    async def get(self, key: str) -> tuple[CachedEntry, str] | None:
+        """返回 (条目, 命中层级 "memory" / "disk")，未命中返回 None。"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry, "memory"
+            self._drop(key)
+
+        if self._disk is not None:
+            try:
+                cursor = await self._disk.execute(
+                    "SELECT content, headers, expires_at FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+                )
+                row = await cursor.fetchone()
+            except Exception as e:
+                logging.warning(f"Response cache disk lookup failed: {e}")
+                row = None
+            if row:
+                entry = CachedEntry(row[0], json.loads(row[1]), row[2])
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry, "disk"
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, content: bytes, headers: dict):
+        if len(content) > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            return
+        entry = CachedEntry(content, headers, time.time() + RESPONSE_CACHE_TTL_SECONDS)
+        self._remember(key, entry)
+        self.stores += 1
+        if self._disk is not None:
+            try:
+                await self._disk.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, content, headers, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, content, json.dumps(headers), entry.expires_at)
+                )
+                await self._disk.commit()
+            except Exception as e:
+                logging.warning(f"Response cache disk write failed: {e}")
+
+    async def clear(self):
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self._disk is not None:
+            await self._disk.execute("DELETE FROM response_cache")
+            await self._disk.commit()
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "memory_budget_bytes": RESPONSE_CACHE_MEMORY_BYTES,
+            "disk_tier": self._disk is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+        }
+
+response_cache = ResponseCache()
@@ -0,0 +1,153 @@
+"""
+调用历史与错误日志的分块保留清理。
+
+过期行按 timestamp 索引（idx_<table>_timestamp）分块删除：每块一个写事务，最多删除
+RETENTION_CHUNK_ROWS 行，块与块之间释放写连接并暂停 RETENTION_CHUNK_PAUSE_MS 毫秒，
+使在线的调用统计写入可以插入到清理过程中，不再被一个长事务阻塞。
+单次运行受 RETENTION_TIME_BUDGET_SECONDS 限制，用尽后剩余的过期行留到下一次运行。
+开启 RETENTION_INCREMENTAL_VACUUM 时，清理后以同样的方式分步执行 PRAGMA incremental_vacuum。
+"""
+import asyncio
+import datetime
+import logging
+import time
+
+from api.config import (
+    RETENTION_CHUNK_ROWS, RETENTION_CHUNK_PAUSE_MS, RETENTION_TIME_BUDGET_SECONDS,
+    RETENTION_INCREMENTAL_VACUUM, RETENTION_VACUUM_PAGES,
+)
+from api.metrics import retention_deleted, retention_runs, retention_chunk_duration
+
+# 允许清理的表（表名直接拼入 SQL，必须在白名单内）
+RETENTION_TABLES = ("error_logs", "api_call_history")
+
+# auto_vacuum 的取值：0 = NONE，1 = FULL，2 = INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+class RetentionEngine:
+    """分块删除过期日志，并记录每张表最近一次运行的进度。"""
+
+    def __init__(self, chunk_rows: int = RETENTION_CHUNK_ROWS, pause_ms: float = RETENTION_CHUNK_PAUSE_MS,
+                 time_budget: float = RETENTION_TIME_BUDGET_SECONDS, incremental_vacuum: bool = RETENTION_INCREMENTAL_VACUUM,
+                 vacuum_pages: int = RETENTION_VACUUM_PAGES):
+        self.chunk_rows = max(1, chunk_rows)
+        self.pause = max(0.0, pause_ms) / 1000
+        self.time_budget = time_budget
+        self.incremental_vacuum = incremental_vacuum
+        self.vacuum_pages = max(1, vacuum_pages)
+        # 每张表最近一次运行的进度，运行中也会实时更新
+        self.last_runs: dict[str, dict] = {}
+        self.last_vacuum: dict | None = None
+
+    async def purge(self, table_name: str, retention_days: int) -> int:
+        """删除 table_name 中早于 retention_days 天的记录，返回本次删除的行数。"""
+        from api.database import db_pool
+
+        if table_name not in RETENTION_TABLES:
+            logging.warning(f"Attempt to delete from non-allowed table: {table_name}. Skipped.")
+            return 0
+
+        # 与写入时一致的 UTC 字符串，可直接在索引上按字符串比较
+        cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        started = time.monotonic()
+        progress = {
+            "cutoff": cutoff,
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "deleted_rows": 0,
+            "chunks": 0,
+            "elapsed_seconds": 0.0,
+            "result": "running",
+        }
+        self.last_runs[table_name] = progress
+
+        sql = f"""
+            DELETE FROM {table_name} WHERE id IN (
+                SELECT id FROM {table_name} WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+            )
+        """
+        try:
+            while True:
+                if time.monotonic() - started >= self.time_budget:
+                    progress["result"] = "budget_exhausted"
+                    break
+                chunk_started = time.perf_counter()
+                async with db_pool.writer() as db:
+                    cursor = await db.execute(sql, (cutoff, self.chunk_rows))
+                    deleted = cursor.rowcount
+                retention_chunk_duration.observe(time.perf_counter() - chunk_started, table_name)
+                retention_deleted.inc(table_name, amount=deleted)
+                progress["deleted_rows"] += deleted
+                progress["chunks"] += 1
+                progress["elapsed_seconds"] = round(time.monotonic() - started, 3)
+                if deleted < self.chunk_rows:
+                    progress["result"] = "complete"
+                    break
+                await asyncio.sleep(self.pause)
+        except Exception:
+            progress["result"] = "failed"
+            raise
+        finally:
+            progress["elapsed_seconds"] = round(time.monotonic() - started, 3)
+            retention_runs.inc(table_name, progress["result"])
+
+        if progress["result"] == "budget_exhausted":
+            logging.warning(
+                f"Retention for {table_name} stopped after {progress['elapsed_seconds']}s time budget with "
+                f"{progress['deleted_rows']} rows deleted; remaining rows older than {cutoff} will be removed on the next run."
+            )
+        else:
+            logging.info(f"Deleted {progress['deleted_rows']} old records from {table_name} in {progress['chunks']} chunks ({progress['elapsed_seconds']}s).")
+        return progress["deleted_rows"]
+
+    async def vacuum(self) -> int:
+        """
+        分步执行 PRAGMA incremental_vacuum，每步释放 vacuum_pages 页，直到没有空闲页或时间预算用尽。
+        数据库未处于 auto_vacuum=INCREMENTAL 模式时该 PRAGMA 不起作用，只记录提示。返回释放的页数。
+        """
+        from api.database import db_pool
+
+        if not self.incremental_vacuum:
+            return 0
+        async with db_pool.reader() as db:
+            mode = (await (await db.execute("PRAGMA auto_vacuum")).fetchone())[0]
+        if mode != AUTO_VACUUM_INCREMENTAL:
+            logging.warning(
+                "RETENTION_INCREMENTAL_VACUUM is enabled but the database is not in auto_vacuum=INCREMENTAL mode. "
+                "Run 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;' once while the service is stopped."
+            )
+            self.last_vacuum = {"result": "unsupported", "freed_pages": 0}
+            return 0
+
+        started = time.monotonic()
+        freed = 0
+        result = "complete"
+        while True:
+            if time.monotonic() - started >= self.time_budget:
+                result = "budget_exhausted"
+                break
+            async with db_pool.writer() as db:
+                before = (await (await db.execute("PRAGMA freelist_count")).fetchone())[0]
+                if before == 0:
+                    break
+                # incremental_vacuum 需要把语句执行完毕才会真正释放页
+                await (await db.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")).fetchall()
+                after = (await (await db.execute("PRAGMA freelist_count")).fetchone())[0]
+            freed += before - after
+            if after == 0 or after >= before:
+                break
+            await asyncio.sleep(self.pause)
+        self.last_vacuum = {"result": result, "freed_pages": freed, "elapsed_seconds": round(time.monotonic() - started, 3)}
+        logging.info(f"Incremental vacuum freed {freed} pages ({result}).")
+        return freed
+
+    def stats(self) -> dict:
+        return {
+            "chunk_rows": self.chunk_rows,
+            "chunk_pause_ms": self.pause * 1000,
+            "time_budget_seconds": self.time_budget,
+            "incremental_vacuum": self.incremental_vacuum,
+            "tables": self.last_runs,
+            "last_vacuum": self.last_vacuum,
+        }
+
+retention_engine = RetentionEngine()
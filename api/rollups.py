@@ -0,0 +1,231 @@
+"""
+调用统计的增量汇总表（rollup）。
+
+api_call_history 的每一次写入同时按 (时间桶, key_id, model_name, 状态类别) 累加到三张汇总表：
+- call_rollup_minute / call_rollup_hour：UTC 时间桶，格式与 api_call_history.timestamp 一致，可直接按字符串比较；
+- call_rollup_day：上海时区的自然日，与仪表盘和 monthly_stats 的统计口径一致。
+管理接口的统计、趋势与单密钥详情只读汇总表，不再扫描整张历史表。
+已有数据库升级后，用 `python -m api.rollups backfill` 补齐升级前的历史数据。
+"""
+import asyncio
+import datetime
+import logging
+import sys
+from collections import Counter
+from functools import lru_cache
+
+import aiosqlite
+
+# 汇总表名与对应的时间桶粒度
+MINUTE_TABLE = "call_rollup_minute"
+HOUR_TABLE = "call_rollup_hour"
+DAY_TABLE = "call_rollup_day"
+ROLLUP_TABLES = (MINUTE_TABLE, HOUR_TABLE, DAY_TABLE)
+
+# 回填进度保存在 config_settings 中：升级时的历史表最大 ID，以及已回填到的 ID
+BACKFILL_UNTIL_KEY = "ROLLUP_BACKFILL_UNTIL_ID"
+BACKFILL_CURSOR_KEY = "ROLLUP_BACKFILL_CURSOR_ID"
+# 每个回填事务处理的历史行数
+BACKFILL_CHUNK_ROWS = 50000
+
+# SQL 中与 status_class 等价的表达式，供回填使用
+STATUS_CLASS_SQL = """
+    CASE
+        WHEN identification_code IS NULL THEN 'other'
+        WHEN identification_code < 300 THEN '2xx'
+        WHEN identification_code < 500 THEN '4xx'
+        ELSE '5xx'
+    END
+"""
+
+def status_class(status_code: int | None) -> str:
+    """将状态码归入 2xx / 4xx / 5xx / other（无状态码，例如网络错误）。"""
+    if status_code is None:
+        return "other"
+    if status_code < 300:
+        return "2xx"
+    if status_code < 500:
+        return "4xx"
+    return "5xx"
+
+def minute_bucket(timestamp: str) -> str:
+    """'YYYY-MM-DD HH:MM:SS' -> 所在分钟的起点。"""
+    return timestamp[:16] + ":00"
+
+def hour_bucket(timestamp: str) -> str:
+    """'YYYY-MM-DD HH:MM:SS' -> 所在小时的起点。"""
+    return timestamp[:13] + ":00:00"
+
+@lru_cache(maxsize=1024)
+def day_bucket(hour: str) -> str:
+    """UTC 小时桶 -> 上海时区的日期（整小时时差，因此小时桶不会跨日）。"""
+    utc = datetime.datetime.strptime(hour, "%Y-%m-%d %H:%M:%S")
+    return (utc + datetime.timedelta(hours=8)).strftime("%Y-%m-%d")
+
+def _upsert_sql(table: str) -> str:
+    return f"""
+        INSERT INTO {table} (bucket, key_id, model_name, status_class, call_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(bucket, key_id, model_name, status_class) DO UPDATE SET call_count = call_count + excluded.call_count
+    """
+
+async def create_rollup_tables(db: aiosqlite.Connection):
+    for table in ROLLUP_TABLES:
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                key_id INTEGER NOT NULL,
+                model_name TEXT NOT NULL,
+                status_class TEXT NOT NULL,
+                call_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, key_id, model_name, status_class)
+            ) WITHOUT ROWID
+        """)
+        await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_key ON {table} (key_id, bucket)")
+
+async def write_rollups(db: aiosqlite.Connection, minute_counts: Counter):
+    """
+    将按 (分钟桶, key_id, model_name, 状态类别) 聚合的计数累加到三张汇总表。
+    小时与日计数在内存中由分钟计数合并得到，每张表一次 executemany。
+    """
+    if not minute_counts:
+        return
+    hour_counts: Counter = Counter()
+    day_counts: Counter = Counter()
+    for (minute, key_id, model_name, klass), count in minute_counts.items():
+        hour = minute[:13] + ":00:00"
+        hour_counts[(hour, key_id, model_name, klass)] += count
+        day_counts[(day_bucket(hour), key_id, model_name, klass)] += count
+    for table, counts in ((MINUTE_TABLE, minute_counts), (HOUR_TABLE, hour_counts), (DAY_TABLE, day_counts)):
+        await db.executemany(_upsert_sql(table), [(*group, count) for group, count in counts.items()])
+
+async def init_backfill_marker(db: aiosqlite.Connection):
+    """
+    首次创建汇总表时记录历史表当前的最大 ID：此后的调用由写后队列实时累加，
+    之前的调用需要回填。已记录时不做任何修改（多个工作进程同时启动也只记录一次）。
+    """
+    await db.execute(
+        "INSERT OR IGNORE INTO config_settings (key, value) SELECT ?, CAST(COALESCE(MAX(id), 0) AS TEXT) FROM api_call_history",
+        (BACKFILL_UNTIL_KEY,)
+    )
+    await db.execute("INSERT OR IGNORE INTO config_settings (key, value) VALUES (?, '0')", (BACKFILL_CURSOR_KEY,))
+
+def _format_utc(moment: datetime.datetime) -> str:
+    return moment.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+async def count_since(db: aiosqlite.Connection, since: datetime.datetime, key_id: int | None = None) -> list[tuple[str, int]]:
+    """
+    返回自 since（精确到分钟）以来按模型分组的调用次数。
+    since 所在小时之后的完整小时读小时表，since 所在小时内的剩余部分读分钟表。
+    """
+    since_str = _format_utc(since)
+    since_hour = hour_bucket(since_str)
+    next_hour = _format_utc(datetime.datetime.strptime(since_hour, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=1))
+    key_filter = "AND key_id = ?" if key_id is not None else ""
+    key_params = (key_id,) if key_id is not None else ()
+    cursor = await db.execute(
+        f"""
+        SELECT model_name, SUM(call_count) FROM (
+            SELECT model_name, call_count FROM {HOUR_TABLE} WHERE bucket > ? {key_filter}
+            UNION ALL
+            SELECT model_name, call_count FROM {MINUTE_TABLE} WHERE bucket >= ? AND bucket < ? {key_filter}
+        )
+        GROUP BY model_name
+        """,
+        (since_hour, *key_params, minute_bucket(since_str), next_hour, *key_params)
+    )
+    return await cursor.fetchall()
+
+async def prune_rollups(minute_retention_hours: int, hour_retention_days: int) -> dict:
+    """删除过期的分钟与小时汇总；日汇总体积很小，永久保留。"""
+    from api.database import db_pool
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoffs = {
+        MINUTE_TABLE: _format_utc(now - datetime.timedelta(hours=max(2, minute_retention_hours))),
+        HOUR_TABLE: _format_utc(now - datetime.timedelta(days=max(1, hour_retention_days))),
+    }
+    deleted = {}
+    async with db_pool.writer() as db:
+        for table, cutoff in cutoffs.items():
+            cursor = await db.execute(f"DELETE FROM {table} WHERE bucket < ?", (cutoff,))
+            deleted[table] = cursor.rowcount
+    return deleted
+
+# --- 历史数据回填 ---
+
+async def backfill_status() -> dict:
+    from api.database import config_manager
+
+    until = int(await config_manager.get_config(BACKFILL_UNTIL_KEY) or 0)
+    cursor = int(await config_manager.get_config(BACKFILL_CURSOR_KEY) or 0)
+    return {"until_id": until, "cursor_id": cursor, "remaining_rows_upper_bound": max(0, until - cursor), "done": cursor >= until}
+
+async def backfill_rollups(chunk_rows: int = BACKFILL_CHUNK_ROWS) -> int:
+    """
+    将汇总表启用之前写入的调用历史（ID <= ROLLUP_BACKFILL_UNTIL_ID）累加到汇总表。
+    按 ID 分块，每块一个 IMMEDIATE 写事务：进度在事务内读取并与计数一同提交，
+    因此中断后可以重新运行，多个进程同时回填也不会重复计入；块与块之间让出写连接，
+    不阻塞在线的调用统计写入。返回本次扫描的历史 ID 数。
+    """
+    from api.database import config_manager, db_pool
+
+    processed = 0
+    while True:
+        async with db_pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                "SELECT key, value FROM config_settings WHERE key IN (?, ?)", (BACKFILL_UNTIL_KEY, BACKFILL_CURSOR_KEY)
+            )
+            progress = {key: int(value) for key, value in await cursor.fetchall()}
+            until = progress.get(BACKFILL_UNTIL_KEY, 0)
+            lower = progress.get(BACKFILL_CURSOR_KEY, 0)
+            if lower >= until:
+                break
+            upper = min(lower + chunk_rows, until)
+            for table, bucket_sql in (
+                (MINUTE_TABLE, "strftime('%Y-%m-%d %H:%M:00', timestamp)"),
+                (HOUR_TABLE, "strftime('%Y-%m-%d %H:00:00', timestamp)"),
+                (DAY_TABLE, "date(timestamp, '+8 hours')"),
+            ):
+                await db.execute(
+                    f"""
+                    INSERT INTO {table} (bucket, key_id, model_name, status_class, call_count)
+                    SELECT {bucket_sql}, key_id, model_name, {STATUS_CLASS_SQL}, COUNT(*)
+                    FROM api_call_history
+                    WHERE id > ? AND id <= ? AND model_name IS NOT NULL AND timestamp IS NOT NULL
+                    GROUP BY 1, 2, 3, 4
+                    ON CONFLICT(bucket, key_id, model_name, status_class) DO UPDATE SET call_count = call_count + excluded.call_count
+                    """,
+                    (lower, upper)
+                )
+            await db.execute("UPDATE config_settings SET value = ? WHERE key = ?", (str(upper), BACKFILL_CURSOR_KEY))
+        config_manager.update_cache(BACKFILL_CURSOR_KEY, str(upper))
+        processed += upper - lower
+        logging.info(f"Rollup backfill progressed to history ID {upper}/{until}.")
+        await asyncio.sleep(0)
+    return processed
+
+async def _backfill_main():
+    from api.database import db_pool, config_manager
+
+    await db_pool.open()
+    try:
+        await config_manager.load()
+        if config_manager.get_cached(BACKFILL_UNTIL_KEY) is None:
+            print("Rollup tables are not initialized. Start the service once with this version, then run the backfill.")
+            return
+        status = await backfill_status()
+        if status["done"]:
+            print("Rollup tables are already backfilled.")
+            return
+        processed = await backfill_rollups()
+        print(f"Backfilled rollups for history IDs up to {status['until_id']} ({processed} IDs scanned).")
+    finally:
+        await db_pool.close()
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python -m api.rollups backfill")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_backfill_main())
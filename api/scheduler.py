@@ -1,14 +1,18 @@
 import logging
 import httpx
 import asyncio
-import aiosqlite
 import os
+import socket
+import time
+import uuid
 from datetime import datetime, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from api.database import config_manager, DATABASE_URL, key_manager
+from api.database import config_manager, DATABASE_URL, key_manager, db_pool
 from api.admin import validate_gemini_key
+from api.config import SCHEDULER_LEASE_SECONDS, ROLLUP_MINUTE_RETENTION_HOURS, ROLLUP_HOUR_RETENTION_DAYS, RETENTION_INCREMENTAL_VACUUM
+from api.rollups import prune_rollups
+from api.retention import retention_engine
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class JobService:
@@ -16,24 +20,12 @@ class JobService:
         self.db_url = db_url
 
     async def get_invalid_keys_for_validation(self):
-        """获取数据库中所有标记为无效的密钥进行验证"""
-        async with aiosqlite.connect(self.db_url) as db:
-            cursor = await db.execute("SELECT id, key FROM api_keys WHERE is_valid = 0")
-            return await cursor.fetchall()
+        """获取所有标记为无效的密钥进行验证（以 KeyManager 的内存状态表为准）"""
+        return key_manager.invalid_keys()
 
     async def delete_old_logs(self, retention_days: int, table_name: str):
-        """从指定表中删除超过保留期限的日志（限制在白名单表名内）。"""
-        allowed_tables = {"error_logs", "api_call_history"}
-        if table_name not in allowed_tables:
-            logger.warning(f"Attempt to delete from non-allowed table: {table_name}. Skipped.")
-            return 0
-        async with aiosqlite.connect(self.db_url) as db:
-            # 使用参数占位符仅绑定保留天数，表名使用白名单硬编码避免注入
-            sql = f"DELETE FROM {table_name} WHERE timestamp < datetime('now', ?)"
-            cursor = await db.execute(sql, (f"-{retention_days} days",))
-            await db.commit()
-            logger.info(f"Deleted {cursor.rowcount} old records from {table_name}.")
-            return cursor.rowcount
+        """从指定表中分块删除超过保留期限的日志（限制在白名单表名内），每块之间让出写连接。"""
+        return await retention_engine.purge(table_name, retention_days)
 
 job_service = JobService()
 
@@ -43,6 +35,9 @@ async def validate_and_update_key(client, key_value, model):
     if is_valid:
         # 使用 KeyManager 记录成功，它会重置失败计数并记录调用
         await key_manager.record_success(key_value, model)
+    elif status_code == 429:
+        # 仅被限流：冷却隔离，不计入失败次数
+        await key_manager.record_rate_limited(key_value, model, None, message)
     else:
         # 使用 KeyManager 记录失败，它会增加失败计数、可能使密钥失效，并记录错误
         await key_manager.record_failure(key_value, model, status_code, message)
@@ -93,7 +88,7 @@ async def cleanup_request_logs():
 async def cleanup_expired_sessions():
     """定时任务：清理数据库中所有已过期的管理员会话。"""
     logger.info("Starting scheduled job: cleanup_expired_sessions")
-    async with aiosqlite.connect(DATABASE_URL) as db:
+    async with db_pool.writer() as db:
         # 直接删除 expires_at 早于当前时间的记录
         cursor = await db.execute(
             "DELETE FROM admin_sessions WHERE expires_at < ?",
@@ -103,15 +98,88 @@ async def cleanup_expired_sessions():
         if cursor.rowcount > 0:
             logger.info(f"Cleaned up {cursor.rowcount} expired admin sessions.")
 
+async def cleanup_rollups():
+    """定时任务：清理过期的分钟与小时调用汇总。"""
+    logger.info("Starting scheduled job: cleanup_rollups")
+    deleted = await prune_rollups(ROLLUP_MINUTE_RETENTION_HOURS, ROLLUP_HOUR_RETENTION_DAYS)
+    logger.info(f"Pruned rollup rows: {deleted}.")
+
+async def vacuum_after_cleanup():
+    """定时任务：日志清理后分步归还数据库文件中的空闲页。"""
+    logger.info("Starting scheduled job: vacuum_after_cleanup")
+    await retention_engine.vacuum()
+
 
 # --- 调度器设置与控制 ---
 scheduler = None
-# 在单进程模式下，主进程自动成为领导者。
+# 多个工作进程（uvicorn --workers）共享同一个数据库，通过租约保证只有一个进程运行定时任务。
+
+# 本进程的租约持有者标识
+_instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_is_leader = False
+_election_task: asyncio.Task | None = None
+
+async def _try_acquire_lease() -> bool:
+    """
+    尝试获取或续期调度器租约（scheduler_lease 表中的单行）。
+    租约不存在、已过期或已由本进程持有时写入成功；返回本进程当前是否为领导者。
+    """
+    now = time.time()
+    async with db_pool.writer() as db:
+        await db.execute(
+            """
+            INSERT INTO scheduler_lease (id, holder, expires_at) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE scheduler_lease.expires_at < ? OR scheduler_lease.holder = excluded.holder
+            """,
+            (_instance_id, now + SCHEDULER_LEASE_SECONDS, now)
+        )
+        cursor = await db.execute("SELECT holder FROM scheduler_lease WHERE id = 1")
+        row = await cursor.fetchone()
+    return bool(row) and row[0] == _instance_id
+
+async def _leader_election_loop():
+    """定期续期租约；领导者失效后由其他进程接管，失去租约的进程停止调度器。"""
+    global _is_leader, scheduler
+    while True:
+        await asyncio.sleep(SCHEDULER_LEASE_SECONDS / 3)
+        try:
+            leader = await _try_acquire_lease()
+        except Exception as e:
+            logger.error(f"Scheduler lease renewal failed: {e}")
+            leader = False
+        if leader and not _is_leader:
+            logger.info(f"Process {os.getpid()} acquired the scheduler lease.")
+            _is_leader = True
+            await start_scheduler()
+        elif not leader and _is_leader:
+            logger.warning(f"Process {os.getpid()} lost the scheduler lease. Stopping scheduler.")
+            _is_leader = False
+            stop_scheduler()
+            scheduler = None
+
+async def _is_process_leader():
+    """通过数据库租约选举领导者：多个工作进程中只有一个运行 APScheduler。"""
+    global _is_leader, _election_task
+    if _election_task is None or _election_task.done():
+        _is_leader = await _try_acquire_lease()
+        _election_task = asyncio.create_task(_leader_election_loop())
+        if _is_leader:
+            logger.info(f"Process {os.getpid()} is the scheduler leader.")
+        else:
+            logger.info(f"Process {os.getpid()} is a follower. Another worker runs the scheduler.")
+    return _is_leader
 
-def _is_process_leader():
-    """在单进程模式下，当前进程始终是领导者。"""
-    logger.info(f"Running in single-process mode. Process {os.getpid()} is the leader.")
-    return True
+async def release_scheduler_lease():
+    """进程退出时停止选举并释放租约，让其他进程无需等待租约过期即可接管。"""
+    global _is_leader, _election_task
+    if _election_task is not None:
+        _election_task.cancel()
+        _election_task = None
+    if _is_leader:
+        _is_leader = False
+        async with db_pool.writer() as db:
+            await db.execute("DELETE FROM scheduler_lease WHERE id = 1 AND holder = ?", (_instance_id,))
 
 async def get_scheduler():
     global scheduler
@@ -174,6 +242,25 @@ async def setup_scheduler():
         misfire_grace_time=None,
         coalesce=True,
     )
+    sch.add_job(
+        cleanup_rollups,
+        "cron",
+        hour=3,
+        minute=15,
+        id="cleanup_rollups_job",
+        misfire_grace_time=None,
+        coalesce=True,
+    )
+    if RETENTION_INCREMENTAL_VACUUM:
+        sch.add_job(
+            vacuum_after_cleanup,
+            "cron",
+            hour=3,
+            minute=20,
+            id="vacuum_after_cleanup_job",
+            misfire_grace_time=None,
+            coalesce=True,
+        )
     logger.info(
         "Scheduler jobs configured with misfire_grace_time=None and coalesce=True."
     )
@@ -181,7 +268,7 @@ async def setup_scheduler():
 
 async def start_scheduler():
     """启动调度器，但仅在当前进程是“领导者”时启动。"""
-    if not _is_process_leader():
+    if not await _is_process_leader():
         return
 
     sch = await get_scheduler()
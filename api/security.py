@@ -5,26 +5,40 @@
 """
 from fastapi import Request
 import secrets
-import aiosqlite
 from datetime import datetime, timedelta, timezone
-from api.database import config_manager, DATABASE_URL
-from api.exceptions import AuthenticationError
+from api.database import config_manager, db_pool
+from api.exceptions import AuthenticationError, NotFoundError
+from api.config import METRICS_TOKEN
+from api.utils import split_access_keys
 
 class SecurityService:
     """
     封装了所有与安全相关的操作。
-    密钥从数据库中实时获取，以确保更新后立即生效。
+    访问密钥被预编译为 frozenset，仅在配置快照版本变化时重建，以确保更新后立即生效。
     """
 
     SESSION_DURATION_HOURS = 2
 
+    def __init__(self):
+        self._access_keys: frozenset[str] = frozenset()
+        # 与 config_manager.version 比较；-1 表示尚未编译
+        self._access_keys_version = -1
+
+    def _compile_access_keys(self) -> frozenset[str]:
+        """按需重建访问密钥集合。配置未变化时直接返回已编译的集合。"""
+        version = config_manager.version
+        if version != self._access_keys_version:
+            self._access_keys = frozenset(split_access_keys(config_manager.get_cached("ACCESS_KEY")))
+            self._access_keys_version = version
+        return self._access_keys
+
     async def create_admin_session(self) -> str:
         """创建并存储一个新的管理员会话令牌"""
         token = secrets.token_hex(32)
         now = datetime.now(timezone.utc)
         expires_at = now + timedelta(hours=self.SESSION_DURATION_HOURS)
         
-        async with aiosqlite.connect(DATABASE_URL) as db:
+        async with db_pool.writer() as db:
             await db.execute(
                 "INSERT INTO admin_sessions (token, expires_at) VALUES (?, ?)",
                 (token, expires_at.isoformat())
@@ -34,7 +48,7 @@ class SecurityService:
 
     async def delete_admin_session(self, token: str):
         """删除一个管理员会话令牌"""
-        async with aiosqlite.connect(DATABASE_URL) as db:
+        async with db_pool.writer() as db:
             await db.execute("DELETE FROM admin_sessions WHERE token = ?", (token,))
             await db.commit()
 
@@ -45,17 +59,13 @@ class SecurityService:
         
         如果验证失败，则会引发 AuthenticationError。
         """
-        access_key_str = await config_manager.get_config("ACCESS_KEY")
-        if not access_key_str:
-            raise AuthenticationError("Access key is not configured in the database.")
-        
-        access_keys = [key.strip() for key in access_key_str.split(',') if key.strip()]
+        access_keys = self._compile_access_keys()
         if not access_keys:
             raise AuthenticationError("No valid access keys configured.")
 
         auth_header = request.headers.get('authorization')
         if auth_header and auth_header.lower().startswith('bearer '):
-            token = auth_header.split(' ', 1)[1]
+            token = auth_header[7:]
         elif 'key' in request.query_params:
             token = request.query_params['key']
         else:
@@ -64,6 +74,26 @@ class SecurityService:
         if not token or token not in access_keys:
             raise AuthenticationError("Invalid or missing access key.")
 
+        # 供下游按访问密钥计量（例如对冲预算）
+        request.state.access_key = token
+
+    async def verify_metrics_token(self, request: Request):
+        """
+        验证 /metrics 的抓取令牌（Bearer Token 或 URL Query 'token'），与访问密钥和管理员会话相互独立。
+        未配置 METRICS_TOKEN 时该端点视为不存在。
+        """
+        if not METRICS_TOKEN:
+            raise NotFoundError()
+
+        auth_header = request.headers.get('authorization')
+        if auth_header and auth_header.lower().startswith('bearer '):
+            token = auth_header[7:]
+        else:
+            token = request.query_params.get('token')
+
+        if not token or not secrets.compare_digest(token, METRICS_TOKEN):
+            raise AuthenticationError("Invalid or missing metrics token.")
+
     async def verify_admin_key_from_cookie(self, request: Request):
         """
         从请求的 Cookie 中提取并验证管理员会话令牌。
@@ -72,7 +102,7 @@ class SecurityService:
         if not token:
             raise AuthenticationError("Admin session token not found in cookie.")
 
-        async with aiosqlite.connect(DATABASE_URL) as db:
+        async with db_pool.reader() as db:
             cursor = await db.execute(
                 "SELECT expires_at FROM admin_sessions WHERE token = ?", (token,)
             )
@@ -0,0 +1,213 @@
+"""
+相同并发上游请求的合并（single-flight）。
+
+按规范化请求哈希识别进行中的相同请求：第一个请求发往上游，其余请求挂在同一个调用上共享结果。
+非流式响应为每个订阅者复制一份响应对象。流式响应只有一个请求时原样返回；多个请求时由一个后台任务
+读取上游，分块分发到各订阅者的有界队列中（速度跟随最慢的订阅者），只合并在第一个分块产生之前到达的请求。
+"""
+import asyncio
+import logging
+import weakref
+from typing import Awaitable, Callable
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+class _SharedResponse:
+    """非流式响应：每个订阅者得到一个独立的 Response 对象，共享同一份响应体。"""
+    accepting = True
+
+    def __init__(self, response: Response):
+        self._response = response
+
+    def response_for(self, coalesced: bool) -> Response:
+        headers = dict(self._response.headers)
+        if coalesced:
+            headers["X-Coalesced"] = "true"
+        return Response(content=self._response.body, status_code=self._response.status_code, headers=headers)
+
+# 流式分块队列中的结束标记
+_END = object()
+
+async def _discard_stream(response: StreamingResponse):
+    """
+    丢弃从未被迭代的上游流式响应。未开始的异步生成器在 aclose 时不会执行其 finally，
+    因此先推进一步，再关闭，使生成器负责的连接关闭与密钥释放得以执行。
+    """
+    body = response.body_iterator
+    try:
+        await body.__anext__()
+    except StopAsyncIteration:
+        return
+    except Exception as e:
+        logging.debug(f"Discarded upstream stream failed: {e}")
+        return
+    await body.aclose()
+
+class _SoleStream:
+    """只有一个请求的流式响应：原样返回上游的 StreamingResponse，保留逐块透传的背压。"""
+    accepting = False
+
+    def __init__(self, response: StreamingResponse):
+        self._response = response
+
+    def response_for(self, coalesced: bool) -> StreamingResponse:
+        return self._response
+
+class _Subscriber:
+    __slots__ = ("queue", "started")
+
+    def __init__(self, backlog: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=backlog)
+        self.started = False
+
+class _SharedStream:
+    """
+    多个请求共享的流式响应：由后台任务读取一次上游，把每个分块放入各订阅者自己的有界队列。
+    读取速度跟随最慢的订阅者（队列满时等待），不会因为客户端较慢而中途断开它。
+    只有在第一个分块产生之前加入的请求才会被合并，因此无需保留已经发出的分块。
+    所有订阅者都断开（或其响应从未被迭代就被丢弃）后停止读取并关闭上游，及时释放连接与密钥。
+    """
+    # 每个订阅者队列的容量（分块数）
+    MAX_BACKLOG = 64
+
+    def __init__(self, response: StreamingResponse):
+        self._response = response
+        self._subscribers: set[_Subscriber] = set()
+        self._started = False
+        self._closed = False
+        self._pump_task: asyncio.Task | None = None
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def accepting(self) -> bool:
+        """第一个分块产生之前、且上游仍在读取时才能加入。"""
+        return not self._started and not self._closed
+
+    async def _pump(self):
+        try:
+            async for chunk in self._response.body_iterator:
+                self._started = True
+                for subscriber in list(self._subscribers):
+                    await subscriber.queue.put(chunk)
+                if not self._subscribers:
+                    break
+        except Exception as e:
+            logging.warning(f"Shared upstream stream failed: {e}")
+            for subscriber in list(self._subscribers):
+                await subscriber.queue.put(e)
+        finally:
+            self._closed = True
+            for subscriber in list(self._subscribers):
+                await subscriber.queue.put(_END)
+            await self._response.body_iterator.aclose()
+
+    def _unsubscribe(self, subscriber: _Subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        # 清空队列，唤醒可能正阻塞在该队列上的读取任务
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        if self._subscribers or self._closed:
+            return
+        # 没有订阅者了：停止读取上游，不再为无人接收的响应占用连接与密钥
+        self._closed = True
+        if self._pump_task is not None:
+            if not self._pump_task.done():
+                self._pump_task.cancel()
+        elif not self._loop.is_closed():
+            self._loop.create_task(_discard_stream(self._response))
+
+    def _abandon(self, subscriber: _Subscriber):
+        """订阅者的 StreamingResponse 被回收：从未开始迭代时其生成器的 finally 不会执行，在此退订。"""
+        if not subscriber.started:
+            self._loop.call_soon_threadsafe(self._unsubscribe, subscriber)
+
+    async def _subscribe(self, subscriber: _Subscriber):
+        subscriber.started = True
+        if self._pump_task is None and not self._closed:
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            while True:
+                item = await subscriber.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._unsubscribe(subscriber)
+
+    def response_for(self, coalesced: bool) -> StreamingResponse:
+        headers = dict(self._response.headers)
+        if coalesced:
+            headers["X-Coalesced"] = "true"
+        subscriber = _Subscriber(self.MAX_BACKLOG)
+        self._subscribers.add(subscriber)
+        response = StreamingResponse(self._subscribe(subscriber), status_code=self._response.status_code, headers=headers)
+        weakref.finalize(response, self._abandon, subscriber)
+        return response
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        # 每个进行中的调用上仍在等待结果的请求数（发起者与合并者）
+        self._waiters: dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Response]]):
+        response = await fn()
+        if isinstance(response, StreamingResponse):
+            waiters = self._waiters.get(key, 0)
+            if waiters == 0:
+                # 所有请求都已断开，没有人会迭代这个响应
+                await _discard_stream(response)
+            if waiters <= 1:
+                return _SoleStream(response)
+            return _SharedStream(response)
+        return _SharedResponse(response)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+        # 所有订阅者都已断开时，避免 "Task exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        执行 fn 或加入进行中的相同调用。上游调用运行在独立任务中，
+        发起者断开连接不会影响其他订阅者。
+        """
+        task = self._calls.get(key)
+        if task is not None and task.done():
+            # 已完成但尚未移除的调用不再接受合并
+            task = None
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.create_task(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            shared = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+            raise
+        if coalesced and not shared.accepting:
+            # 等待期间共享流已开始输出（或已结束、或只为一个请求返回了原始响应）：改为发起或加入新的调用
+            self.coalesced -= 1
+            return await self.do(key, fn)
+        return shared.response_for(coalesced)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "upstream_calls": self.leaders, "coalesced_requests": self.coalesced}
+
+single_flight = SingleFlight()
@@ -0,0 +1,233 @@
+"""
+上游 HTTP 传输层。
+
+流式与非流式（unary）请求使用两个独立的连接池，避免长时间的 SSE 生成占满连接、
+阻塞短请求。安装了 h2 时启用 HTTP/2 多路复用，并发请求共享少量长连接，
+不再因 keepalive 不足而频繁重建 TLS 连接。连接池参数与超时可通过管理接口热更新。
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+
+from api.config import (
+    UPSTREAM_HTTP2, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, UPSTREAM_POOL_TIMEOUT,
+    UPSTREAM_KEEPALIVE_EXPIRY, UPSTREAM_STREAM_MAX_CONNECTIONS, UPSTREAM_STREAM_MAX_KEEPALIVE,
+    UPSTREAM_UNARY_MAX_CONNECTIONS, UPSTREAM_UNARY_MAX_KEEPALIVE, UPSTREAM_RETIRE_TIMEOUT,
+)
+from api.database import config_manager
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class PoolStats:
+    """单个连接池的占用统计，所有更新都在事件循环线程内进行。"""
+    __slots__ = ("max_connections", "in_flight", "peak_in_flight", "requests", "saturated", "pool_timeouts", "total_ttfb")
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated = 0
+        self.pool_timeouts = 0
+        self.total_ttfb = 0.0
+
+    def acquire(self):
+        # HTTP/1.1 下在途请求数达到连接上限时，新请求只能排队等待空闲连接
+        if self.in_flight >= self.max_connections:
+            self.saturated += 1
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+
+    def as_dict(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(self.in_flight / self.max_connections, 3) if self.max_connections else None,
+            "requests": self.requests,
+            "saturated_requests": self.saturated,
+            "pool_timeouts": self.pool_timeouts,
+            "avg_ttfb_ms": round(self.total_ttfb / self.requests * 1000, 2) if self.requests else 0.0,
+        }
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """包装上游响应体：响应关闭时释放连接池占用计数。"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, stats: PoolStats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._stats.release()
+        await self._stream.aclose()
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """统计在途请求、饱和次数与首字节时间的传输层。"""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.acquire()
+        started = time.monotonic()
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            self.stats.pool_timeouts += 1
+            self.stats.release()
+            raise
+        except BaseException:
+            self.stats.release()
+            raise
+        self.stats.total_ttfb += time.monotonic() - started
+        response.stream = _TrackedStream(response.stream, self.stats)
+        return response
+
+def _setting(key: str, default, cast):
+    value = config_manager.get_cached(key)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid value for {key}: {value!r}. Using default {default!r}.")
+        return default
+
+def _as_bool(value: str) -> bool:
+    return str(value).lower() == "true"
+
+def load_upstream_settings() -> dict:
+    """读取传输层配置：数据库中的设置优先，其次为环境变量默认值。"""
+    return {
+        "http2": _setting("UPSTREAM_HTTP2", UPSTREAM_HTTP2, _as_bool),
+        "connect_timeout": _setting("UPSTREAM_CONNECT_TIMEOUT", UPSTREAM_CONNECT_TIMEOUT, float),
+        "read_timeout": _setting("UPSTREAM_READ_TIMEOUT", UPSTREAM_READ_TIMEOUT, float),
+        "pool_timeout": _setting("UPSTREAM_POOL_TIMEOUT", UPSTREAM_POOL_TIMEOUT, float),
+        "keepalive_expiry": _setting("UPSTREAM_KEEPALIVE_EXPIRY", UPSTREAM_KEEPALIVE_EXPIRY, float),
+        "stream_max_connections": _setting("UPSTREAM_STREAM_MAX_CONNECTIONS", UPSTREAM_STREAM_MAX_CONNECTIONS, int),
+        "stream_max_keepalive": _setting("UPSTREAM_STREAM_MAX_KEEPALIVE", UPSTREAM_STREAM_MAX_KEEPALIVE, int),
+        "unary_max_connections": _setting("UPSTREAM_UNARY_MAX_CONNECTIONS", UPSTREAM_UNARY_MAX_CONNECTIONS, int),
+        "unary_max_keepalive": _setting("UPSTREAM_UNARY_MAX_KEEPALIVE", UPSTREAM_UNARY_MAX_KEEPALIVE, int),
+    }
+
+class UpstreamPool:
+    """一个带统计的 httpx.AsyncClient。"""
+
+    def __init__(self, name: str, settings: dict, max_connections: int, max_keepalive: int):
+        self.name = name
+        self.stats = PoolStats(max_connections)
+        http2 = settings["http2"] and HTTP2_AVAILABLE
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=settings["keepalive_expiry"],
+        )
+        timeout = httpx.Timeout(
+            connect=settings["connect_timeout"],
+            read=settings["read_timeout"],
+            write=settings["read_timeout"],
+            pool=settings["pool_timeout"],
+        )
+        self.http2 = http2
+        self.client = httpx.AsyncClient(
+            transport=MeteredTransport(self.stats, http2=http2, limits=limits),
+            timeout=timeout,
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+class UpstreamClients:
+    """管理流式与非流式两个连接池，支持在不中断在途请求的情况下重建。"""
+
+    def __init__(self):
+        self.stream: UpstreamPool | None = None
+        self.unary: UpstreamPool | None = None
+        self.settings: dict = {}
+        # 正在等待在途请求结束的旧连接池
+        self._retiring: dict[asyncio.Task, UpstreamPool] = {}
+
+    def _build(self):
+        settings = load_upstream_settings()
+        if settings["http2"] and not HTTP2_AVAILABLE:
+            logging.warning("UPSTREAM_HTTP2 is enabled but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        self.settings = settings
+        self.stream = UpstreamPool("stream", settings, settings["stream_max_connections"], settings["stream_max_keepalive"])
+        self.unary = UpstreamPool("unary", settings, settings["unary_max_connections"], settings["unary_max_keepalive"])
+        logging.info(f"Upstream clients ready (HTTP/2: {self.stream.http2}, stream pool: {settings['stream_max_connections']}, unary pool: {settings['unary_max_connections']}).")
+
+    async def start(self):
+        self._build()
+
+    def client_for(self, streaming: bool) -> httpx.AsyncClient:
+        pool = self.stream if streaming else self.unary
+        assert pool is not None, "Upstream clients not initialized."
+        return pool.client
+
+    async def _retire(self, pool: UpstreamPool, timeout: float = UPSTREAM_RETIRE_TIMEOUT):
+        """
+        等待旧连接池上的在途请求（包括长时间的流式响应）结束后再关闭。
+        超过 timeout 秒仍未结束（例如响应体泄漏、从未关闭）时强制关闭，不让旧连接池永久驻留。
+        """
+        deadline = time.monotonic() + timeout
+        while pool.stats.in_flight > 0:
+            if time.monotonic() >= deadline:
+                logging.warning(f"Closing retired {pool.name} pool with {pool.stats.in_flight} requests still in flight after {timeout:.0f}s.")
+                break
+            await asyncio.sleep(1)
+        await pool.aclose()
+
+    async def reconfigure(self):
+        """按最新配置重建连接池；新请求立即使用新连接池，旧连接池在请求结束后关闭。"""
+        old_pools = [pool for pool in (self.stream, self.unary) if pool is not None]
+        self._build()
+        for pool in old_pools:
+            task = asyncio.create_task(self._retire(pool))
+            self._retiring[task] = pool
+            task.add_done_callback(lambda t: self._retiring.pop(t, None))
+
+    async def close(self):
+        for task, pool in list(self._retiring.items()):
+            task.cancel()
+            await pool.aclose()
+        for pool in (self.stream, self.unary):
+            if pool is not None:
+                await pool.aclose()
+        self.stream = self.unary = None
+
+    def stats(self) -> dict:
+        return {
+            "http2": bool(self.stream and self.stream.http2),
+            "http2_available": HTTP2_AVAILABLE,
+            "pools": {pool.name: pool.stats.as_dict() for pool in (self.stream, self.unary) if pool is not None},
+            "retiring_pools": len(self._retiring),
+        }
+
+    def pool_metrics(self) -> dict[tuple, float]:
+        """供 /metrics 抓取时读取的连接池占用。"""
+        values = {}
+        for pool in (self.stream, self.unary):
+            if pool is not None:
+                values[(pool.name, "in_flight")] = pool.stats.in_flight
+                values[(pool.name, "max_connections")] = pool.stats.max_connections
+        return values
+
+upstream_clients = UpstreamClients()
@@ -2,4 +2,10 @@ def create_partial_key(key: str) -> str:
     """为过长的密钥创建一个部分视图，例如 'sk-12...ab'"""
     if not key or len(key) <= 8:
         return "Not Set or Too Short"
-    return f"{key[:4]}...{key[-4:]}"
\ No newline at end of file
+    return f"{key[:4]}...{key[-4:]}"
+
+def split_access_keys(value: str | None) -> list[str]:
+    """将逗号分隔的 ACCESS_KEY 字符串解析为去除空白后的密钥列表"""
+    if not value:
+        return []
+    return [key.strip() for key in value.split(',') if key.strip()]
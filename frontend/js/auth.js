@@ -8,6 +8,10 @@ export async function logout() {
   } catch (_) {
   } finally {
     appState.isLoggedIn = false;
+    if (appState.dashboardStream) {
+      appState.dashboardStream.close();
+      appState.dashboardStream = null;
+    }
     checkAuth();
   }
 }
@@ -27,8 +27,12 @@ export const appState = {
   pagination: {
     valid: { currentPage: 1, pageSize: 10 },
     invalid: { currentPage: 1, pageSize: 10 },
-    error_logs: { currentPage: 1, pageSize: 50 },
+    // 错误日志按游标分页：cursors[i] 为第 i + 1 页的起始游标
+    error_logs: { currentPage: 1, pageSize: 50, cursors: [null], nextCursor: null },
   },
+  // 最近一次的统计数据，仪表盘增量推送在其基础上合并
+  lastStats: null,
+  dashboardStream: null,
   apiTrendChart: null,
   lastTrendData: null,
 };
@@ -24,6 +24,7 @@ export async function fetchData() {
     if (!response.ok) throw new Error(`获取仪表盘数据失败 (状态: ${response.status})`);
     const data = await response.json();
 
+    appState.lastStats = data.stats;
     updateDashboardStats(data.stats);
 
     appState.allKeys = data.keys;
@@ -32,24 +33,10 @@ export async function fetchData() {
 
     renderAccessKeys(data.access_keys);
 
-    const errorData = data.error_logs;
-    const errorTbody = document.getElementById('error-logs-tbody');
-    appState.pagination.error_logs.currentPage = errorData.current_page;
-    if (errorData.logs.length === 0) {
-      errorTbody.innerHTML = '<tr><td colspan="4" style="text-align: center;">暂无错误日志</td></tr>';
-    } else {
-      errorTbody.innerHTML = '';
-      errorData.logs.forEach((log) => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
-          <td>${log.key_partial}</td>
-          <td>${log.model_name || 'N/A'}</td>
-          <td>${log.identification_code !== null ? log.identification_code : 'N/A'}</td>
-          <td>${formatTimestamp(log.timestamp)}</td>`;
-        errorTbody.appendChild(row);
-      });
-    }
-    renderErrorLogsPagination(errorData.total_pages);
+    const errorState = appState.pagination.error_logs;
+    errorState.currentPage = 1;
+    errorState.cursors = [null];
+    renderErrorLogs(data.error_logs);
 
     const { api_config } = data;
     const apiForm = document.getElementById('api-config-form');
@@ -70,6 +57,7 @@ export async function fetchData() {
       : '请设置一个管理员密钥';
 
     fetchAndRenderTrendChart();
+    connectDashboardStream();
     return { ok: true };
   } catch (err) {
     showError(err.message);
@@ -77,45 +65,87 @@ export async function fetchData() {
   }
 }
 
+// 仪表盘增量推送：统计与密钥状态的变化由服务器推送，不必反复加载整个仪表盘
+function connectDashboardStream() {
+  if (appState.dashboardStream) return;
+  const evtSource = new EventSource('/admin/dashboard/stream');
+  appState.dashboardStream = evtSource;
+  evtSource.onmessage = (event) => applyDashboardDelta(JSON.parse(event.data));
+  evtSource.onerror = () => {
+    // 浏览器会自动重连；连接被拒绝（例如会话失效）时不再重试，下次加载仪表盘时重新连接
+    if (evtSource.readyState === EventSource.CLOSED) appState.dashboardStream = null;
+  };
+}
+
+function applyDashboardDelta(delta) {
+  if (delta.stats && appState.lastStats) {
+    appState.lastStats = { ...appState.lastStats, ...delta.stats };
+    updateDashboardStats(appState.lastStats);
+  }
+  if (delta.keys || delta.removed_keys) {
+    const removed = new Set(delta.removed_keys || []);
+    const byId = new Map(appState.allKeys.filter((k) => !removed.has(k.id)).map((k) => [k.id, k]));
+    (delta.keys || []).forEach((info) => byId.set(info.id, { ...byId.get(info.id), ...info }));
+    appState.allKeys = [...byId.values()].sort((a, b) => a.id - b.id);
+    renderPaginatedKeys('valid');
+    renderPaginatedKeys('invalid');
+  }
+}
+
 // Error logs (merged from errorLogs.js)
 export async function fetchErrorLogs(page = 1) {
   const tbody = document.getElementById('error-logs-tbody');
-  const pageSize = appState.pagination.error_logs.pageSize;
+  const state = appState.pagination.error_logs;
+  // 只能跳转到已知起始游标的页：第一页、已访问过的页以及当前页的下一页
+  if (page > state.cursors.length) page = 1;
+  const cursor = state.cursors[page - 1];
   try {
     tbody.innerHTML = `<tr><td colspan="4" style="text-align: center;" aria-busy="true">加载中...</td></tr>`;
-    const response = await fetch(`/admin/error-logs?page=${page}&size=${pageSize}`);
+    const params = new URLSearchParams({ size: state.pageSize });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`/admin/error-logs?${params}`);
     if (!response.ok) throw new Error('获取错误日志失败');
     const data = await response.json();
-    appState.pagination.error_logs.currentPage = data.current_page;
-    if (data.logs.length === 0) {
-      tbody.innerHTML = '<tr><td colspan="4" style="text-align: center;">暂无错误日志</td></tr>';
-    } else {
-      tbody.innerHTML = '';
-      data.logs.forEach((log) => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
-          <td>${log.key_partial}</td>
-          <td>${log.model_name || 'N/A'}</td>
-          <td>${log.identification_code !== null ? log.identification_code : 'N/A'}</td>
-          <td>${formatTimestamp(log.timestamp)}</td>`;
-        tbody.appendChild(row);
-      });
-    }
-    renderErrorLogsPagination(data.total_pages);
+    state.currentPage = page;
+    state.cursors = state.cursors.slice(0, page);
+    renderErrorLogs(data);
   } catch (err) {
     tbody.innerHTML = `<tr><td colspan="4" style="color: var(--pico-color-red-500); text-align: center;">${err.message}</td></tr>`;
   }
 }
 
-export function renderErrorLogsPagination(totalPages) {
+function renderErrorLogs(data) {
+  const tbody = document.getElementById('error-logs-tbody');
+  const state = appState.pagination.error_logs;
+  state.nextCursor = data.next_cursor;
+  if (data.next_cursor) state.cursors[state.currentPage] = data.next_cursor;
+  if (data.logs.length === 0) {
+    tbody.innerHTML = '<tr><td colspan="4" style="text-align: center;">暂无错误日志</td></tr>';
+  } else {
+    tbody.innerHTML = '';
+    data.logs.forEach((log) => {
+      const row = document.createElement('tr');
+      row.innerHTML = `
+        <td>${log.key_partial}</td>
+        <td>${log.model_name || 'N/A'}</td>
+        <td>${log.identification_code !== null ? log.identification_code : 'N/A'}</td>
+        <td>${formatTimestamp(log.timestamp)}</td>`;
+      tbody.appendChild(row);
+    });
+  }
+  renderErrorLogsPagination(data.total_estimate, data.total_is_exact);
+}
+
+export function renderErrorLogsPagination(totalEstimate, totalIsExact) {
   const container = document.getElementById('error-logs-pagination');
-  const currentPage = appState.pagination.error_logs.currentPage;
+  const { currentPage, pageSize, nextCursor } = appState.pagination.error_logs;
   container.innerHTML = '';
-  if (totalPages <= 1) return;
+  if (currentPage === 1 && !nextCursor) return;
+  const totalPages = Math.ceil(totalEstimate / pageSize);
   let buttons = '';
   if (currentPage > 1) buttons += `<button data-page="${currentPage - 1}">上一页</button>`;
-  buttons += `<span>第 ${currentPage} / ${totalPages} 页</span>`;
-  if (currentPage < totalPages) buttons += `<button data-page="${currentPage + 1}">下一页</button>`;
+  buttons += `<span>第 ${currentPage} / ${totalPages}${totalIsExact ? '' : '+'} 页</span>`;
+  if (nextCursor) buttons += `<button data-page="${currentPage + 1}">下一页</button>`;
   container.innerHTML = buttons;
 }
 
@@ -24,6 +24,9 @@ GOOGLE_API_KEYS="your_gemini_key_1,your_gemini_key_2"
 
 # 数据库文件路径
 DATABASE_URL="data.db"
+
+# 工作进程数，0 表示使用全部 CPU 核心
+WORKERS=1
 """
 
 if __name__ == '__main__':
@@ -60,10 +63,17 @@ if __name__ == '__main__':
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8008))
 
+    # 工作进程数由 api.config 统一解析（WORKERS / WEB_CONCURRENCY，0 表示使用全部 CPU 核心），
+    # 解析结果写回环境变量，工作进程导入配置时得到相同的值
+    from api.config import WORKERS as workers
+    os.environ["WORKERS"] = str(workers)
+
     print(f"--- Gemini Synapse ---")
     print(f"服务将监听在: {host}:{port}")
+    print(f"工作进程数: {workers}")
     
     # --- 启动 Uvicorn 服务 ---
     # "api.index:app" 指的是 api/index.py 文件中的 app 实例
     # reload=False 在生产/打包环境中是必须的
-    uvicorn.run("api.index:app", host=host, port=port, reload=False)
\ No newline at end of file
+    # 多个工作进程时，仅持有数据库租约的进程运行定时任务，各进程的配置与密钥状态通过数据库同步
+    uvicorn.run("api.index:app", host=host, port=port, reload=False, workers=workers)
\ No newline at end of file